@@ -0,0 +1,285 @@
+# Server-side aggregation for the graphs
+# -----------------------------------------------------------------------------------------------
+#
+# The distribution graphs are drawn as go.Bar traces from these aggregates, so the figure JSON
+# holds one number per bin or category instead of every raw value. DatasetSummary computes them
+# from a stream of chunks (datasets.iter_chunks), so the source can be larger than memory.
+
+import numpy as np
+import pandas as pd
+
+MAX_BINS = 100
+
+
+def histogram(values, bins="auto", max_bins=MAX_BINS):
+    # Bin centers, widths and counts of a numeric column
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    edges = np.histogram_bin_edges(values, bins=bins)
+    if len(edges) > max_bins + 1:
+        edges = np.histogram_bin_edges(values, bins=max_bins)
+    counts, edges = np.histogram(values, bins=edges)
+    return (edges[:-1] + edges[1:]) / 2, np.diff(edges), counts
+
+
+def weighted_quantiles(values, weights, quantiles):
+    order = np.argsort(values, kind="mergesort")
+    values, cumulative = values[order], np.cumsum(weights[order])
+    ranks = np.asarray(quantiles) * cumulative[-1]
+    return values[np.minimum(np.searchsorted(cumulative, ranks), len(values) - 1)]
+
+
+def kde(values, weights=None, grid_size=200, bins=1024):
+    # Gaussian KDE (Silverman bandwidth) evaluated on a regular grid by smoothing a fine histogram;
+    # weights let it run on bucketed values such as a QuantileSketch
+    values = np.asarray(values, dtype=np.float64)
+    weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)
+    n = weights.sum()
+    low, high = values.min(), values.max()
+    counts, edges = np.histogram(values, bins=bins, range=(low, high), weights=weights)
+    bin_width = edges[1] - edges[0]
+
+    mean = np.average(values, weights=weights)
+    std = np.sqrt(np.average((values - mean) ** 2, weights=weights))
+    q25, q75 = weighted_quantiles(values, weights, [0.25, 0.75])
+    iqr = q75 - q25
+    spread = min(std, iqr / 1.349) if iqr > 0 else std
+    bandwidth = 0.9 * spread * n ** -0.2
+    sigma = max(bandwidth / bin_width, 1e-9) if bin_width > 0 else 1.0
+
+    half = int(np.ceil(4 * sigma))
+    kernel = np.exp(-0.5 * (np.arange(-half, half + 1) / sigma) ** 2)
+    padded = np.concatenate([np.zeros(half), counts, np.zeros(half)])
+    density = np.convolve(padded, kernel / kernel.sum(), mode="same")
+
+    centers = np.concatenate([low - bin_width * (np.arange(half, 0, -1) - 0.5),
+                              (edges[:-1] + edges[1:]) / 2,
+                              high + bin_width * (np.arange(1, half + 1) - 0.5)])
+    grid = np.linspace(centers[0], centers[-1], grid_size)
+    density = np.interp(grid, centers, density) / (n * bin_width)
+    return grid, density
+
+
+# Streaming Aggregates
+# -----------------------------------------------------------------------------------------------
+#
+# Each accumulator takes the data one chunk at a time and keeps state whose size depends on the
+# value range and resolution, not on the number of rows, so a file of any size can be summarized
+# in bounded memory.
+
+def add_counts(counts, keys, chunk_counts):
+    for key, count in zip(keys, chunk_counts):
+        counts[key] = counts.get(key, 0) + int(count)
+
+
+def key_counts(keys):
+    # Distinct integer keys with their counts; bincount when the keys are dense, else a sort
+    keys = np.asarray(keys, dtype=np.int64)
+    if len(keys) == 0:
+        return keys, keys
+    low, high = keys.min(), keys.max()
+    if high - low > 4 * len(keys):
+        return np.unique(keys, return_counts=True)
+    counts = np.bincount(keys - low)
+    present = np.nonzero(counts)[0]
+    return present + low, counts[present]
+
+
+class QuantileSketch:
+    # Log-bucket sketch: a value x > 0 is counted in bucket ceil(log_gamma(x)), so any quantile is
+    # returned within `accuracy` relative error; negative values are mirrored, zeros counted apart
+
+    def __init__(self, accuracy=0.005):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _bucket(self, values):
+        return np.ceil(np.log(values) / np.log(self.gamma)).astype(np.int64)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.zeros += int((values == 0).sum())
+        for buckets, sign in ((self.positive, 1), (self.negative, -1)):
+            side = sign * values[sign * values > 0]
+            if len(side):
+                add_counts(buckets, *key_counts(self._bucket(side)))
+
+    def buckets(self):
+        # Representative value and count of every bucket, in increasing value order
+        def side(buckets, sign):
+            keys = np.array(sorted(buckets), dtype=np.int64)
+            values = sign * 2 * self.gamma ** keys / (self.gamma + 1)
+            return values, np.array([buckets[k] for k in keys], dtype=np.float64)
+
+        negative, positive = side(self.negative, -1), side(self.positive, 1)
+        values = np.concatenate([negative[0][::-1], [0.0] if self.zeros else [], positive[0]])
+        counts = np.concatenate([negative[1][::-1], [self.zeros] if self.zeros else [], positive[1]])
+        return np.clip(values, self.min, self.max), counts
+
+    def quantiles(self, quantiles):
+        values, counts = self.buckets()
+        return weighted_quantiles(values, counts, quantiles)
+
+    def box_stats(self):
+        # The statistics plotly needs to draw a box without the raw values
+        values, counts = self.buckets()
+        q1, median, q3 = weighted_quantiles(values, counts, [0.25, 0.5, 0.75])
+        iqr = q3 - q1
+        inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+        return {
+            "q1": q1,
+            "median": median,
+            "q3": q3,
+            "lowerfence": inside.min(),
+            "upperfence": inside.max(),
+            "mean": self.sum / self.count,
+        }
+
+
+class StreamingHistogram:
+    # Counts on a fine grid of width `resolution`, regrouped into display bins at the end
+
+    def __init__(self, resolution):
+        self.resolution = resolution
+        self.counts = {}
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        add_counts(self.counts, *key_counts(np.floor(values / self.resolution)))
+
+    def bins(self, max_bins=MAX_BINS):
+        # Bin centers, widths and counts like histogram(), with numpy's "auto" bin width
+        # (the smaller of the Freedman-Diaconis and Sturges widths) from the fine counts
+        keys = np.array(sorted(self.counts), dtype=np.int64)
+        weights = np.array([self.counts[k] for k in keys], dtype=np.float64)
+        centers = np.clip((keys + 0.5) * self.resolution, self.min, self.max)
+        n = weights.sum()
+        span = self.max - self.min
+
+        q25, q75 = weighted_quantiles(centers, weights, [0.25, 0.75])
+        sturges = span / (np.log2(n) + 1.0)
+        fd = 2.0 * (q75 - q25) * n ** (-1.0 / 3)
+        width = min(fd, sturges) if fd > 0 else sturges
+        n_bins = min(max(1, int(np.ceil(span / width))) if width > 0 else 1, max_bins)
+
+        counts, edges = np.histogram(centers, bins=n_bins, range=(self.min, self.max), weights=weights)
+        return (edges[:-1] + edges[1:]) / 2, np.diff(edges), counts.astype(np.int64)
+
+
+class DensityGrid:
+    # Row counts per (integer x level, y bin of width y_width) cell
+
+    def __init__(self, y_width):
+        self.y_width = y_width
+        self.cells = {}
+
+    def update(self, x, y):
+        x = np.asarray(x).astype(np.int64)
+        y_bins = np.floor(np.asarray(y, dtype=np.float64) / self.y_width).astype(np.int64)
+        if len(x) == 0:
+            return
+        # One integer key per cell within this chunk's ranges
+        x_low, y_low = x.min(), y_bins.min()
+        n_y = int(y_bins.max() - y_low) + 1
+        keys, counts = key_counts((x - x_low) * n_y + (y_bins - y_low))
+        cells = zip((keys // n_y + x_low).tolist(), (keys % n_y + y_low).tolist())
+        add_counts(self.cells, cells, counts)
+
+    def grid(self):
+        # x levels, y bin centers and the counts as a (y, x) matrix
+        keys = np.array(sorted(self.cells), dtype=np.int64).reshape(-1, 2)
+        x_levels = np.arange(keys[:, 0].min(), keys[:, 0].max() + 1)
+        y_bins = np.arange(keys[:, 1].min(), keys[:, 1].max() + 1)
+        z = np.zeros((len(y_bins), len(x_levels)), dtype=np.int64)
+        z[keys[:, 1] - y_bins[0], keys[:, 0] - x_levels[0]] = [self.cells[tuple(key)] for key in keys.tolist()]
+        return x_levels, (y_bins + 0.5) * self.y_width, z
+
+
+class DatasetSummary:
+    # Everything the Data Analysis and Data Distribution figures need, built chunk by chunk. The raw
+    # rows are also kept while there are at most `point_budget` of them, so small datasets are drawn
+    # exactly as before
+
+    def __init__(self, point_budget, bmi_resolution=0.01, charges_bin=500.0):
+        self.point_budget = point_budget
+        self.rows = 0
+        self._frames = []
+        self.counts = {col: {} for col in ("age", "children", "sex", "smoker", "region")}
+        self.bmi = StreamingHistogram(bmi_resolution)
+        self.charges = {}
+        self.age_charges = DensityGrid(charges_bin)
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        if self._frames is not None:
+            self._frames.append(chunk)
+            if self.rows > self.point_budget:
+                self._frames = None
+
+        for col, counts in self.counts.items():
+            if col in ("age", "children"):
+                add_counts(counts, *key_counts(chunk[col].values))
+            else:
+                levels = chunk[col].value_counts(sort=False)
+                levels = levels[levels > 0]
+                add_counts(counts, [str(level) for level in levels.index], levels.values)
+        self.bmi.update(chunk["bmi"].values)
+
+        smoker = chunk["smoker"].astype("category")
+        charges = chunk["charges"].values
+        for code, level in enumerate(smoker.cat.categories):
+            # Categoricals (e.g. Parquet dictionaries) may list levels this chunk has no rows of
+            level_charges = charges[smoker.cat.codes.values == code]
+            if len(level_charges):
+                self.charges.setdefault(str(level), QuantileSketch()).update(level_charges)
+        self.age_charges.update(chunk["age"].values, charges)
+        return self
+
+    @property
+    def complete(self):
+        return self._frames is not None
+
+    def frame(self):
+        # All rows, or None once there are more than point_budget of them
+        if self._frames is None:
+            return None
+        return pd.concat(self._frames, ignore_index=True)
+
+    def integer_counts(self, col):
+        # Count of every integer level between the smallest and largest value
+        counts = self.counts[col]
+        levels = np.arange(min(counts), max(counts) + 1)
+        return levels, np.array([counts.get(level, 0) for level in levels.tolist()])
+
+    def value_counts(self, col):
+        # Categories in sorted order with their counts
+        levels = sorted(self.counts[col])
+        return levels, np.array([self.counts[col][level] for level in levels])
+
+
+def summarize(chunks, point_budget):
+    summary = DatasetSummary(point_budget)
+    for chunk in chunks:
+        summary.update(chunk)
+    return summary
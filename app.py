@@ -1,467 +1,319 @@
 # Import required libraries
-import joblib
-import copy
+import profiling
+
+# With PROFILE_DIR set, everything app.py does at import (library imports, data and model loading)
+# is profiled, along with a sample of the callbacks (see profiling.py)
+startup_profile = profiling.startup()
+
+import io
+import os
+import json
 import pathlib
+import functools
+import threading
+import warnings
 import dash
+import numpy as np
 import pandas as pd
+from flask import request, jsonify
 from dash.dependencies import Input, Output, State, ClientsideFunction
 import dash_core_components as dcc
 import dash_html_components as html
 from dash import no_update
-import plotly.graph_objs as go
-from sklearn.preprocessing import OneHotEncoder
-from sklearn.preprocessing import StandardScaler
+
+import datasets
+import evaluation
+import figures
+import metrics
+import model_store
+from lattice import PredictionLattice
+from cache import PredictionCache, normalize_profile
+from runner import ModelRunner
 
 # get relative data folder
 PATH = pathlib.Path(__file__).parent
 DATA_PATH = PATH.joinpath("data").resolve()
 
 app = dash.Dash(
-    __name__, meta_tags=[{"name": "viewport", "content": "width=device-width"}]
+    __name__, meta_tags=[{"name": "viewport", "content": "width=device-width"}], compress=True
 )
 server = app.server
 
-# Reading and preprocessing the dataset
-# -----------------------------------------------------------------------------------------------
-df = pd.read_csv("data/insurance.csv")
-
-# Encoding features
-
-ohe_smoker = OneHotEncoder(drop='first').fit(df["smoker"].values.reshape(-1,1))
-ohe_smoker.get_feature_names(['smoker'])
-
-ohe_sex = OneHotEncoder(drop='first').fit(df["sex"].values.reshape(-1,1))
-ohe_sex.get_feature_names(['sex'])
-
-ohe_region = OneHotEncoder(drop='first').fit(df["region"].values.reshape(-1,1))
-ohe_region.get_feature_names(['region'])
-
-df_2 = pd.concat(
-    [
-        df,
-        pd.DataFrame(ohe_smoker.transform(df["smoker"].values.reshape(-1,1)).toarray(),
-                    columns = ohe_smoker.get_feature_names(['smoker'])).astype(int)
-    ], axis=1).drop("smoker", axis=1)
-
-
-
-df_2 = pd.concat(
-    [
-        df_2,
-        pd.DataFrame(ohe_sex.transform(df["sex"].values.reshape(-1,1)).toarray(),
-                    columns = ohe_sex.get_feature_names(['sex'])).astype(int)
-    ], axis=1).drop("sex", axis=1)
-
-df_2 = pd.concat(
-    [
-        df_2,
-        pd.DataFrame(ohe_region.transform(df["region"].values.reshape(-1,1)).toarray(),
-                    columns = ohe_region.get_feature_names(['region'])).astype(int)
-    ], axis=1).drop("region", axis=1)
-
+# Prometheus metrics at /metrics: request and callback latency, errors, in-flight gauges and
+# encoding/predict timers. METRICS_DIR lets every gunicorn worker's numbers show up in one scrape
+metrics.init_app(server, os.environ.get("METRICS_DIR"), float(os.environ.get("METRICS_INTERVAL", 5)))
 
-X = df_2.drop('charges', axis = 1).values
-y = df_2['charges'].values.reshape(-1,1)
+# The layout and callback graph only change on deploy; let browsers revalidate them with an ETag
+# instead of downloading them again on every page load
+@server.after_request
+def add_etag(response):
+    if request.method == "GET" and request.path.endswith(("/_dash-layout", "/_dash-dependencies")):
+        response.add_etag()
+        response = response.make_conditional(request)
+    return response
 
-# Feature Scaling
-sc_X = StandardScaler()
-sc_y = StandardScaler()
-X_scaled = sc_X.fit_transform(X)
-y_scaled = sc_y.fit_transform(y.reshape(-1,1))
-
-# df = pd.read_csv("data/insurance.csv")
+# Reading the dataset (used by the graphs)
+# -----------------------------------------------------------------------------------------------
+# Typed columns (categoricals, small ints, float32 BMI), cached as .npy arrays after the first start
+df = datasets.load_dataset(DATA_PATH.joinpath("insurance.csv"))
 
 
-# Random Forrest Model
+# Preprocessing and Models
 # ------------------------------------------------------------------------------------------------
 
 rf_path = 'data/random_forest_model.sav'
-rf_model = joblib.load(rf_path)
-
 lasso_path = 'data/lasso_model.sav'
-lasso_model = joblib.load(lasso_path)
-
 svr_path = 'data/svr_model.sav'
-svr_model = joblib.load(svr_path)
 
-# General layout for charts
-# -----------------------------------------------------------------------------------------------
+# Models and the training-time encoder/scalers exported by model_store.py are loaded from one
+# versioned bundle, with the model arrays memory-mapped and shared by all workers on a host.
+# Without a bundle (or with MODEL_STORE=0) the pickles are loaded and the encoder/scalers are
+# refit on the notebook's training split.
+USE_MODEL_STORE = os.environ.get("MODEL_STORE", "1") != "0"
+MODEL_STORE_PATH = DATA_PATH.joinpath("models")
+
+# SVR_MODE=approx serves the reduced SVR built by svr_approx.py (store bundles only)
+SVR_MODE = os.environ.get("SVR_MODE", "exact")
+
+# Random forest batches of at least RF_BATCH_ROWS rows (default 500; 0 = never) use sklearn's
+# compiled trees instead of CompactForest (store bundles only, see model_store.py)
+RF_BATCH_ROWS = int(os.environ.get("RF_BATCH_ROWS", 500))
+
+if USE_MODEL_STORE and MODEL_STORE_PATH.joinpath("bundle.json").exists():
+    try:
+        bundle = model_store.load_bundle(MODEL_STORE_PATH, svr_mode=SVR_MODE, rf_batch_rows=RF_BATCH_ROWS)
+    except ValueError as e:
+        warnings.warn("%s; serving the exact SVR" % e)
+        bundle = model_store.load_bundle(MODEL_STORE_PATH, rf_batch_rows=RF_BATCH_ROWS)
+    model_source = evaluation.store_source(MODEL_STORE_PATH)
+else:
+    if SVR_MODE != "exact":
+        warnings.warn("SVR_MODE=%s needs a model store bundle; serving the exact SVR" % SVR_MODE)
+    bundle = model_store.load_pickle_bundle(df, rf_path, lasso_path, svr_path)
+    model_source = evaluation.pickle_source({"random_forest": rf_path, "lasso": lasso_path, "svr": svr_path})
+
+MODEL_VERSION = bundle.version
+encoder, sc_X, sc_y = bundle.encoder, bundle.sc_X, bundle.sc_y
+rf_model, lasso_model, svr_model = bundle.rf_model, bundle.lasso_model, bundle.svr_model
+
+# Predictions for repeated profiles are served from a bounded LRU cache tied to the served models,
+# one entry per (profile, model)
+prediction_cache = PredictionCache(
+    maxsize=int(os.environ.get("PREDICTION_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("PREDICTION_CACHE_TTL", 0)) or None,
+    version=bundle.serving_version,
+)
 
-layout = dict(
-    autosize=True,
-    # automargin=True,
-    margin=dict(l=30, r=30, b=20, t=40),
-    hovermode="closest",
-    plot_bgcolor="#1a2229",
-    paper_bgcolor="#2d353c",
-    xaxis = dict(color="#9ba8b4", showgrid=False),
-    yaxis = dict(color="#9ba8b4", showgrid=False),
-    
-    title="Sample Title",
-    titlefont=dict(
-        family='Open Sans',
-        size=18,
-        color='white'
-    ),
-    
-    legend = dict(
-            x=0.16,
-            y=-0.12,
-            traceorder="normal",
-            font=dict(
-                family="Open Sans",
-                size=12,
-                color="#9ba8b4"
-            ),
-            bgcolor="#1a2229",
-            bordercolor="Black",
-            borderwidth=1,
-            orientation='h'
-        )
+# Each result card runs only its own model and waits for it for at most PREDICTION_TIMEOUT seconds
+# (0 waits indefinitely); beyond PREDICTION_QUEUE queued or running predictions a card is left empty
+def predict_profile(name, key):
+    # Runs in the runner's pool, so it is sampled on its own rather than under predict_result
+    with profiling.sample("predict_profile:" + name):
+        with metrics.ENCODE_SECONDS.time("row"):
+            sample = encoder.transform_row(*key)
+        with metrics.PREDICT_SECONDS.time(name, "row"):
+            return float(bundle.predict_model(name, sample)[0])
+
+model_runner = ModelRunner(
+    {name: functools.partial(predict_profile, name) for name in model_store.MODEL_NAMES},
+    timeout=float(os.environ.get("PREDICTION_TIMEOUT", 2)) or None,
+    max_pending=int(os.environ.get("PREDICTION_QUEUE", 0)) or None,
+    on_complete=lambda key, name, value: prediction_cache.put((key, name), value),
 )
 
-# Smoker Graph (Data Analysis Tab)
+# With PREDICTION_MODE=lattice, profiles inside the lattice built by lattice.py are answered by
+# interpolation for the models that passed its tolerance check; the other models run live.
+# Interpolated values are approximations and never go into the prediction cache
+PREDICTION_MODE = os.environ.get("PREDICTION_MODE", "live")
+lattice = None
+
+if PREDICTION_MODE == "lattice":
+    lattice_path = MODEL_STORE_PATH.joinpath("lattice")
+    if lattice_path.exists():
+        lattice = PredictionLattice.load(lattice_path)
+    if lattice is None or lattice.bundle_version != MODEL_VERSION:
+        warnings.warn("no prediction lattice for model bundle %s, serving live predictions" % MODEL_VERSION)
+        lattice = None
+    elif not lattice.models:
+        warnings.warn("the prediction lattice serves no model within tolerance (rebuild it with lattice.py), "
+                      "serving live predictions")
+        lattice = None
+
+# Tab Content (rendered on demand)
 # -----------------------------------------------------------------------------------------------
 
-def smoker_graph():
+# Figures depend only on the dataset and the models. They come from the cache written by
+# `python figures.py` when it matches this dataset and model bundle; otherwise each figure is
+# built and serialized on first use and reused for every later visit
+DATASET_VERSION = evaluation.dataset_digest(DATA_PATH.joinpath("insurance.csv"))
+
+# ANALYSIS_DATA points the Data Analysis and Data Distribution tabs at another CSV/Parquet file,
+# which may be larger than memory. It is keyed by its size and modification time, and streamed
+# only by `python figures.py --analysis` or warm_caches in the gunicorn master, never inside a
+# request; until then its figures are a placeholder
+ANALYSIS_DATA = os.environ.get("ANALYSIS_DATA")
+ANALYSIS_VERSION = datasets.source_key(ANALYSIS_DATA) if ANALYSIS_DATA else None
+
+FIGURES_VERSION = figures.figures_version(DATASET_VERSION, MODEL_VERSION, ANALYSIS_VERSION)
+figure_cache = figures.load_figures(FIGURES_VERSION) or {}
+figure_cache_lock = threading.Lock()
+
+ANALYSIS_MISSING = figures.placeholder_figure("Data Analysis", "The data summary has not been built yet "
+                                              "(python figures.py --analysis)")
+
+if ANALYSIS_DATA and not figure_cache:
+    warnings.warn("no figures built for ANALYSIS_DATA=%s; run `python figures.py --analysis %s` or start "
+                  "gunicorn with gunicorn.conf.py" % (ANALYSIS_DATA, ANALYSIS_DATA))
+
+@functools.lru_cache(maxsize=None)
+def data_summary():
+    return figures.summarize(ANALYSIS_DATA or df)
+
+# Scoring the models takes far longer than a request may, so it only happens in `python
+# evaluation.py`; until its scores exist the Models Performance tab shows a placeholder
+SCORES_MISSING = figures.placeholder_figure("Models Performance",
+                                            "Model scores have not been built yet (python evaluation.py)")
+
+# The models and dataset are hashed once here; a request only checks whether evaluation.json has
+# changed since it was last read
+SCORE_KEYS = evaluation.entry_keys(model_source, DATASET_VERSION)
+scores_state = {"mtime_ns": None, "scores": None}
+
+def current_scores():
+    try:
+        mtime_ns = os.stat(evaluation.EVALUATION_PATH).st_mtime_ns
+    except OSError:
+        return None
+    if mtime_ns != scores_state["mtime_ns"]:
+        scores_state["scores"] = evaluation.load_scores(model_source, keys=SCORE_KEYS)
+        scores_state["mtime_ns"] = mtime_ns
+    return scores_state["scores"]
+
+if current_scores() is None:
+    warnings.warn("no held-out scores for these models; run `python evaluation.py` to fill the Models "
+                  "Performance tab")
+
+def figure_json(name, stream_analysis=False):
+    cached = figure_cache.get(name)
+    if cached is None:
+        if name in figures.PERFORMANCE_FIGURES:
+            # Checked on every visit until evaluation.py has written the scores
+            scores = current_scores()
+            if scores is None:
+                return SCORES_MISSING
+        elif ANALYSIS_DATA and not stream_analysis:
+            return ANALYSIS_MISSING
+        with figure_cache_lock:
+            cached = figure_cache.get(name)
+            if cached is None:
+                if name in figures.PERFORMANCE_FIGURES:
+                    cached = figures.build_figure(name, scores)
+                else:
+                    cached = figures.build_figure(name, data_summary())
+                figure_cache[name] = cached
+    return cached
+
+# Parsed figure dicts, so a tab visit does not parse the cached JSON again (Dash still encodes
+# the response). Placeholders are not kept, since the real figure replaces them once built
+parsed_figures = {}
+
+def figure(name):
+    parsed = parsed_figures.get(name)
+    if parsed is None:
+        data = figure_json(name)
+        parsed = json.loads(data)
+        if figure_cache.get(name) is data:
+            parsed_figures[name] = parsed
+    return parsed
+
+def warm_caches():
+    # Builds and parses every figure up front; gunicorn.conf.py calls this in the master so the
+    # workers share them
+    for name in figures.FIGURES:
+        figure_json(name, stream_analysis=True)
+        figure(name)
+
+
+def tab_content(tab):
+    
+    if tab == "analysis":
+        return html.Div([
+            
+            dcc.Graph(figure = figure("smoker_graph"), className = "four columns", style = {"height": "400px" }),
+            
+            dcc.Graph(figure = figure("age_graph"), className = "eight columns", style = {"height": "424px" })
+            
+        ], className = "tab_content")
     
-    layout_count = copy.deepcopy(layout)
+    elif tab == "distribution":
+        return html.Div([
+            
+            html.Div([
+                dcc.Graph(figure = figure("bmi_dist"), className = "four columns", style = {"height": "280px" }),
+            
+                dcc.Graph(figure = figure("age_dist"), className = "four columns", style = {"height": "280px" }),
+                
+                dcc.Graph(figure = figure("region_dist"), className = "four columns", style = {"height": "280px" }),
+                    
+            ], className="row"),
+            
+            html.Div([
+                dcc.Graph(figure = figure("sex_dist"), className = "four columns", style = {"height": "280px" }),
+            
+                dcc.Graph(figure = figure("children_dist"), className = "four columns", style = {"height": "280px" }),
+                
+                dcc.Graph(figure = figure("smoker_dist"), className = "four columns", style = {"height": "280px" }),
+                    
+            ], className="row"),
+            
+            
+            
+        ], className = "tab_content")
     
-    fig = go.Figure(layout=layout_count)
-
-    fig.add_trace(go.Violin(x=df['smoker'][ df['smoker'] == 'yes' ],
-                            y=df['charges'][ df['smoker'] == 'yes' ],
-                            box_visible=True, opacity=1   ,
-                            legendgroup='Smoker', scalegroup='M', name='Smoker',
-                            fillcolor='#e8871a', line_color='black',))
+    elif tab == "performance":
+        return html.Div([
+            
+            dcc.Graph(figure = figure("rsquared_graph"), className = "twelve columns", style = {"height": "360px" }),
+                
+            
+            dcc.Graph(figure = figure("rmse_graph"), className = "twelve columns", style = {"height": "360px" }),
+                                                
+        ], className = "tab_content")
     
-    fig.add_trace(go.Violin(x=df['smoker'][ df['smoker'] == 'no' ],
-                            y=df['charges'][ df['smoker'] == 'no' ],
-                            box_visible=True, opacity=1,
-                            legendgroup='Non-Smoker', scalegroup='M', name='Non-Smoker',
-                            fillcolor='#00c0c7', line_color='black',))   
+    # About the App
+    return html.Div([
     
-    fig.update_layout(
-        title = "Smoker and Non-Smoker Charges",
-        title_x=0.5,
-        yaxis_title="Charges",
+        # html.P("""
+        #        This dash application allows you to predict medical charges using machine learning alogirthms
+        #        (Random Forest Regression, SVR and Lasso Regression). You can also:
+        #        """
+        #        ),
+            
+        dcc.Markdown('''
+        #### **Predictive Analysis on Medical Charges**
         
-        titlefont=dict(
-            family='Open Sans',
-            size=18,
-            color = "#ffffff"
-        ),
+        This dash application allows you to predict medical charges using machine learning algorithms
+        (Random Forest Regression, SVR and Lasso Regression). Developed with Python and all codes published
+        on GitHub. Feel free to review and download repository. You can:
+        * calculate body mass index,
+        * predict medical costs billed by health insurance
+        * review data analysis
+        * explore data distribution.
         
-        showlegend = False,
+        ##### **Inspiration**
         
-        yaxis_zeroline=False)
-    
-    return fig
-
-# Age Graph (Data Analysis Tab)
-# -----------------------------------------------------------------------------------------------
-
-def age_graph():
-    
-    layout_count = copy.deepcopy(layout)
-    
-    fig = go.Figure(layout=layout_count)
-    
-    fig.add_trace(go.Scatter(x=df["age"],
-                             y=df["charges"],
-                             mode='markers',
-                             opacity=0.7,
-                             marker_symbol = "hexagon",
-                             marker=dict(
-                                 color='#00c0c7',
-                                 size=8,
-                                  line=dict(
-                                      color='black',
-                                      width=0.4
-                                  )
-                             ),
-                         )),  
-    
-    fig.update_layout(
-        title = "Charges with respect to Age",
-        title_x=0.5,
-        xaxis_title="Age",
-        # yaxis_title="Charges",
-        titlefont=dict(
-            family='Open Sans',
-            size=18,
-            color = "#ffffff"
-        ),
+        I have inspired one of my old Kaggle notebook. You can find details about different ML pipelines and hyperparameters tuning:  
+        https://www.kaggle.com/tolgahancepel/medical-costs-regression-hypertuning-eda
         
-        yaxis_zeroline=False)
-    
-    return fig
-
-# R2 Graph (Models Performance Tab)
-# -----------------------------------------------------------------------------------------------
-
-def rsquared_graph():
-    
-    layout_count = copy.deepcopy(layout)
-    
-    fig = go.Figure(layout=layout_count)
-    
-    fig.add_trace(
-        go.Bar(
-            name='test set',
-            y=['Random Forest', 'Decision Tree', 'Lasso', 'Ridge', 'SVR', 'Linear'],
-            x=[0.896686, 0.877656, 0.861600, 0.861564, 0.861047, 0.767264],
-            orientation='h',
-            marker=dict(
-                color = '#006064'
-            )
-            
-        ),    
-    )
-    
-    fig.update_layout(
-        title = "R2 Score (Test set)",
-        title_x=0.5,
-        yaxis_title="Model",
-        titlefont=dict(
-            family='Open Sans',
-            size=18,
-            color = "#ffffff"
-        ),
-        showlegend = False,
-        yaxis_zeroline=False
-    )
-    
-    return fig
-
-# RMSE Graph (Models Performance Tab)
-# -----------------------------------------------------------------------------------------------
-
-def rmse_graph():
-    
-    layout_count = copy.deepcopy(layout)
-    
-    fig = go.Figure(layout=layout_count)
-    
-    fig.add_trace(
-        go.Bar(
-            name='test set',
-            x=['Random Forest', 'Decision Tree', 'Lasso', 'Ridge', 'SVR', 'Linear'],
-            y=[3948.307638, 4296.587786, 4569.831897, 4570.420248, 4578.942853, 5926.023602],
-            orientation='v',
-            marker=dict(
-                color = '#AC5700'
-            )
-            
-        ),    
-    )
-    
-    fig.update_layout(
-        title = "RMSE (Test set)",
-        title_x=0.5,
-        yaxis_title="Model",
-        titlefont=dict(
-            family='Open Sans',
-            size=18,
-            color = "#ffffff"
-        ),
-        showlegend = False,
-        yaxis_zeroline=False
-    )
-    
-    return fig
-
-# BMI Graph (Data Distribution Tab)
-# -----------------------------------------------------------------------------------------------
-
-def bmi_dist():
-    
-    layout_count = copy.deepcopy(layout)
-    
-    fig = go.Figure(layout=layout_count)
-    
-    fig.add_trace(
-        go.Histogram(
-            x=df['bmi'].values,
-            y=df['bmi'].values,
-            # marginal='box',
-        ) 
-    )
-    
-    fig.update_layout(
-        title = "BMI Distribution",
-        title_x=0.5,
-        # yaxis_title="Sum",
-        titlefont=dict(
-            family='Open Sans',
-            size=18,
-            color = "#ffffff"
-        ),
-        showlegend = False,
-        yaxis_zeroline=False
-    )
-    
-    return fig
-
-# Age Graph (Data Distribution Tab)
-# -----------------------------------------------------------------------------------------------
-
-def age_dist():
-    
-    layout_count = copy.deepcopy(layout)
-    
-    fig = go.Figure(layout=layout_count)
-    
-    fig.add_trace(
-        go.Histogram(
-            x=df['age'].values,
-            y=df['age'].values,
-            # marginal='box',
-        ) 
-    )
-    
-    fig.update_layout(
-        title = "Age Distribution",
-        title_x=0.5,
-        # yaxis_title="Sum",
-        titlefont=dict(
-            family='Open Sans',
-            size=18,
-            color = "#ffffff"
-        ),
-        showlegend = False,
-        yaxis_zeroline=False
-    )
-    
-    return fig
-
-# Region Graph (Data Distribution Tab)
-# -----------------------------------------------------------------------------------------------
-
-def region_dist():
-    
-    layout_count = copy.deepcopy(layout)
-    
-    fig = go.Figure(layout=layout_count)
-    
-    fig.add_trace(
-        go.Histogram(
-            x=df['region'].values,
-            y=df['region'].values,
-            # marginal='box',
-        ) 
-    )
-    
-    fig.update_layout(
-        title = "Region Distribution",
-        title_x=0.5,
-        # yaxis_title="Sum",
-        titlefont=dict(
-            family='Open Sans',
-            size=18,
-            color = "#ffffff"
-        ),
-        showlegend = False,
-        yaxis_zeroline=False
-    )
-    
-    return fig
-
-# Sex Graph (Data Distribution Tab)
-# -----------------------------------------------------------------------------------------------
-
-def sex_dist():
-    
-    layout_count = copy.deepcopy(layout)
-    
-    fig = go.Figure(layout=layout_count)
-    
-    fig.add_trace(
-        go.Histogram(
-            x=df['sex'].values,
-            y=df['sex'].values,
-            # marginal='box',
-        ) 
-    )
-    
-    fig.update_layout(
-        title = "Sex Distribution",
-        title_x=0.5,
-        # yaxis_title="Sum",
-        titlefont=dict(
-            family='Open Sans',
-            size=18,
-            color = "#ffffff"
-        ),
-        showlegend = False,
-        yaxis_zeroline=False
-    )
-    
-    return fig
-
-# Children Graph (Data Distribution Tab)
-# -----------------------------------------------------------------------------------------------
-
-def children_dist():
-    
-    layout_count = copy.deepcopy(layout)
-    
-    fig = go.Figure(layout=layout_count)
-    
-    fig.add_trace(
-        go.Histogram(
-            x=df['children'].values,
-            y=df['children'].values,
-            # marginal='box',
-        ) 
-    )
-    
-    fig.update_layout(
-        title = "Children Distribution",
-        title_x=0.5,
-        # yaxis_title="Sum",
-        titlefont=dict(
-            family='Open Sans',
-            size=18,
-            color = "#ffffff"
-        ),
-        showlegend = False,
-        yaxis_zeroline=False
-    )
-    
-    return fig
-
-# Smoker Graph (Data Distribution Tab)
-# -----------------------------------------------------------------------------------------------
-
-def smoker_dist():
-    
-    layout_count = copy.deepcopy(layout)
-    
-    fig = go.Figure(layout=layout_count)
-    
-    fig.add_trace(
-        go.Histogram(
-            x=df['smoker'].values,
-            y=df['smoker'].values,
-            # marginal='box',
-        ) 
-    )
-    
-    fig.update_layout(
-        title = "Smoker Distribution",
-        title_x=0.5,
-        # yaxis_title="Sum",
-        titlefont=dict(
-            family='Open Sans',
-            size=18,
-            color = "#ffffff"
-        ),
-        showlegend = False,
-        yaxis_zeroline=False
-    )
-    
-    return fig
+        ##### **Dataset**
+        https://www.kaggle.com/mirichoi0218/insurance
+        
+        ##### **GitHub**
+        https://github.com/tolgahancepel/medical-charges-prediction
+        '''
+        )    
+        
+    ], className = "tab_content")
 
 
 # Creating App Layout
@@ -472,6 +324,9 @@ app.layout = html.Div(
         # empty Div to trigger javascript file for graph resizing
         html.Div(id="output-clientside"),
         
+        # last seen Calculate/Reset clicks of the BMI calculator
+        dcc.Store(id="bmi_clicks"),
+        
         # Navbar
         # --------------------------------------------------------------------------------
         
@@ -763,107 +618,16 @@ app.layout = html.Div(
                 html.Div(
                     [
                         dcc.Tabs(
-                        [
-                            
-                            dcc.Tab(label = "Data Analysis", children = [
-                                
-                                html.Div([
-                                    
-                                    dcc.Graph(figure = smoker_graph(), className = "four columns", style = {"height": "400px" }),
-                                    
-                                    dcc.Graph(figure = age_graph(), className = "eight columns", style = {"height": "424px" })
-                                    
-                                ], className = "tab_content"),
-                                
-                                
-                                
-                            ]),
-                            
-                            
-                            dcc.Tab(label = "Data Distribution", children = [
-                                
-                                html.Div([
-                                    
-                                    html.Div([
-                                        dcc.Graph(figure = bmi_dist(), className = "four columns", style = {"height": "280px" }),
-                                    
-                                        dcc.Graph(figure = age_dist(), className = "four columns", style = {"height": "280px" }),
-                                        
-                                        dcc.Graph(figure = region_dist(), className = "four columns", style = {"height": "280px" }),
-                                            
-                                    ], className="row"),
-                                    
-                                    html.Div([
-                                        dcc.Graph(figure = sex_dist(), className = "four columns", style = {"height": "280px" }),
-                                    
-                                        dcc.Graph(figure = children_dist(), className = "four columns", style = {"height": "280px" }),
-                                        
-                                        dcc.Graph(figure = smoker_dist(), className = "four columns", style = {"height": "280px" }),
-                                            
-                                    ], className="row"),
-                                    
-                                    
-                                    
-                                ], className = "tab_content"),
-                                
-                                
-                                
-                            ]),
-                            
-                            dcc.Tab(label = "Models Performance", children = [
-                                
-                                html.Div([
-                                    
-                                    dcc.Graph(figure = rsquared_graph(), className = "twelve columns", style = {"height": "360px" }),
-                                        
-                                    
-                                    dcc.Graph(figure = rmse_graph(), className = "twelve columns", style = {"height": "360px" }),
-                                                                        
-                                ], className = "tab_content"),
-                                
-                                
-                                
-                            ]),
-                            
-                            dcc.Tab(label = "About the App", children = [
-                                
-                                html.Div([
-                                
-                                    # html.P("""
-                                    #        This dash application allows you to predict medical charges using machine learning alogirthms
-                                    #        (Random Forest Regression, SVR and Lasso Regression). You can also:
-                                    #        """
-                                    #        ),
-                                        
-                                    dcc.Markdown('''
-                                    #### **Predictive Analysis on Medical Charges**
-                                    
-                                    This dash application allows you to predict medical charges using machine learning algorithms
-                                    (Random Forest Regression, SVR and Lasso Regression). Developed with Python and all codes published
-                                    on GitHub. Feel free to review and download repository. You can:
-                                    * calculate body mass index,
-                                    * predict medical costs billed by health insurance
-                                    * review data analysis
-                                    * explore data distribution.
-                                    
-                                    ##### **Inspiration**
-                                    
-                                    I have inspired one of my old Kaggle notebook. You can find details about different ML pipelines and hyperparameters tuning:  
-                                    https://www.kaggle.com/tolgahancepel/medical-costs-regression-hypertuning-eda
-                                    
-                                    ##### **Dataset**
-                                    https://www.kaggle.com/mirichoi0218/insurance
-                                    
-                                    ##### **GitHub**
-                                    https://github.com/tolgahancepel/medical-charges-prediction
-                                    '''
-                                    )    
-                                    
-                                ], className = "tab_content"),
-
-                            ]),
-                        ]              
+                            id = "tabs", value = "analysis",
+                            children = [
+                                dcc.Tab(label = "Data Analysis", value = "analysis"),
+                                dcc.Tab(label = "Data Distribution", value = "distribution"),
+                                dcc.Tab(label = "Models Performance", value = "performance"),
+                                dcc.Tab(label = "About the App", value = "about"),
+                            ]
                         ),
+                        
+                        html.Div(id = "tab_content"),
                     
                     ], className = "tabs_pretty_container twelve columns")
 
@@ -878,92 +642,42 @@ app.layout = html.Div(
 # App Callbacks
 # --------------------------------------------------------------------------------------------
 
-# BMI Calculate Button
-
-@app.callback(
-    dash.dependencies.Output('bmi_value', 'children'),
-    
-    [dash.dependencies.Input('btn_calculate', 'n_clicks')],
-    
-    [dash.dependencies.State('input_weight', 'value'),
-     dash.dependencies.State('input_height', 'value')],
-)
-
-def update_bmi(n_clicks, input_weight, input_height):
-    if(n_clicks):
-        return "Your BMI: " + ("%.2f" % (input_weight / (input_height * input_height) * 10000))
-    
-    else:
-        return no_update
-
-
-@app.callback(
-    dash.dependencies.Output('predict_age', 'value'),
-    
-    [dash.dependencies.Input('btn_calculate', 'n_clicks')],
-    
-    [dash.dependencies.State('input_age', 'value')],
+# BMI Calculate and Reset Buttons (clientside, see assets/bmi_calculator.js)
+
+app.clientside_callback(
+    ClientsideFunction(namespace="bmi", function_name="update"),
+    
+    [Output('bmi_value', 'children'),
+     Output('predict_age', 'value'),
+     Output('predict_bmi', 'value'),
+     Output('input_height', 'value'),
+     Output('input_weight', 'value'),
+     Output('input_age', 'value'),
+     Output('bmi_clicks', 'data')],
+    
+    [Input('btn_calculate', 'n_clicks'),
+     Input('btn_reset', 'n_clicks')],
+    
+    [State('input_weight', 'value'),
+     State('input_height', 'value'),
+     State('input_age', 'value'),
+     State('bmi_value', 'children'),
+     State('predict_age', 'value'),
+     State('predict_bmi', 'value'),
+     State('bmi_clicks', 'data')],
 )
 
-def copy_age(n_clicks, input_age):
-    if(n_clicks):
-        return input_age
-    
-    else:
-        return no_update
-
-
-@app.callback(
-    dash.dependencies.Output('predict_bmi', 'value'),
-    
-    [dash.dependencies.Input('btn_calculate', 'n_clicks')],
-    
-    [dash.dependencies.State('input_weight', 'value'),
-     dash.dependencies.State('input_height', 'value')],
-)
-
-def copy_bmi(n_clicks, input_weight, input_height):
-    if(n_clicks):
-        return ("%.2f" % (input_weight / (input_height * input_height) * 10000))
-    
-    else:
-        return no_update
-
-# BMI Reset Button
+# Tabs (only the selected tab's figures are sent to the browser)
 
-@app.callback(
-    [dash.dependencies.Output('input_height', 'value'),
-    dash.dependencies.Output('input_weight', 'value'),
-    dash.dependencies.Output('input_age', 'value'),
-    ],
-    
-    [dash.dependencies.Input('btn_reset', 'n_clicks')]
-)
-
-def reset_bmi(n_clicks):
-    if(n_clicks):
-        return (None, None, None)
-    else:
-        return no_update
+@app.callback(Output('tab_content', 'children'), [Input('tabs', 'value')])
+@metrics.instrument_callback('render_tab', 'tab_content')
+@profiling.profiled('render_tab')
+def render_tab(tab):
+    return tab_content(tab)
 
 # Prediction
 
-@app.callback(
-    [dash.dependencies.Output('rf_result', 'children'),
-     dash.dependencies.Output('lasso_result', 'children'),
-     dash.dependencies.Output('svr_result', 'children')],
-    
-    [dash.dependencies.Input('btn_predict', 'n_clicks')],
-    
-    [dash.dependencies.State('predict_age', 'value'),
-     dash.dependencies.State('predict_bmi', 'value'),
-     dash.dependencies.State('predict_children', 'value'),
-     dash.dependencies.State('predict_region', 'value'),
-     dash.dependencies.State('predict_sex', 'value'),
-     dash.dependencies.State('predict_smoker', 'value')],
-)
-
-def predict_result(n_clicks, input_age, input_bmi, input_children, input_region, input_sex, input_smoker):
+def predict_result(name, n_clicks, input_age, input_bmi, input_children, input_region, input_sex, input_smoker):
     if(n_clicks):
         
         if (not input_smoker):
@@ -974,43 +688,164 @@ def predict_result(n_clicks, input_age, input_bmi, input_children, input_region,
         # print("smoker: ", isSmoker)
         
         
-        sample = [input_age, input_sex, input_bmi, input_children, isSmoker, input_region]
-        
-        # sample = [19, "female", 27.900, 0, "yes", "southwest"]
+        key = normalize_profile(input_age, input_sex, input_bmi, input_children, isSmoker, input_region)
+        value = prediction_cache.get((key, name))
         
+        if value is None and lattice is not None and name in lattice.models:
+            result = lattice.predict_row(*key)
+            if result is not None:
+                value = result[model_store.MODEL_NAMES.index(name)]
         
-        sample = pd.DataFrame([sample], columns = ["age", "sex", "bmi", "children", "smoker", "region"])
+        if value is None:
+            value = model_runner.result(key, name)
         
+        # A model that failed, timed out or was turned away leaves its card empty
+        if value is None:
+            return ""
         
-        sample = pd.concat(
-            [
-                sample,
-                pd.DataFrame(ohe_smoker.transform(sample["smoker"].values.reshape(-1,1)).toarray(),
-                            columns = ohe_smoker.get_feature_names(['smoker'])).astype(int)
-            ], axis=1).drop("smoker", axis=1)
-        
-        sample = pd.concat(
-            [
-                sample,
-                pd.DataFrame(ohe_sex.transform(sample["sex"].values.reshape(-1,1)).toarray(),
-                            columns = ohe_sex.get_feature_names(['sex'])).astype(int)
-            ], axis=1).drop("sex", axis=1)
-        
-        sample = pd.concat(
-            [
-                sample,
-                pd.DataFrame(ohe_region.transform(sample["region"].values.reshape(-1,1)).toarray(),
-                            columns = ohe_region.get_feature_names(['region'])).astype(int)
-            ], axis=1).drop("region", axis=1)
-            
-        rf_result = sc_y.inverse_transform(rf_model.predict(sc_X.transform(sample)))
-        lasso_result = lasso_model.predict(sample)
-        svr_result = sc_y.inverse_transform(svr_model.predict(sc_X.transform(sample)))
-        
-        return ("$" + ("%.2f" % rf_result)), ("$" + ("%.2f" % lasso_result)), ("$" + ("%.2f" % svr_result))
+        return "$" + ("%.2f" % value)
     else:
         return no_update
 
+
+# One callback per result card, so each card updates as soon as its model finishes
+
+PREDICT_STATES = [dash.dependencies.State('predict_age', 'value'),
+                  dash.dependencies.State('predict_bmi', 'value'),
+                  dash.dependencies.State('predict_children', 'value'),
+                  dash.dependencies.State('predict_region', 'value'),
+                  dash.dependencies.State('predict_sex', 'value'),
+                  dash.dependencies.State('predict_smoker', 'value')]
+
+for card_id, model_name in (('rf_result', 'random_forest'), ('lasso_result', 'lasso'), ('svr_result', 'svr')):
+    app.callback(
+        dash.dependencies.Output(card_id, 'children'),
+        [dash.dependencies.Input('btn_predict', 'n_clicks')],
+        PREDICT_STATES,
+    )(metrics.instrument_callback('predict_result', card_id)(
+        profiling.profiled('predict_result:' + card_id)(functools.partial(predict_result, model_name))))
+
+# Batch Prediction API
+# --------------------------------------------------------------------------------------------
+
+FEATURE_COLUMNS = ["age", "sex", "bmi", "children", "smoker", "region"]
+MAX_BATCH_ROWS = 100000
+# Larger batches skip the prediction cache: they are scored in one vectorized pass and would
+# otherwise evict the interactive entries and skew its hit/miss counters
+CACHED_BATCH_ROWS = int(os.environ.get("CACHED_BATCH_ROWS", 100))
+MODEL_NAMES = model_store.MODEL_NAMES
+
+
+def predict_samples(samples, names=MODEL_NAMES):
+    with metrics.ENCODE_SECONDS.time("batch"):
+        encoded = encoder.transform(samples)
+    results = []
+    for name in names:
+        with metrics.PREDICT_SECONDS.time(name, "batch"):
+            results.append(bundle.predict_model(name, encoded))
+    return np.column_stack(results)
+
+
+def run_models(samples):
+    # All rows go through each model in a single vectorized call, or come from the lattice when it
+    # covers them and serves that model. Returns the results and a mask of the interpolated ones
+    interpolated = np.zeros((len(samples), len(MODEL_NAMES)), dtype=bool)
+    if lattice is None:
+        return predict_samples(samples), interpolated
+    
+    results, covered = lattice.lookup(samples)
+    if not covered.all():
+        results[~covered] = predict_samples(samples[~covered])
+    live = [name for name in MODEL_NAMES if name not in lattice.models]
+    if live and covered.any():
+        results[np.ix_(covered, [MODEL_NAMES.index(name) for name in live])] = predict_samples(samples[covered], live)
+    interpolated[np.ix_(covered, [MODEL_NAMES.index(name) for name in lattice.models])] = True
+    return results, interpolated
+
+
+def predict_batch(samples):
+    # Rows of a small batch already in the prediction cache are answered from it, the rest are
+    # scored together
+    samples = samples.reset_index(drop=True)
+    samples["bmi"] = np.round(samples["bmi"].values.astype(float), 2)
+    
+    if len(samples) > CACHED_BATCH_ROWS:
+        results, _ = run_models(samples)
+        return {name: results[:, j] for j, name in enumerate(MODEL_NAMES)}
+    
+    keys = [normalize_profile(*row) for row in zip(*(samples[col].values for col in FEATURE_COLUMNS))]
+    cached = [[prediction_cache.get((key, name)) for name in MODEL_NAMES] for key in keys]
+    missing = [i for i, values in enumerate(cached) if None in values]
+    
+    results = np.empty((len(samples), len(MODEL_NAMES)))
+    if len(missing) < len(samples):
+        hits = [i for i, values in enumerate(cached) if None not in values]
+        results[hits] = [cached[i] for i in hits]
+    if missing:
+        results[missing], interpolated = run_models(samples.iloc[missing])
+        for i, approximate in zip(missing, interpolated):
+            for j, name in enumerate(MODEL_NAMES):
+                if not approximate[j]:
+                    prediction_cache.put((keys[i], name), float(results[i, j]))
+    
+    return {name: results[:, j] for j, name in enumerate(MODEL_NAMES)}
+
+
+def parse_samples(req):
+    # Accepts a CSV body (text/csv) or a JSON array of objects / positional rows
+    if req.mimetype in ("text/csv", "application/csv"):
+        samples = pd.read_csv(io.StringIO(req.get_data(as_text=True)))
+    else:
+        rows = req.get_json(silent=True)
+        if isinstance(rows, dict):
+            rows = rows.get("rows")
+        if not isinstance(rows, list) or not rows:
+            raise ValueError("expected a non-empty JSON array of rows or a CSV body")
+        if isinstance(rows[0], dict):
+            samples = pd.DataFrame(rows)
+        else:
+            samples = pd.DataFrame(rows, columns=FEATURE_COLUMNS)
+    
+    missing = [col for col in FEATURE_COLUMNS if col not in samples.columns]
+    if missing:
+        raise ValueError("missing columns: " + ", ".join(missing))
+    if len(samples) > MAX_BATCH_ROWS:
+        raise ValueError("batch too large (max %d rows)" % MAX_BATCH_ROWS)
+    
+    samples = samples[FEATURE_COLUMNS].copy()
+    for col in ("age", "bmi", "children"):
+        samples[col] = pd.to_numeric(samples[col])
+    for col in ("sex", "smoker", "region"):
+        samples[col] = samples[col].astype(str).str.strip().str.lower()
+    if samples.isnull().values.any():
+        raise ValueError("rows contain empty values")
+    
+    return samples
+
+
+@server.route("/api/predict", methods=["POST"])
+def api_predict():
+    try:
+        samples = parse_samples(request)
+        predictions = predict_batch(samples)
+    except (ValueError, TypeError, KeyError) as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify({
+        "count": len(samples),
+        "predictions": {name: np.round(values, 2).tolist() for name, values in predictions.items()},
+    })
+
+@server.route("/api/cache", methods=["GET"])
+def api_cache():
+    return jsonify(prediction_cache.stats())
+
+@server.route("/api/timings", methods=["GET"])
+def api_timings():
+    return jsonify(model_runner.stats())
+
+profiling.end_startup(startup_profile)
+
 # Main
 if __name__ == "__main__":
     app.run_server(debug=True, use_reloader=False)
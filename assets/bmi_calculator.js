@@ -0,0 +1,23 @@
+if (!window.dash_clientside) {
+  window.dash_clientside = {};
+}
+window.dash_clientside.bmi = {
+  // Calculate and Reset buttons of the BMI card. Runs in the browser, so the card never
+  // calls the server; outputs that a click doesn't change are returned as they are.
+  update: function(calculate_clicks, reset_clicks, weight, height, age,
+                   bmi_text, predict_age, predict_bmi, last_clicks) {
+    var clicks = {calculate: calculate_clicks || 0, reset: reset_clicks || 0};
+    last_clicks = last_clicks || {calculate: 0, reset: 0};
+
+    if (clicks.reset > last_clicks.reset) {
+      return [bmi_text, predict_age, predict_bmi, null, null, null, clicks];
+    }
+
+    if (clicks.calculate > last_clicks.calculate && weight && height) {
+      var bmi = (weight / (height * height) * 10000).toFixed(2);
+      return ["Your BMI: " + bmi, age, bmi, height, weight, age, clicks];
+    }
+
+    return [bmi_text, predict_age, predict_bmi, height, weight, age, clicks];
+  }
+};
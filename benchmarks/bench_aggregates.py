@@ -0,0 +1,49 @@
+# Streaming summary of the Data tabs on synthetic extracts of growing size
+#
+#   python benchmarks/bench_aggregates.py [--rows 1000000 10000000] [--dir /tmp/dataset-bench]
+#
+# Each extract is summarized in a fresh process (Linux) with figures.summarize, which reads it in
+# chunks; peak RSS should stay flat as the row count grows.
+
+import argparse
+import json
+import pathlib
+import subprocess
+import sys
+import tempfile
+
+from bench_dataset import write_extract
+from common import PATH
+
+CHILD = """
+import json, sys, time
+sys.path.insert(0, %(root)r)
+import figures
+start = time.perf_counter()
+summary = figures.summarize(%(path)r, %(chunk_rows)d)
+seconds = time.perf_counter() - start
+sizes = {name: len(figures.build_figure(name, summary)) for name in figures.DATA_FIGURES}
+with open("/proc/self/status") as f:
+    peak_mb = [int(line.split()[1]) / 1024.0 for line in f if line.startswith("VmHWM:")][0]
+print(json.dumps({"rows": summary.rows, "seconds": seconds, "peak_mb": peak_mb, "figure_kb": sum(sizes.values()) / 1e3}))
+"""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000000, 10000000])
+    parser.add_argument("--chunk-rows", type=int, default=200000)
+    parser.add_argument("--dir", default=None, help="where to write the extracts (default: a temporary directory)")
+    args = parser.parse_args()
+
+    directory = pathlib.Path(args.dir or tempfile.mkdtemp(prefix="dataset-bench-"))
+    directory.mkdir(parents=True, exist_ok=True)
+
+    print("%12s %10s %14s %16s" % ("rows", "wall s", "peak RSS MB", "figures KB"))
+    for rows in args.rows:
+        path = directory.joinpath("extract-%d.csv" % rows)
+        if not path.exists():
+            write_extract(path, rows)
+        code = CHILD % {"root": str(PATH), "path": str(path), "chunk_rows": args.chunk_rows}
+        result = json.loads(subprocess.check_output([sys.executable, "-c", code], cwd=str(PATH)).decode().splitlines()[-1])
+        print("%12d %10.2f %14.1f %16.1f" % (result["rows"], result["seconds"], result["peak_mb"], result["figure_kb"]))
@@ -0,0 +1,81 @@
+# Load time and memory of the dataset loaders on a synthetic extract (default 10M rows)
+#
+#   python benchmarks/bench_dataset.py [--rows 10000000] [--dir /tmp/dataset-bench]
+#
+# The extract has the columns and value ranges of insurance.csv. Each loader runs in a fresh
+# process (Linux), so peak RSS includes the parser's temporary memory and the cache runs really start cold.
+
+import argparse
+import json
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from common import DATA_PATH, PATH
+from features import FeatureEncoder, random_profiles
+
+LOADERS = {
+    "pd.read_csv (default dtypes)": "df = pd.read_csv(path)",
+    "load_dataset, no cache": "df = datasets.load_dataset(path, cache=False)",
+    "load_dataset, first start": "df = datasets.load_dataset(path, cache_path=cache_path)",
+    "load_dataset, cached": "df = datasets.load_dataset(path, cache_path=cache_path)",
+}
+
+CHILD = """
+import json, sys, time
+sys.path.insert(0, %(root)r)
+import pandas as pd
+import datasets
+def peak_mb():
+    # VmHWM starts over at exec, unlike ru_maxrss which a child inherits from its parent
+    with open("/proc/self/status") as f:
+        return [int(line.split()[1]) / 1024.0 for line in f if line.startswith("VmHWM:")][0]
+path, cache_path = %(path)r, %(cache_path)r
+start = time.perf_counter()
+%(load)s
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "frame_mb": df.memory_usage(deep=True).sum() / 1e6,
+                  "peak_mb": peak_mb()}))
+"""
+
+
+def write_extract(path, rows, seed=0):
+    # Random profiles over the training domain with charges drawn from the real ones
+    df = pd.read_csv(DATA_PATH.joinpath("insurance.csv"))
+    extract = random_profiles(FeatureEncoder.fit(df), rows, seed)
+    extract["bmi"] = np.round(extract["bmi"].values, 3)
+    extract["charges"] = np.random.RandomState(seed).choice(df["charges"].values, rows)
+    extract.to_csv(path, index=False)
+
+
+def run_loader(load, path, cache_path):
+    code = CHILD % {"root": str(PATH), "path": str(path), "cache_path": str(cache_path), "load": load}
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=str(PATH))
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000000)
+    parser.add_argument("--dir", default=None, help="where to write the extract (default: a temporary directory)")
+    args = parser.parse_args()
+
+    directory = pathlib.Path(args.dir or tempfile.mkdtemp(prefix="dataset-bench-"))
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory.joinpath("extract.csv")
+    cache_path = directory.joinpath("cache")
+    if not path.exists():
+        write_extract(path, args.rows)
+
+    print("%d rows, %.0f MB CSV" % (args.rows, path.stat().st_size / 1e6))
+    print("%-30s %10s %12s %14s" % ("loader", "load s", "frame MB", "peak RSS MB"))
+    for label, load in LOADERS.items():
+        if label == "load_dataset, first start" and cache_path.exists():
+            shutil.rmtree(str(cache_path))
+        result = run_loader(load, path, cache_path)
+        print("%-30s %10.2f %12.1f %14.1f" % (label, result["seconds"], result["frame_mb"], result["peak_mb"]))
@@ -0,0 +1,63 @@
+# Micro-benchmark: per-row feature encoding cost, pandas/OneHotEncoder chain vs FeatureEncoder
+#
+#   python benchmarks/bench_encoding.py
+
+import pandas as pd
+from sklearn.preprocessing import OneHotEncoder
+
+from common import DATA_PATH, best_time
+from features import FeatureEncoder
+
+df = pd.read_csv(DATA_PATH.joinpath("insurance.csv"))
+columns = ["age", "sex", "bmi", "children", "smoker", "region"]
+
+ohe_smoker = OneHotEncoder(drop='first').fit(df["smoker"].values.reshape(-1,1))
+ohe_sex = OneHotEncoder(drop='first').fit(df["sex"].values.reshape(-1,1))
+ohe_region = OneHotEncoder(drop='first').fit(df["region"].values.reshape(-1,1))
+
+encoder = FeatureEncoder.fit(df)
+
+
+# The chain app.py used before FeatureEncoder
+def pandas_chain(sample):
+    sample = pd.concat(
+        [
+            sample,
+            pd.DataFrame(ohe_smoker.transform(sample["smoker"].values.reshape(-1,1)).toarray(),
+                        columns = ohe_smoker.get_feature_names(['smoker'])).astype(int)
+        ], axis=1).drop("smoker", axis=1)
+    
+    sample = pd.concat(
+        [
+            sample,
+            pd.DataFrame(ohe_sex.transform(sample["sex"].values.reshape(-1,1)).toarray(),
+                        columns = ohe_sex.get_feature_names(['sex'])).astype(int)
+        ], axis=1).drop("sex", axis=1)
+    
+    sample = pd.concat(
+        [
+            sample,
+            pd.DataFrame(ohe_region.transform(sample["region"].values.reshape(-1,1)).toarray(),
+                        columns = ohe_region.get_feature_names(['region'])).astype(int)
+        ], axis=1).drop("region", axis=1)
+    
+    return sample.values
+
+
+def bench(label, func, rows, number):
+    seconds = best_time(func, number)
+    print("%-40s %10.2f us/call %10.3f us/row" % (label, seconds * 1e6, seconds * 1e6 / rows))
+
+
+if __name__ == "__main__":
+    row = [19, "female", 27.9, 0, "yes", "southwest"]
+    batch = df[columns]
+
+    # Both paths must produce the same matrix
+    assert (pandas_chain(batch) == encoder.transform(batch)).all()
+    assert (pandas_chain(pd.DataFrame([row], columns=columns)) == encoder.transform_row(*row)).all()
+
+    bench("single row, pandas chain", lambda: pandas_chain(pd.DataFrame([row], columns=columns)), 1, 200)
+    bench("single row, FeatureEncoder.transform_row", lambda: encoder.transform_row(*row), 1, 20000)
+    bench("%d rows, pandas chain" % len(batch), lambda: pandas_chain(batch), len(batch), 50)
+    bench("%d rows, FeatureEncoder.transform" % len(batch), lambda: encoder.transform(batch), len(batch), 200)
@@ -0,0 +1,76 @@
+# Random Forest: sklearn GridSearchCV pickle vs memory-mapped CompactForest arrays
+#
+#   python model_store.py
+#   python benchmarks/bench_forest.py
+#
+# Load time and RSS are measured in fresh interpreters so the two models don't share a heap. The
+# batch-size sweep shows where sklearn overtakes CompactForest (RF_BATCH_ROWS in app.py).
+
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from common import DATA_PATH, best_time, rss_mb
+
+RF_PATH = DATA_PATH.joinpath("random_forest_model.sav")
+COMPACT_PATH = DATA_PATH.joinpath("models", "random_forest")
+
+
+def measure_load(kind):
+    before = rss_mb()
+    start = time.perf_counter()
+    if kind == "sklearn":
+        import joblib
+        joblib.load(RF_PATH)
+    else:
+        from model_store import load_model
+        load_model(COMPACT_PATH)
+    seconds = time.perf_counter() - start
+    print(json.dumps({"seconds": seconds, "rss_mb": rss_mb() - before}))
+
+
+def load_in_subprocess(kind):
+    out = subprocess.check_output([sys.executable, __file__, "--load", kind])
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--load":
+        measure_load(sys.argv[2])
+        sys.exit()
+
+    import joblib
+    from sklearn.preprocessing import StandardScaler
+    from features import FeatureEncoder
+    from model_store import load_model
+
+    df = pd.read_csv(DATA_PATH.joinpath("insurance.csv"))
+    X = StandardScaler().fit_transform(FeatureEncoder.fit(df).transform(df))
+
+    rf_model = joblib.load(RF_PATH)
+    compact = load_model(COMPACT_PATH)
+
+    # Predictions must match sklearn exactly, for single rows and for the batch
+    assert np.array_equal(rf_model.predict(X), compact.predict(X))
+    assert all(np.array_equal(rf_model.predict(X[i:i + 1]), compact.predict(X[i])) for i in range(20))
+
+    print("%d trees, %d nodes, depth %d" % (compact.n_estimators, compact.node_count, compact.depth))
+    print("%-10s %12s %12s %16s %16s" % ("", "load (s)", "RSS (MB)", "1 row (ms)", "%d rows (ms)" % len(X)))
+    for kind, model in (("sklearn", rf_model), ("compact", compact)):
+        load = load_in_subprocess(kind)
+        single = best_time(lambda: model.predict(X[:1]), number=10)
+        batch = best_time(lambda: model.predict(X), number=1, repeat=3)
+        print("%-10s %12.3f %12.1f %16.3f %16.1f" % (kind, load["seconds"], load["rss_mb"], single * 1e3, batch * 1e3))
+
+    # Where sklearn's compiled trees overtake CompactForest (the bundle's rf_batch_rows)
+    print()
+    print("%8s %14s %14s" % ("rows", "sklearn (ms)", "compact (ms)"))
+    rng = np.random.RandomState(0)
+    for rows in (1, 100, 250, 500, 1000, 5000, 20000):
+        X_rows = X[rng.randint(0, len(X), rows)]
+        times = [best_time(lambda: model.predict(X_rows), number=1, repeat=3) for model in (rf_model, compact)]
+        print("%8d %14.1f %14.1f" % (rows, times[0] * 1e3, times[1] * 1e3))
@@ -0,0 +1,33 @@
+# Lasso pipeline: sklearn StandardScaler -> PolynomialFeatures -> Lasso vs SparseQuadratic
+#
+#   python benchmarks/bench_lasso.py
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from common import DATA_PATH, best_time
+from features import FeatureEncoder, random_profiles
+from polynomial import SparseQuadratic
+
+df = pd.read_csv(DATA_PATH.joinpath("insurance.csv"))
+encoder = FeatureEncoder.fit(df)
+X = encoder.transform(df)
+X_large = encoder.transform(random_profiles(encoder, 100000, seed=0))
+
+lasso_model = joblib.load(DATA_PATH.joinpath("lasso_model.sav"))
+sparse = SparseQuadratic.from_estimator(lasso_model)
+
+# Must match sklearn to float rounding, for single rows and for batches
+for rows in (X[:1], X, X_large):
+    expected = lasso_model.predict(rows)
+    assert np.allclose(sparse.predict(rows), expected, rtol=1e-9, atol=1e-6)
+
+n_coef = len(lasso_model.best_estimator_.steps[-1][1].coef_)
+print("%d polynomial terms, %d non-zero after folding the scaler" % (n_coef + 1, sparse.n_terms))
+print("%-10s %14s %18s %18s" % ("", "1 row (us)", "%d rows (ms)" % len(X), "%d rows (ms)" % len(X_large)))
+for kind, model in (("sklearn", lasso_model), ("sparse", sparse)):
+    single = best_time(lambda: model.predict(X[:1]), number=200)
+    batch = best_time(lambda: model.predict(X), number=20)
+    large = best_time(lambda: model.predict(X_large), number=1, repeat=3)
+    print("%-10s %14.1f %18.2f %18.1f" % (kind, single * 1e6, batch * 1e3, large * 1e3))
@@ -0,0 +1,105 @@
+# Per-worker memory and boot time of `gunicorn app:server` with 1, 4 and 16 workers (Linux)
+#
+#   python model_store.py                       # export the memory-mapped models first
+#   python benchmarks/bench_worker_rss.py
+#   python benchmarks/bench_worker_rss.py --no-store
+#   python benchmarks/bench_worker_rss.py --config gunicorn.conf.py    # defaults vs the config
+#
+# Every worker is warmed with a few /api/predict batches so all model pages are touched. PSS
+# charges shared pages proportionally, so total PSS is the real footprint on the host. Boot time
+# runs from starting gunicorn until every worker is up and the first page has been served.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+from common import DATA_PATH, PATH, child_pids, memory_info
+
+
+def start_gunicorn(app, workers, port, env, config=None):
+    # Command-line settings win over the config file, so -w and -b apply either way. Without a
+    # config, an empty one stops gunicorn >= 20 from picking up ./gunicorn.conf.py on its own
+    options = ["-c", config or os.devnull]
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn"] + options + ["-w", str(workers), "-b", "127.0.0.1:%d" % port, app],
+        cwd=str(PATH), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_ready(proc, port, workers, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("gunicorn exited with code %d" % proc.returncode)
+        if len(child_pids(proc.pid)) == workers:
+            try:
+                urllib.request.urlopen("http://127.0.0.1:%d/" % port, timeout=5).read()
+                return
+            except OSError:
+                pass
+        time.sleep(0.1)
+    raise RuntimeError("gunicorn did not start within %d s" % timeout)
+
+
+def warm(port, requests):
+    body = DATA_PATH.joinpath("insurance.csv").read_bytes()
+    for _ in range(requests):
+        req = urllib.request.Request("http://127.0.0.1:%d/api/predict" % port, data=body,
+                                     headers={"Content-Type": "text/csv"})
+        urllib.request.urlopen(req, timeout=300).read()
+
+
+def measure(app, workers, port, env, warm_requests, config=None):
+    start = time.perf_counter()
+    proc = start_gunicorn(app, workers, port, env, config)
+    try:
+        wait_ready(proc, port, workers)
+        boot = time.perf_counter() - start
+        warm(port, warm_requests * workers)
+        usage = [memory_info(pid) for pid in child_pids(proc.pid)]
+        master = memory_info(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    return {
+        "config": config or "defaults",
+        "workers": workers,
+        "boot_s": boot,
+        "master_rss_mb": master["rss"],
+        "worker_rss_mb": sum(u["rss"] for u in usage) / len(usage),
+        "worker_pss_mb": sum(u["pss"] for u in usage) / len(usage),
+        "worker_uss_mb": sum(u["uss"] for u in usage) / len(usage),
+        "total_pss_mb": master["pss"] + sum(u["pss"] for u in usage),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--app", default="app:server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--warm-requests", type=int, default=3, help="predict batches per worker")
+    parser.add_argument("--no-store", action="store_true", help="load the .sav pickles instead of data/models")
+    parser.add_argument("--config", default=None, help="also measure with this gunicorn config file")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    env = dict(os.environ, MODEL_STORE="0" if args.no_store else "1")
+    configs = [None, args.config] if args.config else [None]
+    results = [measure(args.app, n, args.port, env, args.warm_requests, config)
+               for n in args.workers for config in configs]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("%-18s %8s %10s %12s %12s %12s %12s" % ("config", "workers", "boot (s)", "RSS (MB)", "PSS (MB)",
+                                                      "USS (MB)", "total PSS"))
+        for r in results:
+            print("%-18s %8d %10.2f %12.1f %12.1f %12.1f %12.1f" % (
+                r["config"], r["workers"], r["boot_s"], r["worker_rss_mb"], r["worker_pss_mb"],
+                r["worker_uss_mb"], r["total_pss_mb"]))
@@ -0,0 +1,52 @@
+# Shared helpers for the benchmark scripts
+
+import pathlib
+import resource
+import sys
+import timeit
+
+PATH = pathlib.Path(__file__).resolve().parent.parent
+DATA_PATH = PATH.joinpath("data")
+
+if str(PATH) not in sys.path:
+    sys.path.insert(0, str(PATH))
+
+
+def rss_mb(pid="self"):
+    # Current resident set size; falls back to the peak RSS where /proc is unavailable
+    try:
+        with open("/proc/%s/status" % pid) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def best_time(func, number, repeat=5):
+    # Best per-call wall time in seconds
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def memory_info(pid):
+    # RSS, PSS (shared pages split between the processes mapping them) and USS in MB, Linux only
+    fields = {}
+    with open("/proc/%d/smaps_rollup" % pid) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024.0
+    return {
+        "rss": fields.get("Rss", 0.0),
+        "pss": fields.get("Pss", 0.0),
+        "uss": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0),
+    }
+
+
+def child_pids(pid):
+    try:
+        with open("/proc/%d/task/%d/children" % (pid, pid)) as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
@@ -0,0 +1,300 @@
+# Load test: browser sessions replayed against `gunicorn app:server` (Linux)
+#
+#   python benchmarks/load_test.py [--workers 2] [--worker-class sync] [--threads 1]
+#                                  [--concurrency 1 4 16] [--duration 30] [--out load.json]
+#                                  [--baseline load.json] [--threshold 1.25] [--config gunicorn.conf.py]
+#   python benchmarks/load_test.py --url http://127.0.0.1:8050 ...   # a server that is already running
+#
+# Each virtual user repeats one session and never pauses:
+# - The page load. That is the index page, /_dash-layout and /_dash-dependencies, then the initial
+#   callbacks: the Data Analysis tab and the three result cards with no click yet.
+# - --predicts predictions, each for a random profile. A prediction is the three result-card
+#   callbacks, sent together as the browser sends them.
+# The BMI calculator is a clientside callback and sends no request. The requests carry the Dash 1.x
+# /_dash-update-component payloads. JS/CSS assets are not fetched because browsers cache them.
+#
+# For every concurrency level, after --warmup seconds, it reports throughput, the p50/p95/p99 latency
+# of all requests and of the predict callbacks alone, and the workers' CPU (in cores) and peak RSS.
+# With --baseline the numbers are compared like run.py does; throughput is compared as seconds per
+# request, so every metric is lower-is-better. The client runs in this process; on a small machine,
+# check that it is not the bottleneck (the server's CPU should be near workers x 1 core at saturation).
+
+import argparse
+import concurrent.futures
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+from bench_worker_rss import wait_ready
+from common import PATH, child_pids, rss_mb
+from run import callback_body, compare
+
+CARDS = ("rf_result", "lasso_result", "svr_result")
+REGIONS = ("southwest", "southeast", "northwest", "northeast")
+
+
+def start_gunicorn(app, port, workers, worker_class, threads, env, config=None):
+    # As in bench_worker_rss.py: without --config an empty config stops gunicorn >= 20 from loading
+    # ./gunicorn.conf.py on its own; the command-line settings win over the config file either way
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", config or os.devnull, "-b", "127.0.0.1:%d" % port,
+         "-w", str(workers), "-k", worker_class, "--threads", str(threads), "--timeout", "120", app],
+        cwd=str(PATH), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def random_profile(rng):
+    # The predict form's values as the browser sends them
+    return [("predict_age", "value", rng.randint(18, 64)),
+            ("predict_bmi", "value", round(rng.uniform(16, 53), 2)),
+            ("predict_children", "value", str(rng.randint(0, 5))),
+            ("predict_region", "value", rng.choice(REGIONS)),
+            ("predict_sex", "value", rng.choice(("male", "female"))),
+            ("predict_smoker", "value", [1] if rng.random() < 0.2 else [])]
+
+
+def card_body(card, n_clicks, profile):
+    return callback_body((card, "children"), [("btn_predict", "n_clicks", n_clicks)], profile)
+
+
+# Virtual users
+# -----------------------------------------------------------------------------------------------
+
+class LoadTest:
+
+    def __init__(self, url, concurrency, predicts, seed=0):
+        parts = urllib.parse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.concurrency = concurrency
+        self.predicts = predicts
+        self.seed = seed
+        self.records = []
+        self.stopping = threading.Event()
+        self._local = threading.local()
+        # The three card requests of a prediction go out on connections of their own
+        self._cards = concurrent.futures.ThreadPoolExecutor(max_workers=len(CARDS) * concurrency)
+
+    def request(self, kind, method, path, body=None):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            status = 0
+        end = time.perf_counter()
+        self.records.append((kind, status, end - start, end))
+
+    def callback(self, kind, body):
+        self.request(kind, "POST", "/_dash-update-component", body)
+
+    def cards(self, n_clicks, profile):
+        futures = [self._cards.submit(self.callback, "predict" if n_clicks else "card_init",
+                                      card_body(card, n_clicks, profile)) for card in CARDS]
+        concurrent.futures.wait(futures)
+
+    def session(self, rng):
+        for path, kind in (("/", "index"), ("/_dash-layout", "layout"), ("/_dash-dependencies", "dependencies")):
+            self.request(kind, "GET", path)
+        self.callback("render_tab", callback_body(("tab_content", "children"), [("tabs", "value", "analysis")]))
+        profile = random_profile(rng)
+        self.cards(0, profile)
+        for n_clicks in range(1, self.predicts + 1):
+            if self.stopping.is_set():
+                return
+            self.cards(n_clicks, random_profile(rng))
+
+    def user(self, index):
+        rng = random.Random(self.seed * 1000003 + index)
+        while not self.stopping.is_set():
+            self.session(rng)
+
+    def start(self):
+        self._users = [threading.Thread(target=self.user, args=(i,), daemon=True) for i in range(self.concurrency)]
+        for thread in self._users:
+            thread.start()
+
+    def stop(self):
+        # Sessions end after their current request; returns when every user has stopped
+        self.stopping.set()
+        for thread in self._users:
+            thread.join()
+        self._cards.shutdown()
+
+
+# Worker usage
+# -----------------------------------------------------------------------------------------------
+
+def cpu_seconds(pids):
+    # User + system CPU time of the processes, from /proc/<pid>/stat
+    total = 0
+    for pid in pids:
+        try:
+            with open("/proc/%d/stat" % pid) as f:
+                fields = f.read().rpartition(")")[2].split()
+            total += int(fields[11]) + int(fields[12])
+        except OSError:
+            pass
+    return total / float(os.sysconf("SC_CLK_TCK"))
+
+
+class UsageMonitor(threading.Thread):
+    # Peak RSS of the workers, polled while the load runs
+
+    def __init__(self, master_pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peak_worker_mb = 0.0
+        self.peak_total_mb = 0.0
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            rss = [rss_mb(pid) for pid in child_pids(self.master_pid)]
+            if rss:
+                self.peak_worker_mb = max(self.peak_worker_mb, max(rss))
+                self.peak_total_mb = max(self.peak_total_mb, sum(rss))
+
+
+def percentiles(seconds):
+    if not seconds:
+        return {}
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+    return {"p50": 1e3 * p50, "p95": 1e3 * p95, "p99": 1e3 * p99}
+
+
+def measure(url, master_pid, concurrency, duration, warmup, predicts, seed):
+    test = LoadTest(url, concurrency, predicts, seed)
+    test.start()
+    time.sleep(warmup)
+
+    # Requests, CPU time and RSS are counted from the end of the warm-up
+    start = time.perf_counter()
+    monitor = None
+    if master_pid:
+        monitor = UsageMonitor(master_pid)
+        monitor.start()
+        cpu = cpu_seconds(child_pids(master_pid))
+    time.sleep(duration)
+    if monitor:
+        cpu = cpu_seconds(child_pids(master_pid)) - cpu
+        monitor.done.set()
+        monitor.join()
+    wall = time.perf_counter() - start
+    test.stop()
+
+    # Only requests that completed inside the measured window
+    measured = [r for r in test.records if start <= r[3] <= start + wall]
+    ok = [r for r in measured if r[1] in (200, 204)]
+    result = {
+        "concurrency": concurrency,
+        "requests": len(measured),
+        "errors": len(measured) - len(ok),
+        "throughput": len(ok) / wall,
+        "predictions_per_s": sum(r[0] == "predict" for r in ok) / len(CARDS) / wall,
+        "latency_ms": percentiles([r[2] for r in ok]),
+        "predict_latency_ms": percentiles([r[2] for r in ok if r[0] == "predict"]),
+    }
+    if monitor:
+        result.update(worker_cpu_cores=cpu / wall, worker_peak_rss_mb=monitor.peak_worker_mb,
+                      workers_peak_rss_mb=monitor.peak_total_mb)
+    return result
+
+
+def as_metrics(results):
+    # Flat lower-is-better metrics for run.compare
+    metrics = {}
+    for r in results:
+        prefix = "load.c%d." % r["concurrency"]
+        if r["throughput"]:
+            metrics[prefix + "ms_per_request"] = {"value": 1e3 / r["throughput"], "unit": "ms"}
+        for group in ("latency_ms", "predict_latency_ms"):
+            for name, value in r[group].items():
+                metrics["%s%s.%s" % (prefix, group.replace("_ms", ""), name)] = {"value": value, "unit": "ms"}
+        if "worker_peak_rss_mb" in r:
+            metrics[prefix + "worker_peak_rss"] = {"value": r["worker_peak_rss_mb"], "unit": "MB"}
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=None, help="load an already running server instead of starting gunicorn")
+    parser.add_argument("--app", default="app:server")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--worker-class", default="sync", help="gunicorn -k: sync, gthread, gevent, ...")
+    parser.add_argument("--threads", type=int, default=1, help="threads per worker (gthread)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds per concurrency")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of load before measuring")
+    parser.add_argument("--predicts", type=int, default=5, help="predictions per session")
+    parser.add_argument("--no-cache", action="store_true", help="start the app with the prediction cache off")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    parser.add_argument("--config", default=None, help="gunicorn config file (default: none)")
+    args = parser.parse_args()
+
+    proc = None
+    url = args.url
+    if url is None:
+        env = dict(os.environ, PREDICTION_CACHE_SIZE="0") if args.no_cache else dict(os.environ)
+        proc = start_gunicorn(args.app, args.port, args.workers, args.worker_class, args.threads, env,
+                              args.config)
+        url = "http://127.0.0.1:%d" % args.port
+    try:
+        if proc is not None:
+            wait_ready(proc, args.port, args.workers)
+        results = [measure(url, proc.pid if proc else None, c, args.duration, args.warmup, args.predicts, args.seed)
+                   for c in args.concurrency]
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    config = {"url": args.url, "workers": args.workers, "worker_class": args.worker_class,
+              "threads": args.threads, "predicts": args.predicts, "no_cache": args.no_cache,
+              "duration": args.duration, "cpus": os.cpu_count(), "config": args.config or "defaults"}
+    metrics = as_metrics(results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"meta": config, "results": results, "metrics": metrics}, f, indent=2, sort_keys=True)
+
+    print("%s, %s workers x %d threads" % (args.worker_class, args.workers if proc else "?", args.threads))
+    print("%6s %8s %7s %9s %8s %8s %8s %11s %8s %10s" % ("users", "requests", "errors", "req/s", "p50 ms",
+                                                         "p95 ms", "p99 ms", "predict p95", "CPU", "worker MB"))
+    for r in results:
+        latency, predict = r["latency_ms"], r["predict_latency_ms"]
+        print("%6d %8d %7d %9.1f %8.1f %8.1f %8.1f %11.1f %8.2f %10.1f" % (
+            r["concurrency"], r["requests"], r["errors"], r["throughput"], latency.get("p50", 0),
+            latency.get("p95", 0), latency.get("p99", 0), predict.get("p95", 0),
+            r.get("worker_cpu_cores", 0), r.get("worker_peak_rss_mb", 0)))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["metrics"]
+        rows = compare(metrics, baseline, args.threshold)
+        print()
+        print("%-40s %12s %12s %8s" % ("metric", "baseline", "current", "ratio"))
+        for name, unit, before, after, ratio, regressed in rows:
+            print("%-40s %9.3f %-2s %9.3f %-2s %7.2fx%s" % (name, before, unit, after, unit, ratio,
+                                                           "  REGRESSION" if regressed else ""))
+        regressions = sum(row[-1] for row in rows)
+        print("%d of %d metrics more than %.2fx the baseline" % (regressions, len(rows), args.threshold))
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,302 @@
+# Benchmark suite: start-up, model inference, Dash callbacks and payload sizes
+#
+#   python benchmarks/run.py [--out results.json] [--baseline baseline.json] [--threshold 1.25]
+#                            [--groups startup models callbacks sizes]
+#
+# Every group runs in a fresh interpreter, so import and load times are cold. Results are written
+# as JSON ({"meta": ..., "metrics": {name: {"value": ..., "unit": ...}}}); with --baseline each
+# metric is compared against a stored run and the command exits with status 1 when any metric is
+# more than --threshold times the baseline (every metric is lower-is-better). Save a run on the
+# current main branch as the baseline, then rerun after retraining a model or upgrading a package.
+#
+# The app is benchmarked as deployed: the model store when data/models/bundle.json exists, else
+# the .sav pickles. The prediction cache is disabled so every callback runs the models.
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from common import DATA_PATH, PATH
+
+GROUPS = ["startup", "models", "callbacks", "sizes"]
+
+# Calls per latency measurement; the median and the 95th percentile are reported
+ROW_CALLS = 200
+BATCH_CALLS = 10
+CALLBACK_CALLS = 50
+
+
+def latency(func, calls):
+    # Median and 95th percentile wall time of `calls` calls, in milliseconds
+    func()
+    times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return 1e3 * float(np.median(times)), 1e3 * float(np.percentile(times, 95))
+
+
+def timed(metrics, name, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    metrics[name] = {"value": 1e3 * (time.perf_counter() - start), "unit": "ms"}
+    return result
+
+
+def add_latency(metrics, name, func, calls):
+    median, p95 = latency(func, calls)
+    metrics[name + ".median"] = {"value": median, "unit": "ms"}
+    metrics[name + ".p95"] = {"value": p95, "unit": "ms"}
+
+
+# Groups (each runs in its own process)
+# -----------------------------------------------------------------------------------------------
+
+def bench_startup():
+    # The steps app.py runs at import, one at a time, then `import app` as a whole
+    import datasets
+    import evaluation
+    import figures
+    import model_store
+
+    metrics = {}
+    csv_path = DATA_PATH.joinpath("insurance.csv")
+    timed(metrics, "startup.read_csv", datasets.load_dataset, csv_path, False)
+    df = timed(metrics, "startup.read_dataset_cached", datasets.load_dataset, csv_path)
+    timed(metrics, "startup.fit_preprocessing", model_store.fit_preprocessing, df)
+
+    store_path = DATA_PATH.joinpath("models")
+    if store_path.joinpath("bundle.json").exists():
+        bundle = timed(metrics, "startup.load_model_store", model_store.load_bundle, store_path)
+        source = evaluation.store_source(store_path)
+    else:
+        import joblib
+
+        for name, path in evaluation.PICKLE_FILES.items():
+            timed(metrics, "startup.joblib_load.%s" % name, joblib.load, str(path))
+        source = evaluation.pickle_source()
+        bundle = evaluation.load_source(source, df)
+
+    summary = timed(metrics, "startup.summarize_dataset", figures.summarize, df)
+    for name in figures.DATA_FIGURES:
+        timed(metrics, "startup.build_figure.%s" % name, figures.build_figure, name, summary)
+    scores = timed(metrics, "startup.score_models", evaluation.evaluate_bundle, bundle, df, source)
+    for name in figures.PERFORMANCE_FIGURES:
+        timed(metrics, "startup.build_figure.%s" % name, figures.build_figure, name, scores)
+    return metrics
+
+
+def bench_import():
+    metrics = {}
+    sys.path.insert(0, str(PATH))
+    os.chdir(str(PATH))
+    timed(metrics, "startup.import_app", __import__, "app")
+    return metrics
+
+
+def bench_models():
+    import datasets
+    import evaluation
+    import model_store
+    from features import FeatureEncoder, random_profiles
+
+    df = datasets.load_dataset(DATA_PATH.joinpath("insurance.csv"), cache=False)
+    store_path = DATA_PATH.joinpath("models")
+    if store_path.joinpath("bundle.json").exists():
+        bundle = model_store.load_bundle(store_path)
+    else:
+        bundle = evaluation.load_source(evaluation.pickle_source(), df)
+
+    encoder = bundle.encoder
+    profiles = random_profiles(FeatureEncoder.fit(df), 100000, seed=0)
+    row = tuple(profiles.iloc[0])
+    X_row, X_data, X_large = encoder.transform_row(*row), encoder.transform(df), encoder.transform(profiles)
+
+    metrics = {}
+    add_latency(metrics, "models.encode_row", lambda: encoder.transform_row(*row), ROW_CALLS)
+    add_latency(metrics, "models.encode_100k", lambda: encoder.transform(profiles), BATCH_CALLS)
+    for name in model_store.MODEL_NAMES:
+        add_latency(metrics, "models.%s.row" % name, lambda: bundle.predict_model(name, X_row), ROW_CALLS)
+        add_latency(metrics, "models.%s.dataset" % name, lambda: bundle.predict_model(name, X_data), BATCH_CALLS)
+        add_latency(metrics, "models.%s.100k" % name, lambda: bundle.predict_model(name, X_large), 3)
+    return metrics
+
+
+def callback_body(output, inputs, state=()):
+    # A /_dash-update-component request as the Dash 1.x renderer sends it
+    def props(items):
+        return [{"id": component, "property": prop, "value": value} for component, prop, value in items]
+
+    component, prop = output
+    return {
+        "output": "%s.%s" % (component, prop),
+        "outputs": {"id": component, "property": prop},
+        "inputs": props(inputs),
+        "state": props(state),
+        "changedPropIds": ["%s.%s" % (c, p) for c, p, _ in inputs],
+    }
+
+
+def predict_body(card, bmi):
+    return callback_body(
+        (card, "children"),
+        [("btn_predict", "n_clicks", 1)],
+        [("predict_age", "value", 40), ("predict_bmi", "value", bmi), ("predict_children", "value", 2),
+         ("predict_region", "value", "southeast"), ("predict_sex", "value", "male"),
+         ("predict_smoker", "value", ["yes"])],
+    )
+
+
+def bench_callbacks():
+    os.environ["PREDICTION_CACHE_SIZE"] = "0"
+    sys.path.insert(0, str(PATH))
+    os.chdir(str(PATH))
+    import app
+
+    client = app.server.test_client()
+    metrics = {}
+
+    def post(body):
+        response = client.post("/_dash-update-component", json=body)
+        if response.status_code != 200:
+            raise RuntimeError("callback failed with status %d" % response.status_code)
+        return response
+
+    for card in ("rf_result", "lasso_result", "svr_result"):
+        # A different BMI on every call, so nothing is answered from an earlier prediction
+        bmis = iter(np.round(np.linspace(20, 40, CALLBACK_CALLS + 1), 2).tolist())
+        add_latency(metrics, "callbacks.predict.%s" % card, lambda: post(predict_body(card, next(bmis))),
+                    CALLBACK_CALLS)
+
+    for tab in ("analysis", "distribution", "performance", "about"):
+        body = callback_body(("tab_content", "children"), [("tabs", "value", tab)])
+        add_latency(metrics, "callbacks.render_tab.%s" % tab, lambda: post(body), CALLBACK_CALLS)
+
+    csv = DATA_PATH.joinpath("insurance.csv").read_bytes()
+    add_latency(metrics, "callbacks.api_predict_dataset",
+                lambda: client.post("/api/predict", data=csv, content_type="text/csv"), BATCH_CALLS)
+    return metrics
+
+
+def bench_sizes():
+    sys.path.insert(0, str(PATH))
+    os.chdir(str(PATH))
+    import app
+
+    client = app.server.test_client()
+    metrics = {}
+    for path in ("/", "/_dash-layout", "/_dash-dependencies"):
+        response = client.get(path)
+        if response.status_code != 200:
+            raise RuntimeError("GET %s failed with status %d" % (path, response.status_code))
+        size = len(response.get_data())
+        metrics["sizes.%s" % (path.strip("/") or "index")] = {"value": size / 1e3, "unit": "KB"}
+    for name in sorted(app.figures.FIGURES):
+        metrics["sizes.figure.%s" % name] = {"value": len(app.figure_json(name)) / 1e3, "unit": "KB"}
+    for tab in ("analysis", "distribution", "performance", "about"):
+        body = callback_body(("tab_content", "children"), [("tabs", "value", tab)])
+        response = client.post("/_dash-update-component", json=body)
+        if response.status_code != 200:
+            raise RuntimeError("callback failed with status %d" % response.status_code)
+        size = len(response.get_data())
+        metrics["sizes.render_tab.%s" % tab] = {"value": size / 1e3, "unit": "KB"}
+    return metrics
+
+
+CHILDREN = {
+    "startup": [bench_import, bench_startup],
+    "models": [bench_models],
+    "callbacks": [bench_callbacks],
+    "sizes": [bench_sizes],
+}
+
+
+# Runner
+# -----------------------------------------------------------------------------------------------
+
+def run_child(func_name):
+    out = subprocess.check_output([sys.executable, __file__, "--child", func_name], cwd=str(PATH))
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def metadata():
+    import pandas as pd
+    import sklearn
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=str(PATH),
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sklearn": sklearn.__version__,
+        "model_store": DATA_PATH.joinpath("models", "bundle.json").exists(),
+    }
+
+
+def compare(metrics, baseline, threshold):
+    # Rows of (name, unit, baseline, current, ratio, regressed) for metrics present in both runs
+    rows = []
+    for name in sorted(metrics):
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["value"], metrics[name]["value"]
+        ratio = after / before if before else float("inf") if after else 1.0
+        rows.append((name, metrics[name]["unit"], before, after, ratio, ratio > threshold))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="ratio to the baseline above which a metric counts as a regression")
+    parser.add_argument("--groups", nargs="+", choices=GROUPS, default=GROUPS)
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(globals()[args.child]()))
+        sys.exit(0)
+
+    metrics = {}
+    for group in args.groups:
+        for func in CHILDREN[group]:
+            metrics.update(run_child(func.__name__))
+
+    results = {"meta": metadata(), "metrics": metrics}
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if not args.baseline:
+        print("%-50s %12s" % ("metric", "value"))
+        for name in sorted(metrics):
+            print("%-50s %9.3f %-2s" % (name, metrics[name]["value"], metrics[name]["unit"]))
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["metrics"]
+    rows = compare(metrics, baseline, args.threshold)
+    print("%-50s %12s %12s %8s" % ("metric", "baseline", "current", "ratio"))
+    for name, unit, before, after, ratio, regressed in rows:
+        print("%-50s %9.3f %-2s %9.3f %-2s %7.2fx%s" % (name, before, unit, after, unit, ratio,
+                                                       "  REGRESSION" if regressed else ""))
+    regressions = sum(row[-1] for row in rows)
+    print("%d of %d metrics more than %.2fx the baseline" % (regressions, len(rows), args.threshold))
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,89 @@
+# Bounded LRU/TTL cache for model predictions
+# -----------------------------------------------------------------------------------------------
+#
+# Keys are normalized (age, sex, bmi, children, smoker, region) tuples. Every entry is stored
+# under the model version it was computed with (the bundle's serving_version), and lookups only
+# see entries of the current version. set_version switches it and drops the older entries.
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_profile(age, sex, bmi, children, smoker, region):
+    # BMI is kept at the precision shown in the UI ("%.2f"), which is what makes profiles repeat
+    return (float(age), str(sex), float(np.round(float(bmi), 2)), float(children), str(smoker), str(region))
+
+
+class PredictionCache:
+
+    def __init__(self, maxsize=10000, ttl=None, version=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = version
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def set_version(self, version):
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+
+    def get(self, key):
+        with self._lock:
+            key = (self.version, key)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            key = (self.version, key)
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
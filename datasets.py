@@ -0,0 +1,170 @@
+# Typed dataset loader
+# -----------------------------------------------------------------------------------------------
+#
+# pd.read_csv with default dtypes keeps sex/smoker/region as Python string objects and every
+# number as a 64-bit value. load_dataset applies a fixed schema instead: categoricals for the
+# three string columns, int8 for age and children and float32 for BMI (the CSV has at most three
+# decimals). Charges stay float64 because they are the training target and are shown to the cent.
+#
+# CSV, Parquet and Feather/Arrow files are read (the last two need pyarrow). The converted columns
+# are cached as .npy arrays in data/cache/<name>/ (model_store.save_artifact) keyed by the source
+# file's size and modification time, so later starts skip parsing entirely. iter_chunks reads the
+# same formats a chunk at a time for files that do not fit in memory.
+#
+#   python datasets.py [data/insurance.csv] [--no-cache]
+
+import argparse
+import json
+import pathlib
+import time
+
+import numpy as np
+import pandas as pd
+
+import model_store
+
+PATH = pathlib.Path(__file__).parent
+DATA_PATH = PATH.joinpath("data").resolve()
+CACHE_PATH = DATA_PATH.joinpath("cache")
+
+SCHEMA = {
+    "age": "int8",
+    "sex": "category",
+    "bmi": "float32",
+    "children": "int8",
+    "smoker": "category",
+    "region": "category",
+    "charges": "float64",
+}
+SCHEMA_VERSION = 1
+
+
+def read_source(path):
+    path = pathlib.Path(path)
+    suffix = path.suffix.lower()
+    if suffix in (".parquet", ".pq"):
+        return pd.read_parquet(path, columns=list(SCHEMA))
+    if suffix in (".feather", ".arrow"):
+        return pd.read_feather(path, columns=list(SCHEMA))
+    if suffix == ".csv":
+        # Only the string columns get a dtype here; the numeric ones are range-checked below
+        return pd.read_csv(path, usecols=list(SCHEMA),
+                           dtype={col: "category" for col, dtype in SCHEMA.items() if dtype == "category"})
+    raise ValueError("unsupported dataset format: %s" % path.name)
+
+
+def apply_schema(df):
+    missing = [col for col in SCHEMA if col not in df.columns]
+    if missing:
+        raise ValueError("missing columns: " + ", ".join(missing))
+
+    columns = {}
+    for col, dtype in SCHEMA.items():
+        values = df[col]
+        if dtype == "category":
+            values = values.astype("category")
+            # Sorted categories, as FeatureEncoder.fit expects them
+            columns[col] = values.cat.reorder_categories(sorted(values.cat.categories))
+            continue
+        if values.isnull().any():
+            raise ValueError("column %s has empty values" % col)
+        if np.dtype(dtype).kind == "i":
+            info = np.iinfo(dtype)
+            if values.min() < info.min or values.max() > info.max or (values != np.round(values)).any():
+                raise ValueError("column %s does not fit %s" % (col, dtype))
+        columns[col] = values.astype(dtype)
+    return pd.DataFrame(columns, columns=list(SCHEMA))
+
+
+def iter_chunks(path, chunk_rows=200000):
+    # The dataset as typed frames of at most chunk_rows rows, for files larger than memory
+    path = pathlib.Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        reader = pd.read_csv(path, usecols=list(SCHEMA), chunksize=chunk_rows,
+                             dtype={col: "category" for col, dtype in SCHEMA.items() if dtype == "category"})
+        for chunk in reader:
+            yield apply_schema(chunk)
+    elif suffix in (".parquet", ".pq"):
+        import pyarrow.parquet
+
+        for batch in pyarrow.parquet.ParquetFile(str(path)).iter_batches(chunk_rows, columns=list(SCHEMA)):
+            yield apply_schema(batch.to_pandas())
+    elif suffix in (".feather", ".arrow"):
+        import pyarrow.ipc
+
+        reader = pyarrow.ipc.open_file(str(path))
+        for i in range(reader.num_record_batches):
+            yield apply_schema(reader.get_batch(i).to_pandas())
+    else:
+        raise ValueError("unsupported dataset format: %s" % path.name)
+
+
+def source_key(path):
+    stat = pathlib.Path(path).stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "schema": SCHEMA_VERSION}
+
+
+def save_cache(df, cache_path, key):
+    arrays, categories = {}, {}
+    for col, dtype in SCHEMA.items():
+        if dtype == "category":
+            arrays[col] = df[col].cat.codes.values
+            categories[col] = [str(cat) for cat in df[col].cat.categories]
+        else:
+            arrays[col] = df[col].values
+    model_store.save_artifact(cache_path, "dataset", arrays, source=key, categories=categories,
+                              rows=len(df))
+
+
+def load_cache(cache_path, key):
+    # The cached frame, or None when there is no cache or it was built from another file
+    cache_path = pathlib.Path(cache_path)
+    if not cache_path.joinpath("meta.json").exists():
+        return None
+    try:
+        meta, arrays = model_store.load_artifact(cache_path, mmap_mode=None)
+    except (OSError, ValueError):
+        # Another worker is replacing the cache
+        return None
+    if meta.get("kind") != "dataset" or meta.get("source") != key:
+        return None
+
+    columns = {}
+    for col, dtype in SCHEMA.items():
+        if dtype == "category":
+            columns[col] = pd.Categorical.from_codes(arrays[col], meta["categories"][col])
+        else:
+            columns[col] = arrays[col]
+    return pd.DataFrame(columns, columns=list(SCHEMA))
+
+
+def load_dataset(path=DATA_PATH.joinpath("insurance.csv"), cache=True, cache_path=None):
+    path = pathlib.Path(path)
+    if not cache:
+        return apply_schema(read_source(path))
+
+    cache_path = CACHE_PATH.joinpath(path.stem) if cache_path is None else pathlib.Path(cache_path)
+    key = source_key(path)
+    df = load_cache(cache_path, key)
+    if df is None:
+        df = apply_schema(read_source(path))
+        try:
+            save_cache(df, cache_path, key)
+        except OSError:
+            # A read-only deploy still serves, it just parses the file on every start
+            pass
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", default=str(DATA_PATH.joinpath("insurance.csv")))
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = load_dataset(args.path, cache=not args.no_cache)
+    print("%d rows in %.3f s, %.1f MB in memory" % (len(df), time.perf_counter() - start,
+                                                  df.memory_usage(deep=True).sum() / 1e6))
+    print(json.dumps({col: str(dtype) for col, dtype in df.dtypes.items()}, indent=2))
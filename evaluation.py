@@ -0,0 +1,222 @@
+# Model evaluation
+# -----------------------------------------------------------------------------------------------
+#
+# Scores every model of the serving bundle on the notebook's held-out split
+# (train_test_split(test_size=0.25, random_state=42)): R2, RMSE and MAE on the test rows,
+# prediction latency per row (batched and one row at a time) and the size of the model on disk.
+# Each model is scored in its own worker process.
+#
+# Results are cached in data/evaluation.json, one entry per (model hash, dataset hash), so only
+# retrained models are scored again. The Models Performance tab is built from this file.
+#
+#   python evaluation.py [--store data/models] [--data data/insurance.csv] [--jobs 3]
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import pathlib
+import time
+
+import numpy as np
+import pandas as pd
+
+import model_store
+
+PATH = pathlib.Path(__file__).parent
+DATA_FILE = PATH.joinpath("data", "insurance.csv").resolve()
+EVALUATION_PATH = PATH.joinpath("data", "evaluation.json").resolve()
+
+PICKLE_FILES = {
+    "random_forest": PATH.joinpath("data", "random_forest_model.sav"),
+    "lasso": PATH.joinpath("data", "lasso_model.sav"),
+    "svr": PATH.joinpath("data", "svr_model.sav"),
+}
+
+# Single-row latency is the median over this many predict calls
+LATENCY_CALLS = 50
+
+
+# Model Sources
+# -----------------------------------------------------------------------------------------------
+#
+# A source says where the models come from: {"store": path} for an exported model store, or
+# {"pickles": {name: path}} for the notebook's .sav files. Sources are plain dicts so they can be
+# sent to worker processes.
+
+def store_source(store_path=model_store.STORE_PATH):
+    return {"store": str(store_path)}
+
+
+def pickle_source(paths=PICKLE_FILES):
+    return {"pickles": {name: str(path) for name, path in paths.items()}}
+
+
+def load_source(source, df):
+    if "store" in source:
+        return model_store.load_bundle(source["store"])
+    paths = source["pickles"]
+    return model_store.load_pickle_bundle(df, paths["random_forest"], paths["lasso"], paths["svr"])
+
+
+def model_keys(source):
+    # model name -> hash of everything its predictions depend on
+    if "store" in source:
+        digests = model_store.load_manifest(source["store"])["artifacts"]
+        return {name: hashlib.sha256((digests["preprocessing"] + digests[name]).encode()).hexdigest()[:16]
+                for name in model_store.MODEL_NAMES}
+    # pickle bundles refit their scalers from the dataset, which is keyed separately
+    return {name: hashlib.sha256(pathlib.Path(path).read_bytes()).hexdigest()[:16]
+            for name, path in source["pickles"].items()}
+
+
+def model_size(source, name):
+    if "store" in source:
+        return sum(f.stat().st_size for f in pathlib.Path(source["store"]).joinpath(name).iterdir())
+    return os.path.getsize(source["pickles"][name])
+
+
+def dataset_digest(data_path=DATA_FILE):
+    # Read in blocks, so large datasets are hashed in constant memory
+    digest = hashlib.sha256()
+    with open(data_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+# Scoring
+# -----------------------------------------------------------------------------------------------
+
+def score_model(bundle, name, df):
+    _, test = model_store.split_rows(len(df))
+    X_test = bundle.encoder.transform(df.iloc[test])
+    y_test = df["charges"].values[test]
+
+    y_pred = bundle.predict_model(name, X_test)
+    residuals = y_test - y_pred
+
+    batch_times = []
+    for _ in range(3):
+        start = time.perf_counter()
+        bundle.predict_model(name, X_test)
+        batch_times.append(time.perf_counter() - start)
+
+    row_times = []
+    for i in range(min(LATENCY_CALLS, len(X_test))):
+        start = time.perf_counter()
+        bundle.predict_model(name, X_test[i:i + 1])
+        row_times.append(time.perf_counter() - start)
+
+    return {
+        "r2": float(1 - np.sum(residuals ** 2) / np.sum((y_test - y_test.mean()) ** 2)),
+        "rmse": float(np.sqrt(np.mean(residuals ** 2))),
+        "mae": float(np.mean(np.abs(residuals))),
+        "batch_latency_us": 1e6 * min(batch_times) / len(X_test),
+        "row_latency_ms": 1e3 * float(np.median(row_times)),
+        "test_rows": int(len(test)),
+    }
+
+
+def _score_in_worker(source, name, data_path):
+    df = pd.read_csv(data_path)
+    scores = score_model(load_source(source, df), name, df)
+    scores["size_bytes"] = model_size(source, name)
+    return scores
+
+
+def _read_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(entries, path):
+    path = pathlib.Path(path)
+    tmp_path = path.with_name("%s.%d.tmp" % (path.name, os.getpid()))
+    with open(tmp_path, "w") as f:
+        json.dump(entries, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _entry_key(model_key, data_key):
+    return "%s:%s" % (model_key, data_key)
+
+
+def entry_keys(source, data_key):
+    # model name -> key of its scores on the dataset with digest data_key
+    keys = model_keys(source)
+    return {name: _entry_key(keys[name], data_key) for name in model_store.MODEL_NAMES}
+
+
+def load_scores(source, data_path=DATA_FILE, path=EVALUATION_PATH, keys=None):
+    # {model name: scores} for the current models and dataset, or None if any is missing. Hashing
+    # the models and dataset is skipped when their entry_keys are passed in
+    if keys is None:
+        keys = entry_keys(source, dataset_digest(data_path))
+    entries = _read_cache(path)
+
+    scores = {}
+    for name in model_store.MODEL_NAMES:
+        entry = entries.get(keys[name])
+        if entry is None:
+            return None
+        scores[name] = entry["scores"]
+    return scores
+
+
+def evaluate(source, data_path=DATA_FILE, path=EVALUATION_PATH, jobs=None, force=False):
+    # Scores the models that have no cache entry yet, one worker process per model
+    keys = model_keys(source)
+    data_key = dataset_digest(data_path)
+    entries = _read_cache(path)
+
+    missing = [name for name in model_store.MODEL_NAMES
+               if force or _entry_key(keys[name], data_key) not in entries]
+    if missing:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs or len(missing)) as executor:
+            futures = {name: executor.submit(_score_in_worker, source, name, str(data_path)) for name in missing}
+            for name, future in futures.items():
+                entries[_entry_key(keys[name], data_key)] = {"model": name, "scores": future.result()}
+
+    # Only the entries of the current models and dataset are kept
+    current = {_entry_key(keys[name], data_key) for name in model_store.MODEL_NAMES}
+    entries = {key: entry for key, entry in entries.items() if key in current}
+    _write_cache(entries, path)
+
+    return {name: entries[_entry_key(keys[name], data_key)]["scores"] for name in model_store.MODEL_NAMES}
+
+
+def evaluate_bundle(bundle, df, source):
+    # In-process scoring of an already loaded bundle, for when there is no cached evaluation
+    scores = {}
+    for name in model_store.MODEL_NAMES:
+        scores[name] = score_model(bundle, name, df)
+        scores[name]["size_bytes"] = model_size(source, name)
+    return scores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", default=str(model_store.STORE_PATH))
+    parser.add_argument("--data", default=str(DATA_FILE))
+    parser.add_argument("--out", default=str(EVALUATION_PATH))
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="score every model even if it is cached")
+    args = parser.parse_args()
+
+    if pathlib.Path(args.store).joinpath("bundle.json").exists():
+        source = store_source(args.store)
+    else:
+        source = pickle_source()
+
+    start = time.perf_counter()
+    results = evaluate(source, args.data, args.out, args.jobs, args.force)
+    print("evaluated in %.1f s" % (time.perf_counter() - start))
+    print("%-15s %8s %10s %10s %14s %12s %10s" % ("model", "R2", "RMSE", "MAE", "batch us/row", "row ms", "size MB"))
+    for name, s in results.items():
+        print("%-15s %8.4f %10.2f %10.2f %14.2f %12.3f %10.2f" % (
+            name, s["r2"], s["rmse"], s["mae"], s["batch_latency_us"], s["row_latency_ms"], s["size_bytes"] / 1e6))
@@ -0,0 +1,122 @@
+# Feature encoding for the prediction models
+# -----------------------------------------------------------------------------------------------
+#
+# The models were trained on the matrix produced in the notebook by three
+# OneHotEncoder(drop='first') + pd.concat steps: age, bmi and children first, then the
+# smoker, sex and region dummies with the first (alphabetical) category dropped.
+# FeatureEncoder builds exactly that matrix with plain lookup tables, so the same object
+# can encode the whole dataset at start-up and a single row inside a callback.
+
+import numpy as np
+import pandas as pd
+
+NUMERIC_COLUMNS = ["age", "bmi", "children"]
+CATEGORICAL_COLUMNS = ["smoker", "sex", "region"]
+RAW_COLUMNS = ["age", "sex", "bmi", "children", "smoker", "region"]
+
+# Input domain covered by the training data
+AGE_RANGE = (18, 64)
+CHILDREN_RANGE = (0, 5)
+BMI_RANGE = (15.0, 55.0)
+
+
+class FeatureEncoder:
+
+    def __init__(self, categories):
+        self.categories = {col: list(categories[col]) for col in CATEGORICAL_COLUMNS}
+
+        # value -> column offset of its dummy in the output row (None for the dropped category)
+        self._lookup = {}
+        self.feature_names = list(NUMERIC_COLUMNS)
+        for col in CATEGORICAL_COLUMNS:
+            cats = self.categories[col]
+            offset = len(self.feature_names)
+            self._lookup[col] = {cats[0]: None}
+            for i, cat in enumerate(cats[1:]):
+                self._lookup[col][cat] = offset + i
+            self.feature_names += ["%s_%s" % (col, cat) for cat in cats[1:]]
+
+        self.n_features = len(self.feature_names)
+
+        # category code -> dummy offset, -1 for the dropped category
+        self._code_offsets = {
+            col: np.array([-1 if self._lookup[col][cat] is None else self._lookup[col][cat]
+                           for cat in self.categories[col]], dtype=np.intp)
+            for col in CATEGORICAL_COLUMNS
+        }
+
+    @classmethod
+    def fit(cls, df):
+        return cls({col: sorted(df[col].unique()) for col in CATEGORICAL_COLUMNS})
+
+    def _offsets(self, col, values):
+        # Map a column of category labels to dummy offsets through a hashed category lookup
+        codes = pd.Index(self.categories[col]).get_indexer(values)
+        if (codes < 0).any():
+            unknown = sorted(set(str(v) for v in np.asarray(values)[codes < 0]))
+            raise ValueError("unknown %s value(s): %s" % (col, ", ".join(unknown)))
+        return self._code_offsets[col][codes]
+
+    def transform(self, samples):
+        # samples: DataFrame (or dict of columns) with the raw age/sex/bmi/children/smoker/region columns
+        n = len(samples[NUMERIC_COLUMNS[0]])
+        out = np.zeros((n, self.n_features), dtype=np.float64)
+
+        for i, col in enumerate(NUMERIC_COLUMNS):
+            out[:, i] = np.asarray(samples[col], dtype=np.float64)
+
+        rows = np.arange(n)
+        for col in CATEGORICAL_COLUMNS:
+            offsets = self._offsets(col, samples[col])
+            hot = offsets >= 0
+            out[rows[hot], offsets[hot]] = 1.0
+
+        return out
+
+    def transform_row(self, age, sex, bmi, children, smoker, region):
+        # Single-row fast path used by the prediction callback
+        out = np.zeros((1, self.n_features), dtype=np.float64)
+        out[0, 0] = float(age)
+        out[0, 1] = float(bmi)
+        out[0, 2] = float(children)
+
+        for col, value in (("smoker", smoker), ("sex", sex), ("region", region)):
+            try:
+                offset = self._lookup[col][value]
+            except KeyError:
+                raise ValueError("unknown %s value: %s" % (col, value))
+            if offset is not None:
+                out[0, offset] = 1.0
+
+        return out
+
+
+def random_profiles(encoder, n, seed=0):
+    # Raw profiles drawn uniformly over the training domain, with a continuous BMI
+    rng = np.random.RandomState(seed)
+    profiles = {
+        "age": rng.randint(AGE_RANGE[0], AGE_RANGE[1] + 1, n),
+        "bmi": rng.uniform(BMI_RANGE[0], BMI_RANGE[1], n),
+        "children": rng.randint(CHILDREN_RANGE[0], CHILDREN_RANGE[1] + 1, n),
+    }
+    for col in CATEGORICAL_COLUMNS:
+        profiles[col] = rng.choice(encoder.categories[col], n)
+    return pd.DataFrame(profiles, columns=RAW_COLUMNS)
+
+
+class Scaler:
+    # Fitted StandardScaler statistics without the sklearn object around them
+
+    def __init__(self, mean, scale):
+        self.mean = mean
+        self.scale = scale
+
+    @classmethod
+    def from_estimator(cls, scaler):
+        return cls(scaler.mean_.astype(np.float64), scaler.scale_.astype(np.float64))
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.mean) / self.scale
+
+    def inverse_transform(self, X):
+        return np.asarray(X, dtype=np.float64) * self.scale + self.mean
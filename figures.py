@@ -0,0 +1,621 @@
+# Figures for the Data Analysis, Data Distribution and Models Performance tabs
+# -----------------------------------------------------------------------------------------------
+#
+# Every builder takes an aggregates.DatasetSummary (or, for the Models Performance tab, the scores
+# written by evaluation.py) and returns a go.Figure. The summary is built from the in-memory
+# dataset or streamed a chunk at a time from a file of any size. Building all of them costs a few
+# hundred milliseconds per worker, so `python figures.py` builds them once and writes the
+# serialized JSON to data/figures/, keyed by the SHA-256 of insurance.csv and the model bundle
+# version (and by the size and modification time of an --analysis file, which may be too large to
+# hash). app.py loads that at start-up and only builds figures live when the cache is stale.
+#
+#   python figures.py [--data data/insurance.csv] [--analysis claims.csv] [--store data/models]
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import pathlib
+
+import numpy as np
+import plotly.graph_objs as go
+import plotly.io
+
+import aggregates
+import datasets
+import model_store
+
+PATH = pathlib.Path(__file__).parent
+FIGURES_PATH = PATH.joinpath("data", "figures").resolve()
+
+# General layout for charts
+# -----------------------------------------------------------------------------------------------
+
+# Above this many rows the Data Analysis graphs switch from the raw rows to a density grid and
+# violins drawn from quantile sketches
+GRAPH_POINT_BUDGET = int(os.environ.get("GRAPH_POINT_BUDGET", 20000))
+
+layout = dict(
+    autosize=True,
+    # automargin=True,
+    margin=dict(l=30, r=30, b=20, t=40),
+    hovermode="closest",
+    plot_bgcolor="#1a2229",
+    paper_bgcolor="#2d353c",
+    xaxis = dict(color="#9ba8b4", showgrid=False),
+    yaxis = dict(color="#9ba8b4", showgrid=False),
+    
+    title="Sample Title",
+    titlefont=dict(
+        family='Open Sans',
+        size=18,
+        color='white'
+    ),
+    
+    legend = dict(
+            x=0.16,
+            y=-0.12,
+            traceorder="normal",
+            font=dict(
+                family="Open Sans",
+                size=12,
+                color="#9ba8b4"
+            ),
+            bgcolor="#1a2229",
+            bordercolor="Black",
+            borderwidth=1,
+            orientation='h'
+        )
+)
+
+# Smoker Graph (Data Analysis Tab)
+# -----------------------------------------------------------------------------------------------
+
+SMOKER_LEVELS = {'yes': ('Smoker', '#e8871a'), 'no': ('Non-Smoker', '#00c0c7')}
+
+def add_violin_summary(fig, position, sketch, name, color):
+    # Violin drawn from a KDE outline of a QuantileSketch plus a box from its quartiles
+    grid, density = aggregates.kde(*sketch.buckets())
+    half_width = 0.4 * density / density.max()
+    stats = sketch.box_stats()
+    
+    outline = np.concatenate([position - half_width, (position + half_width)[::-1]])
+    fig.add_trace(go.Scatter(x=outline,
+                             y=np.concatenate([grid, grid[::-1]]),
+                             mode='lines', fill='toself', hoverinfo='skip',
+                             legendgroup=name, name=name,
+                             fillcolor=color, line_color='black',))
+    
+    fig.add_trace(go.Box(x=[position], q1=[stats['q1']], median=[stats['median']], q3=[stats['q3']],
+                         lowerfence=[stats['lowerfence']], upperfence=[stats['upperfence']],
+                         mean=[stats['mean']], width=0.08,
+                         legendgroup=name, name=name,
+                         fillcolor='white', line_color='black',))
+
+
+def smoker_graph(summary):
+    
+    layout_count = copy.deepcopy(layout)
+    
+    fig = go.Figure(layout=layout_count)
+    
+    df = summary.frame()
+    
+    if df is None:
+        
+        # Only the levels present in the data; a file of smokers alone has no 'no' rows
+        levels = [level for level in SMOKER_LEVELS
+                  if level in summary.charges and summary.charges[level].count > 0]
+        for position, level in enumerate(levels):
+            add_violin_summary(fig, position, summary.charges[level], *SMOKER_LEVELS[level])
+        
+        fig.update_layout(xaxis=dict(tickvals=list(range(len(levels))), ticktext=levels))
+    
+    else:
+        
+        fig.add_trace(go.Violin(x=df['smoker'][ df['smoker'] == 'yes' ],
+                                y=df['charges'][ df['smoker'] == 'yes' ],
+                                box_visible=True, opacity=1   ,
+                                legendgroup='Smoker', scalegroup='M', name='Smoker',
+                                fillcolor='#e8871a', line_color='black',))
+        
+        fig.add_trace(go.Violin(x=df['smoker'][ df['smoker'] == 'no' ],
+                                y=df['charges'][ df['smoker'] == 'no' ],
+                                box_visible=True, opacity=1,
+                                legendgroup='Non-Smoker', scalegroup='M', name='Non-Smoker',
+                                fillcolor='#00c0c7', line_color='black',))   
+    
+    fig.update_layout(
+        title = "Smoker and Non-Smoker Charges",
+        title_x=0.5,
+        yaxis_title="Charges",
+        
+        titlefont=dict(
+            family='Open Sans',
+            size=18,
+            color = "#ffffff"
+        ),
+        
+        showlegend = False,
+        
+        yaxis_zeroline=False)
+    
+    return fig
+
+# Age Graph (Data Analysis Tab)
+# -----------------------------------------------------------------------------------------------
+
+def age_graph(summary):
+    
+    layout_count = copy.deepcopy(layout)
+    
+    fig = go.Figure(layout=layout_count)
+    
+    df = summary.frame()
+    
+    if df is None:
+        
+        # Large datasets are drawn as a density grid of people per age and charges band
+        ages, charges, counts = summary.age_charges.grid()
+        fig.add_trace(go.Heatmap(x=ages,
+                                 y=charges,
+                                 z=np.where(counts > 0, counts, None).tolist(),
+                                 colorscale=[[0, '#1a2229'], [1, '#00c0c7']],
+                                 showscale=False,
+                                 hovertemplate='Age %{x}<br>Charges %{y:.0f}<br>%{z} people'
+                                               '<extra></extra>',
+                             ))
+    
+    else:
+        
+        fig.add_trace(go.Scatter(x=df["age"],
+                                 y=df["charges"],
+                                 mode='markers',
+                                 opacity=0.7,
+                                 marker_symbol = "hexagon",
+                                 marker=dict(
+                                     color='#00c0c7',
+                                     size=8,
+                                      line=dict(
+                                          color='black',
+                                          width=0.4
+                                      )
+                                 ),
+                             )),  
+    
+    fig.update_layout(
+        title = "Charges with respect to Age" if df is not None else
+                "Charges with respect to Age (%d people)" % summary.rows,
+        title_x=0.5,
+        xaxis_title="Age",
+        # yaxis_title="Charges",
+        titlefont=dict(
+            family='Open Sans',
+            size=18,
+            color = "#ffffff"
+        ),
+        
+        yaxis_zeroline=False)
+    
+    return fig
+
+# Models Performance Tab
+# -----------------------------------------------------------------------------------------------
+#
+# Built from the held-out scores of evaluation.py ({model name: scores}), best model first
+
+MODEL_LABELS = {"random_forest": "Random Forest", "lasso": "Lasso", "svr": "SVR"}
+
+def score_hovertext(scores):
+    return ("R2 %.4f<br>RMSE %.2f<br>MAE %.2f<br>"
+            "%.1f \u00b5s/row batched, %.2f ms single row<br>%.1f MB"
+            % (scores['r2'], scores['rmse'], scores['mae'], scores['batch_latency_us'],
+               scores['row_latency_ms'], scores['size_bytes'] / 1e6))
+
+# R2 Graph (Models Performance Tab)
+# -----------------------------------------------------------------------------------------------
+
+def rsquared_graph(scores):
+    
+    names = sorted(scores, key=lambda name: -scores[name]['r2'])
+    
+    layout_count = copy.deepcopy(layout)
+    
+    fig = go.Figure(layout=layout_count)
+    
+    fig.add_trace(
+        go.Bar(
+            name='test set',
+            y=[MODEL_LABELS.get(name, name) for name in names],
+            x=[scores[name]['r2'] for name in names],
+            hovertext=[score_hovertext(scores[name]) for name in names],
+            hoverinfo='text',
+            orientation='h',
+            marker=dict(
+                color = '#006064'
+            )
+            
+        ),    
+    )
+    
+    fig.update_layout(
+        title = "R2 Score (Test set)",
+        title_x=0.5,
+        yaxis_title="Model",
+        titlefont=dict(
+            family='Open Sans',
+            size=18,
+            color = "#ffffff"
+        ),
+        showlegend = False,
+        yaxis_zeroline=False
+    )
+    
+    return fig
+
+# RMSE Graph (Models Performance Tab)
+# -----------------------------------------------------------------------------------------------
+
+def rmse_graph(scores):
+    
+    names = sorted(scores, key=lambda name: scores[name]['rmse'])
+    
+    layout_count = copy.deepcopy(layout)
+    
+    fig = go.Figure(layout=layout_count)
+    
+    fig.add_trace(
+        go.Bar(
+            name='test set',
+            x=[MODEL_LABELS.get(name, name) for name in names],
+            y=[scores[name]['rmse'] for name in names],
+            hovertext=[score_hovertext(scores[name]) for name in names],
+            hoverinfo='text',
+            orientation='v',
+            marker=dict(
+                color = '#AC5700'
+            )
+            
+        ),    
+    )
+    
+    fig.update_layout(
+        title = "RMSE (Test set)",
+        title_x=0.5,
+        yaxis_title="Model",
+        titlefont=dict(
+            family='Open Sans',
+            size=18,
+            color = "#ffffff"
+        ),
+        showlegend = False,
+        yaxis_zeroline=False
+    )
+    
+    return fig
+
+# BMI Graph (Data Distribution Tab)
+# -----------------------------------------------------------------------------------------------
+
+def bmi_dist(summary):
+    
+    df = summary.frame()
+    if df is None:
+        bmi_centers, bmi_widths, bmi_counts = summary.bmi.bins()
+    else:
+        bmi_centers, bmi_widths, bmi_counts = aggregates.histogram(df['bmi'].values)
+    
+    layout_count = copy.deepcopy(layout)
+    
+    fig = go.Figure(layout=layout_count)
+    
+    fig.add_trace(
+        go.Bar(
+            x=bmi_centers,
+            y=bmi_counts,
+            width=bmi_widths,
+        ) 
+    )
+    
+    fig.update_layout(
+        title = "BMI Distribution",
+        title_x=0.5,
+        # yaxis_title="Sum",
+        bargap=0,
+        titlefont=dict(
+            family='Open Sans',
+            size=18,
+            color = "#ffffff"
+        ),
+        showlegend = False,
+        yaxis_zeroline=False
+    )
+    
+    return fig
+
+# Age Graph (Data Distribution Tab)
+# -----------------------------------------------------------------------------------------------
+
+def age_dist(summary):
+    
+    age_levels, age_counts = summary.integer_counts('age')
+    
+    layout_count = copy.deepcopy(layout)
+    
+    fig = go.Figure(layout=layout_count)
+    
+    fig.add_trace(
+        go.Bar(
+            x=age_levels,
+            y=age_counts,
+        ) 
+    )
+    
+    fig.update_layout(
+        title = "Age Distribution",
+        title_x=0.5,
+        # yaxis_title="Sum",
+        bargap=0,
+        titlefont=dict(
+            family='Open Sans',
+            size=18,
+            color = "#ffffff"
+        ),
+        showlegend = False,
+        yaxis_zeroline=False
+    )
+    
+    return fig
+
+# Region Graph (Data Distribution Tab)
+# -----------------------------------------------------------------------------------------------
+
+def region_dist(summary):
+    
+    region_levels, region_counts = summary.value_counts('region')
+    
+    layout_count = copy.deepcopy(layout)
+    
+    fig = go.Figure(layout=layout_count)
+    
+    fig.add_trace(
+        go.Bar(
+            x=region_levels,
+            y=region_counts,
+        ) 
+    )
+    
+    fig.update_layout(
+        title = "Region Distribution",
+        title_x=0.5,
+        # yaxis_title="Sum",
+        titlefont=dict(
+            family='Open Sans',
+            size=18,
+            color = "#ffffff"
+        ),
+        showlegend = False,
+        yaxis_zeroline=False
+    )
+    
+    return fig
+
+# Sex Graph (Data Distribution Tab)
+# -----------------------------------------------------------------------------------------------
+
+def sex_dist(summary):
+    
+    sex_levels, sex_counts = summary.value_counts('sex')
+    
+    layout_count = copy.deepcopy(layout)
+    
+    fig = go.Figure(layout=layout_count)
+    
+    fig.add_trace(
+        go.Bar(
+            x=sex_levels,
+            y=sex_counts,
+        ) 
+    )
+    
+    fig.update_layout(
+        title = "Sex Distribution",
+        title_x=0.5,
+        # yaxis_title="Sum",
+        titlefont=dict(
+            family='Open Sans',
+            size=18,
+            color = "#ffffff"
+        ),
+        showlegend = False,
+        yaxis_zeroline=False
+    )
+    
+    return fig
+
+# Children Graph (Data Distribution Tab)
+# -----------------------------------------------------------------------------------------------
+
+def children_dist(summary):
+    
+    children_levels, children_counts = summary.integer_counts('children')
+    
+    layout_count = copy.deepcopy(layout)
+    
+    fig = go.Figure(layout=layout_count)
+    
+    fig.add_trace(
+        go.Bar(
+            x=children_levels,
+            y=children_counts,
+        ) 
+    )
+    
+    fig.update_layout(
+        title = "Children Distribution",
+        title_x=0.5,
+        # yaxis_title="Sum",
+        bargap=0,
+        titlefont=dict(
+            family='Open Sans',
+            size=18,
+            color = "#ffffff"
+        ),
+        showlegend = False,
+        yaxis_zeroline=False
+    )
+    
+    return fig
+
+# Smoker Graph (Data Distribution Tab)
+# -----------------------------------------------------------------------------------------------
+
+def smoker_dist(summary):
+    
+    smoker_levels, smoker_counts = summary.value_counts('smoker')
+    
+    layout_count = copy.deepcopy(layout)
+    
+    fig = go.Figure(layout=layout_count)
+    
+    fig.add_trace(
+        go.Bar(
+            x=smoker_levels,
+            y=smoker_counts,
+        ) 
+    )
+    
+    fig.update_layout(
+        title = "Smoker Distribution",
+        title_x=0.5,
+        # yaxis_title="Sum",
+        titlefont=dict(
+            family='Open Sans',
+            size=18,
+            color = "#ffffff"
+        ),
+        showlegend = False,
+        yaxis_zeroline=False
+    )
+    
+    return fig
+
+
+# Prebuilt Figure Cache
+# -----------------------------------------------------------------------------------------------
+
+# Data Analysis and Data Distribution figures are built from the dataset, Models Performance
+# figures from the evaluation scores
+DATA_FIGURES = {
+    "smoker_graph": smoker_graph,
+    "age_graph": age_graph,
+    "bmi_dist": bmi_dist,
+    "age_dist": age_dist,
+    "region_dist": region_dist,
+    "sex_dist": sex_dist,
+    "children_dist": children_dist,
+    "smoker_dist": smoker_dist,
+}
+
+PERFORMANCE_FIGURES = {
+    "rsquared_graph": rsquared_graph,
+    "rmse_graph": rmse_graph,
+}
+
+FIGURES = dict(DATA_FIGURES, **PERFORMANCE_FIGURES)
+
+
+def figures_version(dataset_version, model_version, analysis_version=None):
+    # The point budget changes what the Data Analysis figures contain, so it is part of the key;
+    # analysis_version identifies the file the Data tabs summarize, if it is not the dataset
+    key = [dataset_version, model_version, GRAPH_POINT_BUDGET]
+    if analysis_version is not None:
+        key.append(analysis_version)
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()[:16]
+
+
+def summarize(data, chunk_rows=200000):
+    # DatasetSummary of an in-memory frame, or of a dataset file read chunk by chunk
+    chunks = [data] if hasattr(data, "columns") else datasets.iter_chunks(data, chunk_rows)
+    return aggregates.summarize(chunks, GRAPH_POINT_BUDGET)
+
+
+def placeholder_figure(title, message):
+    # An empty chart with a message, for figures whose inputs have not been built yet
+    fig = go.Figure(layout=copy.deepcopy(layout))
+    fig.update_layout(title=title, title_x=0.5, xaxis_visible=False, yaxis_visible=False)
+    fig.add_annotation(text=message, showarrow=False, xref="paper", yref="paper", x=0.5, y=0.5,
+                       font=dict(family="Open Sans", size=14, color="#9ba8b4"))
+    return plotly.io.to_json(fig, validate=False).encode()
+
+
+def build_figure(name, data):
+    # data is a DatasetSummary for DATA_FIGURES and the evaluation scores for PERFORMANCE_FIGURES
+    return plotly.io.to_json(FIGURES[name](data), validate=False).encode()
+
+
+def build_figures(summary, scores):
+    figures = {name: build_figure(name, summary) for name in DATA_FIGURES}
+    figures.update((name, build_figure(name, scores)) for name in PERFORMANCE_FIGURES)
+    return figures
+
+
+def save_figures(figures, version, path=FIGURES_PATH):
+    # Written next to the destination and renamed into place, like the model artifacts
+    path = pathlib.Path(path)
+    tmp_path = model_store.staging_path(path)
+
+    for name, data in figures.items():
+        tmp_path.joinpath(name + ".json").write_bytes(data)
+    with open(tmp_path.joinpath("index.json"), "w") as f:
+        json.dump({"version": version, "figures": sorted(figures)}, f, indent=2)
+
+    model_store.move_into_place(tmp_path, path)
+
+
+def load_figures(version, path=FIGURES_PATH):
+    # Serialized figures by name, or None when the cache is missing or was built for other inputs
+    path = pathlib.Path(path)
+    try:
+        with open(path.joinpath("index.json")) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != version:
+        return None
+    return {name: path.joinpath(name + ".json").read_bytes() for name in index["figures"]}
+
+
+if __name__ == "__main__":
+    import time
+
+    import evaluation
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", default=str(PATH.joinpath("data", "insurance.csv")))
+    parser.add_argument("--analysis", default=None,
+                        help="dataset for the Data Analysis and Distribution tabs "
+                             "(default: --data)")
+    parser.add_argument("--store", default=str(model_store.STORE_PATH))
+    parser.add_argument("--out", default=str(FIGURES_PATH))
+    args = parser.parse_args()
+
+    if pathlib.Path(args.store).joinpath("bundle.json").exists():
+        model_version = model_store.load_manifest(args.store)["version"]
+        source = evaluation.store_source(args.store)
+    else:
+        model_version = model_store.pickle_version(*evaluation.PICKLE_FILES.values())
+        source = evaluation.pickle_source()
+
+    # Uses the cached evaluation when there is one for these models and this dataset
+    scores = evaluation.evaluate(source, args.data)
+
+    start = time.perf_counter()
+    analysis_version = datasets.source_key(args.analysis) if args.analysis else None
+    figures = build_figures(summarize(args.analysis or args.data), scores)
+    version = figures_version(evaluation.dataset_digest(args.data), model_version, analysis_version)
+    save_figures(figures, version, args.out)
+    size_kb = sum(len(data) for data in figures.values()) / 1e3
+    print("built %d figures (%.0f KB) in %.2f s, version %s" % (
+        len(figures), size_kb, time.perf_counter() - start, version))
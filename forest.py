@@ -0,0 +1,100 @@
+# Compact Random Forest inference
+# -----------------------------------------------------------------------------------------------
+#
+# A fitted RandomForestRegressor is 1200 separate tree objects. CompactForest flattens all of
+# them into five contiguous node arrays and predicts by walking every tree for every row at
+# once with NumPy fancy indexing, which gives the same numbers as rf_model.predict.
+# The node arrays are saved and memory-mapped through model_store.py.
+
+import numpy as np
+
+# Upper bound on (trees x rows) node indices held in memory during one traversal
+CHUNK_ELEMENTS = 1 << 20
+
+
+class CompactForest:
+
+    def __init__(self, feature, threshold, left, right, value, roots, depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.depth = int(depth)
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    @property
+    def node_count(self):
+        return len(self.feature)
+
+    @classmethod
+    def from_estimator(cls, model):
+        # Accepts a fitted RandomForestRegressor or a GridSearchCV wrapping one
+        forest = getattr(model, "best_estimator_", model)
+        trees = [est.tree_ for est in forest.estimators_]
+
+        node_count = sum(tree.node_count for tree in trees)
+        feature = np.empty(node_count, dtype=np.int32)
+        threshold = np.empty(node_count, dtype=np.float64)
+        left = np.empty(node_count, dtype=np.int32)
+        right = np.empty(node_count, dtype=np.int32)
+        value = np.empty(node_count, dtype=np.float64)
+        roots = np.empty(len(trees), dtype=np.int32)
+
+        offset = 0
+        for i, tree in enumerate(trees):
+            nodes = slice(offset, offset + tree.node_count)
+            own = np.arange(offset, offset + tree.node_count, dtype=np.int32)
+            is_leaf = tree.children_left < 0
+
+            # Leaves point back at themselves, so every row can take exactly `depth` steps
+            feature[nodes] = np.where(is_leaf, 0, tree.feature)
+            threshold[nodes] = np.where(is_leaf, np.inf, tree.threshold)
+            left[nodes] = np.where(is_leaf, own, tree.children_left + offset)
+            right[nodes] = np.where(is_leaf, own, tree.children_right + offset)
+            value[nodes] = tree.value[:, 0, 0]
+            roots[i] = offset
+
+            offset += tree.node_count
+
+        depth = max(tree.max_depth for tree in trees)
+        return cls(feature, threshold, left, right, value, roots, depth)
+
+    def _predict_chunk(self, X):
+        n, n_features = X.shape
+        flat = X.ravel()
+
+        # nodes[t * n + i] is the current node of row i in tree t; only rows that have not
+        # reached a leaf yet are advanced on each step
+        nodes = np.repeat(self.roots, n)
+        offsets = np.tile(np.arange(n, dtype=np.intp) * n_features, self.n_estimators)
+        active = np.arange(len(nodes))
+        while len(active):
+            current = nodes[active]
+            go_left = flat[offsets[active] + self.feature[current]] <= self.threshold[current]
+            current = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = current
+            active = active[self.left[current] != current]
+
+        # A running sum tree by tree reproduces sklearn's accumulation order bit for bit
+        # (a plain sum may switch to pairwise summation)
+        return np.cumsum(self.value[nodes].reshape(self.n_estimators, n), axis=0)[-1] / self.n_estimators
+
+    def predict(self, X):
+        # sklearn trees compare float32 features against float64 thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        rows_per_chunk = max(1, CHUNK_ELEMENTS // self.n_estimators)
+        if len(X) <= rows_per_chunk:
+            return self._predict_chunk(X)
+
+        return np.concatenate([
+            self._predict_chunk(X[start:start + rows_per_chunk])
+            for start in range(0, len(X), rows_per_chunk)
+        ])
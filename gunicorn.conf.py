@@ -0,0 +1,82 @@
+# Production gunicorn settings
+# -----------------------------------------------------------------------------------------------
+#
+# The app (dataset, encoder/scalers, models and every figure) is loaded once in the master and the
+# workers are forked from it. They share those pages copy-on-write instead of each loading its
+# own copy, and a worker (re)start only costs the fork.
+#
+# Before each fork, gc.freeze() moves every object in the master into the permanent generation.
+# The workers' cyclic garbage collector then never walks those objects and so never writes to
+# them. Their reference counts are still written when the objects are used, so pages holding
+# small, hot objects are still copied. The model arrays are memory-mapped from data/models
+# (model_store.py) and stay shared.
+#
+# Workers default to one per available core, since a prediction runs on the CPU. Each worker has
+# GUNICORN_THREADS (default 2) threads: a worker waiting on its model pool or a slow client still
+# serves another request. Both can be set, and any setting on the command line wins:
+#
+#   gunicorn -c gunicorn.conf.py app:server
+#   WEB_CONCURRENCY=4 GUNICORN_THREADS=4 gunicorn -c gunicorn.conf.py app:server
+#   gunicorn -c gunicorn.conf.py -w 2 app:server
+
+import gc
+import importlib
+import math
+import os
+
+
+def cgroup_cpu_quota():
+    # CPUs allowed by a container's CFS quota (cgroup v2, then v1), or None without a quota
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus():
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, int(math.ceil(quota))))
+    return cpus
+
+
+preload_app = True
+workers = int(os.environ.get("WEB_CONCURRENCY", 0)) or available_cpus()
+threads = int(os.environ.get("GUNICORN_THREADS", 2))
+worker_class = "gthread"
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+
+# No collections while the app is imported in the master, so the heap the workers inherit is not
+# full of holes that later allocations would fill (and so copy). Collection is back on before
+# warm_caches, which may stream a large ANALYSIS_DATA file and create plenty of garbage
+gc.disable()
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before the first fork
+    gc.enable()
+    if server.cfg.preload_app:
+        module = importlib.import_module(server.app.app_uri.split(":")[0])
+        warm_caches = getattr(module, "warm_caches", None)
+        if warm_caches is not None:
+            warm_caches()
+    gc.freeze()
+
+
+def pre_fork(server, worker):
+    # Objects the master created since (e.g. for replaced workers) are frozen before each fork
+    gc.freeze()
@@ -0,0 +1,78 @@
+# Successive-halving hyperparameter search
+# -----------------------------------------------------------------------------------------------
+#
+# GridSearchCV fits every candidate on the full training set. HalvingGridSearch first scores all
+# candidates with cross-validation on a small random subset of the rows, keeps the best
+# 1/factor of them, and repeats on a subset `factor` times larger until the last round uses every
+# row. Weak configurations are dropped while they are still cheap to fit, which matters most for
+# the SVR whose fit time grows faster than linearly with the number of rows.
+#
+# scikit-learn 0.22 has no HalvingGridSearchCV, so this is a small version of it built on
+# GridSearchCV. After fit() it exposes best_params_, best_score_, best_estimator_ and predict()
+# like GridSearchCV, so the app and model_store.py load its pickles the same way.
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.model_selection import GridSearchCV, ParameterGrid
+
+
+class HalvingGridSearch:
+
+    def __init__(self, estimator, param_grid, factor=3, min_resources=100, cv=10, n_jobs=None,
+                 random_state=0):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.factor = factor
+        self.min_resources = min_resources
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+
+    def _n_iterations(self, n_candidates, n_rows):
+        # Enough rounds to get down to one candidate, but no round on fewer than min_resources rows
+        by_candidates = int(np.ceil(np.log(n_candidates) / np.log(self.factor))) + 1
+        if n_rows <= self.min_resources:
+            return 1
+        by_resources = int(np.floor(np.log(n_rows / self.min_resources) / np.log(self.factor))) + 1
+        return min(by_candidates, by_resources)
+
+    def fit(self, X, y):
+        X = np.asarray(X)
+        y = np.asarray(y)
+        candidates = list(ParameterGrid(self.param_grid))
+        rows = np.random.RandomState(self.random_state).permutation(len(X))
+        n_iterations = self._n_iterations(len(candidates), len(X))
+
+        # One entry per round: rows used, candidates scored and the best mean CV score
+        self.iterations_ = []
+        for i in range(n_iterations):
+            last = i == n_iterations - 1
+            n_rows = len(X) if last else int(len(X) / self.factor ** (n_iterations - 1 - i))
+            subset = rows[:n_rows]
+
+            # Each candidate as its own one-point grid, so GridSearchCV parallelizes candidates x folds
+            search = GridSearchCV(self.estimator, [{key: [value] for key, value in params.items()}
+                                                   for params in candidates],
+                                  cv=self.cv, n_jobs=self.n_jobs, refit=False)
+            search.fit(X[subset], y[subset])
+            scores = np.asarray(search.cv_results_["mean_test_score"], dtype=np.float64)
+            scores = np.where(np.isnan(scores), -np.inf, scores)
+
+            self.iterations_.append({"n_resources": int(n_rows), "n_candidates": len(candidates),
+                                     "best_score": float(scores.max())})
+            if last:
+                break
+
+            keep = np.argsort(-scores, kind="mergesort")[:max(1, int(np.ceil(len(candidates) / self.factor)))]
+            candidates = [candidates[j] for j in keep]
+
+        best = int(np.argmax(scores))
+        self.best_params_ = candidates[best]
+        self.best_score_ = float(scores[best])
+        self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y)
+        self.n_candidates_ = [it["n_candidates"] for it in self.iterations_]
+        self.n_resources_ = [it["n_resources"] for it in self.iterations_]
+        return self
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
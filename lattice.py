@@ -0,0 +1,167 @@
+# Precomputed prediction lattice
+# -----------------------------------------------------------------------------------------------
+#
+# The discrete inputs only take 47 ages x 6 child counts x 2 sexes x 2 smoker values x 4 regions
+# = 4,512 combinations. At build time the three models are evaluated for every combination on a
+# fine BMI grid and saved as one array next to the model bundle. Serving (PREDICTION_MODE=lattice)
+# is then an index lookup plus linear interpolation along BMI, whatever the forest size or SVR
+# support-vector count. Profiles outside the lattice fall back to the live models.
+#
+# Interpolation only suits models that are smooth in BMI. At build time each model's maximum error
+# against the live model is measured on random held-out profiles. Only models within --tolerance
+# dollars are served from the lattice; the others (in practice the random forest, whose steps give
+# errors in the thousands) keep running live. No lattice is saved if no model is within tolerance.
+#
+#   python lattice.py [--bmi-step 0.1] [--samples 5000] [--tolerance 50]
+
+import argparse
+import pathlib
+import sys
+
+import numpy as np
+import pandas as pd
+
+import model_store
+from features import AGE_RANGE, BMI_RANGE, CHILDREN_RANGE, RAW_COLUMNS, random_profiles
+
+LATTICE_PATH = model_store.STORE_PATH.joinpath("lattice")
+AXES = ["age", "children", "sex", "smoker", "region"]
+
+
+class PredictionLattice:
+
+    def __init__(self, values, categories, bmi_start, bmi_step, bundle_version, models=()):
+        # values[age, children, sex, smoker, region, bmi, model]; models: the ones served from it
+        self.values = values
+        self.models = list(models)
+        self.categories = categories
+        self.bmi_start = float(bmi_start)
+        self.bmi_step = float(bmi_step)
+        self.bundle_version = bundle_version
+        self.bmi_end = self.bmi_start + self.bmi_step * (values.shape[5] - 1)
+        self._indexes = {col: pd.Index(categories[col]) for col in ("sex", "smoker", "region")}
+        self._codes = {col: {cat: i for i, cat in enumerate(categories[col])} for col in ("sex", "smoker", "region")}
+
+    @classmethod
+    def build(cls, bundle, bmi_step=0.1, chunk_rows=50000):
+        ages = np.arange(AGE_RANGE[0], AGE_RANGE[1] + 1)
+        children = np.arange(CHILDREN_RANGE[0], CHILDREN_RANGE[1] + 1)
+        bmis = np.arange(BMI_RANGE[0], BMI_RANGE[1] + bmi_step / 2, bmi_step)
+        categories = bundle.encoder.categories
+
+        axes = [ages, children, categories["sex"], categories["smoker"], categories["region"], bmis]
+        shape = tuple(len(axis) for axis in axes)
+        index = np.indices(shape).reshape(len(shape), -1)
+        grid = pd.DataFrame({col: np.asarray(axis)[idx] for col, axis, idx in zip(AXES + ["bmi"], axes, index)},
+                            columns=RAW_COLUMNS)
+
+        values = np.empty((len(grid), len(model_store.MODEL_NAMES)), dtype=np.float32)
+        for start in range(0, len(grid), chunk_rows):
+            chunk = grid.iloc[start:start + chunk_rows]
+            values[start:start + chunk_rows] = bundle.predict(bundle.encoder.transform(chunk))
+
+        return cls(values.reshape(shape + (-1,)), categories, bmis[0], bmi_step, bundle.version,
+                   model_store.MODEL_NAMES)
+
+    def lookup(self, samples):
+        # Interpolated predictions for a DataFrame of raw profiles, plus a mask of the rows the
+        # lattice covers; uncovered rows are left as NaN
+        age = np.asarray(samples["age"], dtype=np.float64)
+        children = np.asarray(samples["children"], dtype=np.float64)
+        bmi = np.asarray(samples["bmi"], dtype=np.float64)
+        codes = [self._indexes[col].get_indexer(np.asarray(samples[col])) for col in ("sex", "smoker", "region")]
+
+        covered = ((age == np.round(age)) & (age >= AGE_RANGE[0]) & (age <= AGE_RANGE[1])
+                   & (children == np.round(children)) & (children >= CHILDREN_RANGE[0])
+                   & (children <= CHILDREN_RANGE[1]) & (bmi >= self.bmi_start) & (bmi <= self.bmi_end))
+        for code in codes:
+            covered &= code >= 0
+
+        results = np.full((len(age), self.values.shape[-1]), np.nan)
+        rows = np.nonzero(covered)[0]
+        if len(rows):
+            position = (bmi[rows] - self.bmi_start) / self.bmi_step
+            lower = np.minimum(position.astype(np.intp), self.values.shape[5] - 2)
+            weight = (position - lower)[:, None]
+
+            cell = (age[rows].astype(np.intp) - AGE_RANGE[0], children[rows].astype(np.intp) - CHILDREN_RANGE[0],
+                    codes[0][rows], codes[1][rows], codes[2][rows])
+            below = self.values[cell + (lower,)].astype(np.float64)
+            above = self.values[cell + (lower + 1,)].astype(np.float64)
+            results[rows] = below + (above - below) * weight
+
+        return results, covered
+
+    def predict_row(self, age, sex, bmi, children, smoker, region):
+        # Scalar version of lookup(); None when the profile is outside the lattice
+        try:
+            cell = (int(age) - AGE_RANGE[0], int(children) - CHILDREN_RANGE[0], self._codes["sex"][sex],
+                    self._codes["smoker"][smoker], self._codes["region"][region])
+        except KeyError:
+            return None
+        if (age != int(age) or children != int(children) or not 0 <= cell[0] <= AGE_RANGE[1] - AGE_RANGE[0]
+                or not 0 <= cell[1] <= CHILDREN_RANGE[1] - CHILDREN_RANGE[0]
+                or not self.bmi_start <= bmi <= self.bmi_end):
+            return None
+
+        position = (bmi - self.bmi_start) / self.bmi_step
+        lower = min(int(position), self.values.shape[5] - 2)
+        weight = position - lower
+        below = self.values[cell + (lower,)].astype(np.float64)
+        above = self.values[cell + (lower + 1,)].astype(np.float64)
+        return tuple(float(v) for v in below + (above - below) * weight)
+
+    def max_error(self, bundle, n_samples=5000, seed=1):
+        # Interpolation error against the live models on random held-out profiles
+        profiles = random_profiles(bundle.encoder, n_samples, seed)
+        live = bundle.predict(bundle.encoder.transform(profiles))
+        approx, covered = self.lookup(profiles)
+        error = np.abs(approx[covered] - live[covered])
+        return {
+            name: {"max_abs_error": float(error[:, j].max()), "mean_abs_error": float(error[:, j].mean())}
+            for j, name in enumerate(model_store.MODEL_NAMES)
+        }
+
+    def save(self, path=LATTICE_PATH, **meta):
+        model_store.save_artifact(path, "lattice", {"values": self.values}, categories=self.categories,
+                                  bmi_start=self.bmi_start, bmi_step=self.bmi_step,
+                                  bundle_version=self.bundle_version, models=model_store.MODEL_NAMES,
+                                  served_models=self.models, **meta)
+
+    @classmethod
+    def load(cls, path=LATTICE_PATH, mmap_mode="r"):
+        # Lattices saved before the tolerance check have no served_models and serve nothing
+        meta, arrays = model_store.load_artifact(path, mmap_mode)
+        return cls(arrays["values"], meta["categories"], meta["bmi_start"], meta["bmi_step"],
+                   meta["bundle_version"], meta.get("served_models", []))
+
+
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", default=str(model_store.STORE_PATH))
+    parser.add_argument("--bmi-step", type=float, default=0.1)
+    parser.add_argument("--samples", type=int, default=5000, help="held-out profiles for the error report")
+    parser.add_argument("--tolerance", type=float, default=50.0,
+                        help="largest interpolation error in dollars for a model to be served from the lattice")
+    args = parser.parse_args()
+
+    bundle = model_store.load_bundle(args.store)
+
+    start = time.perf_counter()
+    lattice = PredictionLattice.build(bundle, bmi_step=args.bmi_step)
+    print("built %s lattice (%.1f MB) in %.1f s" % ("x".join(str(n) for n in lattice.values.shape),
+                                                  lattice.values.nbytes / 1e6, time.perf_counter() - start))
+
+    errors = lattice.max_error(bundle, args.samples)
+    lattice.models = [name for name in model_store.MODEL_NAMES if errors[name]["max_abs_error"] <= args.tolerance]
+    for name, error in errors.items():
+        print("%-15s max abs error $%.2f, mean abs error $%.2f  %s" % (
+            name, error["max_abs_error"], error["mean_abs_error"],
+            "served from the lattice" if name in lattice.models else "live (over tolerance)"))
+
+    if not lattice.models:
+        print("no model within $%.2f, lattice not saved" % args.tolerance)
+        sys.exit(1)
+    lattice.save(pathlib.Path(args.store).joinpath("lattice"), errors=errors, tolerance=args.tolerance)
@@ -0,0 +1,375 @@
+# Prometheus metrics for the app
+# -----------------------------------------------------------------------------------------------
+#
+# Counters, gauges and histograms kept in plain Python dicts behind one lock, rendered in the
+# Prometheus text format by the /metrics route. Recording a value is a dict lookup, a bisect over
+# the bucket bounds and a few additions (about a microsecond), so the metrics stay on under load.
+#
+# Every gunicorn worker has its own registry. With METRICS_DIR set, each worker also writes a
+# snapshot of its registry to METRICS_DIR/<pid>-<start ms>.json every METRICS_INTERVAL seconds,
+# and /metrics adds up the snapshots of all workers, so one scrape sees the whole server. The start
+# time in the name keeps a worker that reuses an old PID from overwriting the old worker's counts.
+# When a scrape finds the snapshot of a worker that has exited, its counters and histograms are
+# added to METRICS_DIR/retired.json (under a file lock) and its file is deleted. So the totals never
+# go backwards, its gauges (e.g. requests in flight) are dropped, and the directory holds one file
+# per running worker plus one.
+
+import bisect
+import fcntl
+import functools
+import json
+import os
+import pathlib
+import threading
+import time
+
+# Latency buckets in seconds, from 50 us (a cached prediction) to 10 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(self, name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._register(Gauge(self, name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, help, labels, buckets))
+
+    def snapshot(self):
+        # {name: {"type", "help", "labels", "buckets", "values": [[label values, value], ...]}}
+        with self._lock:
+            return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def render(self, snapshots=None):
+        # Prometheus text format of this registry, or of several merged snapshots
+        merged = merge_snapshots([self.snapshot()] if snapshots is None else snapshots)
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            lines.append("# HELP %s %s" % (name, metric["help"]))
+            lines.append("# TYPE %s %s" % (name, metric["type"]))
+            for label_values, value in sorted(metric["values"].items()):
+                labels = list(zip(metric["labels"], label_values))
+                if metric["type"] != "histogram":
+                    lines.append("%s%s %s" % (name, format_labels(labels), format_value(value)))
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(list(metric["buckets"]) + ["+Inf"], counts):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else format_value(bound)
+                    lines.append("%s_bucket%s %d" % (name, format_labels(labels + [("le", le)]), cumulative))
+                lines.append("%s_sum%s %s" % (name, format_labels(labels), format_value(total)))
+                lines.append("%s_count%s %d" % (name, format_labels(labels), cumulative))
+        return "\n".join(lines) + "\n"
+
+
+class Counter:
+
+    type = "counter"
+
+    def __init__(self, registry, name, help, labels):
+        self._lock = registry._lock
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def snapshot(self):
+        return {"type": self.type, "help": self.help, "labels": self.labels,
+                "values": [[list(key), value] for key, value in self._values.items()]}
+
+
+class Gauge(Counter):
+
+    type = "gauge"
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram:
+
+    type = "histogram"
+
+    def __init__(self, registry, name, help, labels, buckets):
+        self._lock = registry._lock
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def time(self, *label_values):
+        return Timer(self, label_values)
+
+    def snapshot(self):
+        return {"type": self.type, "help": self.help, "labels": self.labels, "buckets": self.buckets,
+                "values": [[list(key), [list(counts), total]] for key, (counts, total) in self._values.items()]}
+
+
+class Timer:
+    # with histogram.time(labels...): records the block's wall time
+
+    __slots__ = ("histogram", "label_values", "start")
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+        return False
+
+
+def merge_snapshots(snapshots):
+    # Sums counters, gauges and histogram buckets with the same name and labels
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, values={}))
+            for label_values, value in metric["values"]:
+                key = tuple(label_values)
+                current = target["values"].get(key)
+                if metric["type"] == "histogram":
+                    counts, total = value
+                    if current is not None:
+                        counts = [a + b for a, b in zip(current[0], counts)]
+                        total += current[1]
+                    target["values"][key] = (counts, total)
+                else:
+                    target["values"][key] = value + (current or 0)
+    return merged
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{%s}" % ",".join('%s="%s"' % (key, value) for (key, _), value in zip(labels, escaped))
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Shared Snapshots (several gunicorn workers)
+# -----------------------------------------------------------------------------------------------
+
+RETIRED_FILE = "retired.json"
+
+class SnapshotWriter:
+
+    def __init__(self, registry, directory, interval=5.0):
+        self.registry = registry
+        self.directory = pathlib.Path(directory)
+        self.interval = interval
+        self._pid = None
+        self._name = None
+
+    def ensure_started(self):
+        # Called on every request; starts one writer thread per worker process after the fork
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._name = "%d-%d.json" % (self._pid, time.time() * 1e3)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+        thread.start()
+
+    def write(self):
+        path = self.directory.joinpath(self._name)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except OSError:
+                pass
+
+    def snapshots(self):
+        # This worker's live registry, the last snapshot of every other running worker and the
+        # retired totals of the workers that have exited
+        files = []
+        for path in self.directory.glob("*-*.json"):
+            try:
+                pid, started = (int(part) for part in path.stem.split("-"))
+            except ValueError:
+                continue
+            files.append((path, pid, started))
+        # Of several files with one PID only the newest can belong to a running worker
+        newest = {}
+        for _, pid, started in files:
+            newest[pid] = max(newest.get(pid, started), started)
+
+        dead = [path for path, pid, started in files if started != newest[pid] or not pid_alive(pid)]
+        if dead:
+            self.retire(dead)
+
+        snapshots = [self.registry.snapshot()]
+        for path in [self.directory.joinpath(RETIRED_FILE)] + [path for path, _, _ in files]:
+            if path.name == self._name or path in dead:
+                continue
+            snapshot = read_snapshot(path)
+            if snapshot is not None:
+                snapshots.append(snapshot)
+        return snapshots
+
+    def retire(self, paths):
+        # Adds the counters and histograms of exited workers to the retired totals and deletes their
+        # files; the lock keeps two workers scraping at once from adding a file twice
+        with open(self.directory.joinpath("retired.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            retired_path = self.directory.joinpath(RETIRED_FILE)
+            folded = [read_snapshot(retired_path) or {}]
+            for path in paths:
+                # None once another worker has retired it
+                snapshot = read_snapshot(path)
+                if snapshot is not None:
+                    folded.append({name: metric for name, metric in snapshot.items()
+                                   if metric["type"] != "gauge"})
+            if len(folded) == 1:
+                return
+            tmp_path = retired_path.with_name("%s.%d.tmp" % (retired_path.name, os.getpid()))
+            with open(tmp_path, "w") as f:
+                json.dump(as_snapshot(merge_snapshots(folded)), f)
+            os.replace(tmp_path, retired_path)
+            for path in paths:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def as_snapshot(merged):
+    # merge_snapshots' result back in the format of Registry.snapshot
+    return {name: dict(metric, values=[[list(key), value] for key, value in metric["values"].items()])
+            for name, metric in merged.items()}
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists but belongs to another user
+        return True
+    return True
+
+
+# Instrumentation
+# -----------------------------------------------------------------------------------------------
+
+registry = Registry()
+
+CALLBACK_SECONDS = registry.histogram(
+    "dash_callback_duration_seconds", "Wall time of Dash callbacks.", ["callback", "output"])
+CALLBACK_ERRORS = registry.counter(
+    "dash_callback_errors_total", "Dash callbacks that raised.", ["callback", "output"])
+CALLBACK_IN_FLIGHT = registry.gauge(
+    "dash_callback_in_flight", "Dash callbacks currently running.", ["callback", "output"])
+
+ENCODE_SECONDS = registry.histogram(
+    "feature_encoding_duration_seconds", "Wall time of feature encoding.", ["mode"])
+PREDICT_SECONDS = registry.histogram(
+    "model_predict_duration_seconds", "Wall time of one model's predict, scaling included.", ["model", "mode"])
+
+REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Wall time of HTTP requests by Flask endpoint.", ["endpoint", "status"])
+REQUESTS_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled.")
+
+
+def instrument_callback(name, output):
+    # Decorator for a callback function: latency histogram, call count, errors and in-flight gauge
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            CALLBACK_IN_FLIGHT.inc(name, output)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                CALLBACK_ERRORS.inc(name, output)
+                raise
+            finally:
+                CALLBACK_SECONDS.observe(time.perf_counter() - start, name, output)
+                CALLBACK_IN_FLIGHT.dec(name, output)
+        return wrapper
+    return decorator
+
+
+def init_app(server, directory=None, interval=5.0):
+    # Request timing and the /metrics route on the Flask server
+    from flask import Response, g, request
+
+    writer = SnapshotWriter(registry, directory, interval) if directory else None
+
+    @server.before_request
+    def start_request_timer():
+        if writer is not None:
+            writer.ensure_started()
+        REQUESTS_IN_FLIGHT.inc()
+        g.metrics_start = time.perf_counter()
+
+    @server.teardown_request
+    def stop_request_timer(exc):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return
+        REQUESTS_IN_FLIGHT.dec()
+        status = "500" if exc is not None else getattr(g, "metrics_status", "")
+        REQUEST_SECONDS.observe(time.perf_counter() - start, request.endpoint or "none", status)
+
+    @server.after_request
+    def record_status(response):
+        g.metrics_status = str(response.status_code)
+        return response
+
+    @server.route("/metrics", methods=["GET"])
+    def metrics():
+        text = registry.render(writer.snapshots() if writer is not None else None)
+        return Response(text, mimetype="text/plain; version=0.0.4")
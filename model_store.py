@@ -0,0 +1,388 @@
+# Memory-mapped model artifact store
+# -----------------------------------------------------------------------------------------------
+#
+# Each model is saved as a directory holding a meta.json plus one uncompressed .npy file per
+# numeric array. Loading opens the arrays with mmap_mode="r", so every gunicorn worker on a host
+# maps the same page-cache pages instead of unpickling its own copy of the models.
+#
+# The fitted encoder and scalers are saved in the same store, and bundle.json records a version
+# hash over every artifact so serving always pairs each model with its training-time statistics.
+#
+# CompactForest is the fastest random forest for single rows, but sklearn's compiled trees are
+# several times faster on large batches and release the GIL while they predict. The store keeps the
+# sklearn forest too, as a pickle that is not shared between workers. A bundle loads it on the first
+# batch of at least rf_batch_rows rows (default 500), so it only costs memory in workers that are
+# sent such batches.
+#
+#   python model_store.py            # export data/*.sav and the preprocessing into data/models/
+
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import sys
+import threading
+
+import numpy as np
+
+from features import FeatureEncoder, Scaler
+from forest import CompactForest
+from polynomial import SparseQuadratic
+
+PATH = pathlib.Path(__file__).parent
+STORE_PATH = PATH.joinpath("data", "models").resolve()
+BUNDLE_FORMAT = 2
+
+
+def staging_path(path):
+    # An empty directory next to path, private to this process (workers may write the same artifact)
+    tmp_path = path.with_name("%s.%d.tmp" % (path.name, os.getpid()))
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+    return tmp_path
+
+
+def move_into_place(tmp_path, path):
+    # Replaces path with the staged directory; if another process got there first, its copy is kept
+    if path.exists():
+        old_path = path.with_name("%s.%d.old" % (path.name, os.getpid()))
+        try:
+            path.rename(old_path)
+        except OSError:
+            pass
+        shutil.rmtree(old_path, ignore_errors=True)
+    try:
+        tmp_path.rename(path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def save_artifact(path, kind, arrays, **meta):
+    # Written next to the destination and renamed into place, so readers never see a partial artifact
+    path = pathlib.Path(path)
+    tmp_path = staging_path(path)
+
+    for name, array in arrays.items():
+        np.save(tmp_path.joinpath(name + ".npy"), np.ascontiguousarray(array))
+
+    meta = dict(meta, kind=kind, arrays=sorted(arrays))
+    with open(tmp_path.joinpath("meta.json"), "w") as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+
+    move_into_place(tmp_path, path)
+
+
+def load_artifact(path, mmap_mode="r"):
+    path = pathlib.Path(path)
+    with open(path.joinpath("meta.json")) as f:
+        meta = json.load(f)
+    arrays = {name: np.load(path.joinpath(name + ".npy"), mmap_mode=mmap_mode) for name in meta["arrays"]}
+    return meta, arrays
+
+
+# SVR (GridSearchCV around sklearn.svm.SVR)
+# -----------------------------------------------------------------------------------------------
+
+class CompactSVR:
+
+    def __init__(self, support_vectors, dual_coef, intercept, kernel, gamma, coef0=0.0, degree=3):
+        self.support_vectors = support_vectors
+        self.dual_coef = dual_coef
+        self.intercept = float(intercept)
+        self.kernel = kernel
+        self.gamma = float(gamma)
+        self.coef0 = float(coef0)
+        self.degree = int(degree)
+        self._sv_norms = np.einsum("ij,ij->i", support_vectors, support_vectors)
+
+    @classmethod
+    def from_estimator(cls, model):
+        svr = getattr(model, "best_estimator_", model)
+        if svr.kernel not in ("rbf", "sigmoid", "linear", "poly"):
+            raise ValueError("unsupported SVR kernel: %r" % svr.kernel)
+        return cls(np.asarray(svr.support_vectors_, dtype=np.float64), svr.dual_coef_.ravel().astype(np.float64),
+                   svr.intercept_[0], svr.kernel, svr._gamma, svr.coef0, svr.degree)
+
+    def kernel_matrix(self, X):
+        dot = X @ self.support_vectors.T
+        if self.kernel == "rbf":
+            sq_dist = np.einsum("ij,ij->i", X, X)[:, None] - 2 * dot + self._sv_norms[None, :]
+            return np.exp(-self.gamma * np.maximum(sq_dist, 0))
+        if self.kernel == "sigmoid":
+            return np.tanh(self.gamma * dot + self.coef0)
+        if self.kernel == "poly":
+            return (self.gamma * dot + self.coef0) ** self.degree
+        return dot
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        return self.kernel_matrix(X) @ self.dual_coef + self.intercept
+
+    def save(self, path, **meta):
+        save_artifact(path, "svr", {"support_vectors": self.support_vectors, "dual_coef": self.dual_coef},
+                      intercept=self.intercept, kernel=self.kernel, gamma=self.gamma,
+                      coef0=self.coef0, degree=self.degree, **meta)
+
+    @classmethod
+    def from_artifact(cls, meta, arrays):
+        return cls(arrays["support_vectors"], arrays["dual_coef"], meta["intercept"], meta["kernel"],
+                   meta["gamma"], meta["coef0"], meta["degree"])
+
+
+# Lasso (GridSearchCV around StandardScaler -> PolynomialFeatures -> Lasso)
+# -----------------------------------------------------------------------------------------------
+
+def save_polynomial(model, path):
+    save_artifact(path, "polynomial", {"left": model.left, "right": model.right, "coef": model.coef})
+
+
+def load_polynomial(meta, arrays):
+    return SparseQuadratic(arrays["left"], arrays["right"], arrays["coef"])
+
+
+# Random Forest
+# -----------------------------------------------------------------------------------------------
+
+def save_forest(forest, path):
+    save_artifact(path, "random_forest",
+                  {"feature": forest.feature, "threshold": forest.threshold, "left": forest.left,
+                   "right": forest.right, "value": forest.value, "roots": forest.roots},
+                  depth=forest.depth)
+
+
+def load_forest(meta, arrays):
+    return CompactForest(arrays["feature"], arrays["threshold"], arrays["left"], arrays["right"],
+                         arrays["value"], arrays["roots"], meta["depth"])
+
+
+def save_sklearn_forest(model, path):
+    # The fitted RandomForestRegressor itself, for large batches
+    import joblib
+
+    path = pathlib.Path(path)
+    tmp_path = staging_path(path)
+    joblib.dump(getattr(model, "best_estimator_", model), tmp_path.joinpath("model.joblib"))
+    with open(tmp_path.joinpath("meta.json"), "w") as f:
+        json.dump({"kind": "sklearn_forest", "arrays": []}, f, indent=2, sort_keys=True)
+    move_into_place(tmp_path, path)
+
+
+def load_sklearn_forest(path):
+    import joblib
+
+    forest = joblib.load(pathlib.Path(path).joinpath("model.joblib"))
+    # One thread: gunicorn already runs one worker per core
+    forest.n_jobs = None
+    return forest
+
+
+# Preprocessing (encoder categories, sc_X and sc_y)
+# -----------------------------------------------------------------------------------------------
+
+def split_rows(n_rows, test_size=0.25, random_state=42):
+    # Train/test row indices of the notebook's train_test_split (the shuffle only depends on n_rows)
+    from sklearn.model_selection import train_test_split
+
+    return train_test_split(np.arange(n_rows), test_size=test_size, random_state=random_state)
+
+
+def fit_preprocessing(df, test_size=0.25, random_state=42):
+    # Same split and scaler fit as machine_learning_models.ipynb: the scalers only see X_train
+    from sklearn.preprocessing import StandardScaler
+
+    encoder = FeatureEncoder.fit(df)
+    X = encoder.transform(df)
+    y = df["charges"].values.reshape(-1,1)
+    train, test = split_rows(len(df), test_size, random_state)
+
+    sc_X = Scaler.from_estimator(StandardScaler().fit(X[train]))
+    sc_y = Scaler.from_estimator(StandardScaler().fit(y[train]))
+    return encoder, sc_X, sc_y
+
+
+def save_preprocessing(encoder, sc_X, sc_y, path):
+    save_artifact(path, "preprocessing",
+                  {"x_mean": sc_X.mean, "x_scale": sc_X.scale, "y_mean": sc_y.mean, "y_scale": sc_y.scale},
+                  categories=encoder.categories, feature_names=encoder.feature_names)
+
+
+def load_preprocessing(path):
+    meta, arrays = load_artifact(path, mmap_mode=None)
+    if meta["kind"] != "preprocessing":
+        raise ValueError("not a preprocessing artifact: %s" % path)
+    return (FeatureEncoder(meta["categories"]),
+            Scaler(arrays["x_mean"], arrays["x_scale"]),
+            Scaler(arrays["y_mean"], arrays["y_scale"]))
+
+
+# Store
+# -----------------------------------------------------------------------------------------------
+
+def save_model(model, path):
+    if isinstance(model, CompactForest):
+        save_forest(model, path)
+    elif isinstance(model, SparseQuadratic):
+        save_polynomial(model, path)
+    else:
+        model.save(path)
+
+
+def load_model(path, mmap_mode="r"):
+    meta, arrays = load_artifact(path, mmap_mode)
+    if meta["kind"] == "random_forest":
+        return load_forest(meta, arrays)
+    if meta["kind"] == "svr":
+        return CompactSVR.from_artifact(meta, arrays)
+    if meta["kind"] == "polynomial":
+        return load_polynomial(meta, arrays)
+    raise ValueError("unknown artifact kind: %r" % meta["kind"])
+
+
+def artifact_digest(path):
+    digest = hashlib.sha256()
+    for file_path in sorted(pathlib.Path(path).iterdir()):
+        digest.update(file_path.name.encode())
+        digest.update(file_path.read_bytes())
+    return digest.hexdigest()
+
+
+def write_manifest(store_path, artifacts):
+    store_path = pathlib.Path(store_path)
+    digests = {name: artifact_digest(store_path.joinpath(name)) for name in artifacts}
+    version = hashlib.sha256(json.dumps(digests, sort_keys=True).encode()).hexdigest()[:16]
+
+    manifest = {"format": BUNDLE_FORMAT, "version": version, "artifacts": digests}
+    with open(store_path.joinpath("bundle.json"), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(store_path=STORE_PATH):
+    with open(pathlib.Path(store_path).joinpath("bundle.json")) as f:
+        manifest = json.load(f)
+    if manifest["format"] != BUNDLE_FORMAT:
+        raise ValueError("unsupported model bundle format: %r" % manifest["format"])
+    return manifest
+
+
+def export_store(rf_model, lasso_model, svr_model, preprocessing, store_path=STORE_PATH):
+    store_path = pathlib.Path(store_path)
+    save_preprocessing(*preprocessing, store_path.joinpath("preprocessing"))
+    save_model(CompactForest.from_estimator(rf_model), store_path.joinpath("random_forest"))
+    save_model(SparseQuadratic.from_estimator(lasso_model), store_path.joinpath("lasso"))
+    save_model(CompactSVR.from_estimator(svr_model), store_path.joinpath("svr"))
+    save_sklearn_forest(rf_model, store_path.joinpath("random_forest_sklearn"))
+    return write_manifest(store_path,
+                          ["preprocessing", "random_forest", "lasso", "svr", "random_forest_sklearn"])
+
+
+# Bundle
+# -----------------------------------------------------------------------------------------------
+
+MODEL_NAMES = ["random_forest", "lasso", "svr"]
+
+
+class ModelBundle:
+    # Encoder, scalers and the three models that were trained together
+
+    def __init__(self, version, encoder, sc_X, sc_y, rf_model, lasso_model, svr_model, svr_mode="exact",
+                 rf_batch_path=None, rf_batch_rows=500):
+        self.version = version
+        self.encoder = encoder
+        self.sc_X = sc_X
+        self.sc_y = sc_y
+        self.rf_model = rf_model
+        self.lasso_model = lasso_model
+        self.svr_model = svr_model
+        self.svr_mode = svr_mode
+        # sklearn forest for batches of at least rf_batch_rows rows, loaded on first use
+        self.rf_batch_path = rf_batch_path
+        self.rf_batch_rows = rf_batch_rows
+        self._rf_batch_model = None
+        self._rf_batch_lock = threading.Lock()
+
+    def rf_batch_model(self):
+        with self._rf_batch_lock:
+            if self._rf_batch_model is None:
+                self._rf_batch_model = load_sklearn_forest(self.rf_batch_path)
+            return self._rf_batch_model
+
+    @property
+    def serving_version(self):
+        # Identifies the predictions actually served, which differ when the SVR is approximated
+        return self.version if self.svr_mode == "exact" else "%s+svr-%s" % (self.version, self.svr_mode)
+
+    def predict_model(self, name, encoded):
+        # Charges predicted by one model for an encoded (unscaled) feature matrix
+        if name == "lasso":
+            return np.ravel(self.lasso_model.predict(encoded))
+        model = self.rf_model if name == "random_forest" else self.svr_model
+        large_batch = self.rf_batch_path is not None and len(encoded) >= self.rf_batch_rows
+        if name == "random_forest" and large_batch:
+            model = self.rf_batch_model()
+        return np.ravel(self.sc_y.inverse_transform(model.predict(self.sc_X.transform(encoded))))
+
+    def predict(self, encoded):
+        return np.column_stack([self.predict_model(name, encoded) for name in MODEL_NAMES])
+
+
+def load_bundle(store_path=STORE_PATH, mmap_mode="r", svr_mode="exact", rf_batch_rows=500):
+    # svr_mode="approx" serves the reduced SVR written by svr_approx.py, if it was fit to this SVR;
+    # rf_batch_rows=0 predicts every batch with CompactForest
+    store_path = pathlib.Path(store_path)
+    manifest = load_manifest(store_path)
+    encoder, sc_X, sc_y = load_preprocessing(store_path.joinpath("preprocessing"))
+    models = [load_model(store_path.joinpath(name), mmap_mode) for name in MODEL_NAMES]
+
+    if svr_mode == "approx":
+        approx_path = store_path.joinpath("svr_approx")
+        if not approx_path.exists():
+            raise ValueError("no approximate SVR in %s, run svr_approx.py" % store_path)
+        meta, arrays = load_artifact(approx_path, mmap_mode)
+        if meta.get("svr_digest") != manifest["artifacts"]["svr"]:
+            raise ValueError("approximate SVR in %s was fit to a different SVR, rerun svr_approx.py" % store_path)
+        models[2] = CompactSVR.from_artifact(meta, arrays)
+    elif svr_mode != "exact":
+        raise ValueError("unknown SVR mode: %r" % svr_mode)
+
+    rf_batch_path = None
+    if rf_batch_rows and "random_forest_sklearn" in manifest["artifacts"]:
+        rf_batch_path = store_path.joinpath("random_forest_sklearn")
+    return ModelBundle(manifest["version"], encoder, sc_X, sc_y, *models, svr_mode=svr_mode,
+                       rf_batch_path=rf_batch_path, rf_batch_rows=rf_batch_rows)
+
+
+def pickle_version(*paths):
+    # Version of a pickle bundle: a hash over the pickle files themselves
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(pathlib.Path(path).read_bytes())
+    return "pickle-" + digest.hexdigest()[:16]
+
+
+def load_pickle_bundle(df, rf_path, lasso_path, svr_path):
+    # The notebook's pickles with encoder/scalers refit on its training split
+    import joblib
+
+    encoder, sc_X, sc_y = fit_preprocessing(df)
+    return ModelBundle(pickle_version(rf_path, lasso_path, svr_path), encoder, sc_X, sc_y,
+                       joblib.load(rf_path), joblib.load(lasso_path), joblib.load(svr_path))
+
+
+if __name__ == "__main__":
+    import joblib
+    import pandas as pd
+
+    data_path = PATH.joinpath("data")
+    store_path = pathlib.Path(sys.argv[1]) if len(sys.argv) > 1 else STORE_PATH
+
+    manifest = export_store(joblib.load(data_path.joinpath("random_forest_model.sav")),
+                            joblib.load(data_path.joinpath("lasso_model.sav")),
+                            joblib.load(data_path.joinpath("svr_model.sav")),
+                            fit_preprocessing(pd.read_csv(data_path.joinpath("insurance.csv"))),
+                            store_path)
+    print("exported model bundle %s to %s" % (manifest["version"], store_path))
@@ -0,0 +1,86 @@
+# Sparse quadratic evaluator for the Lasso pipeline
+# -----------------------------------------------------------------------------------------------
+#
+# lasso_model is StandardScaler -> PolynomialFeatures(degree=2) -> Lasso, i.e. a quadratic
+# polynomial of the scaled features. Substituting z = (x - mean) / scale and expanding gives a
+# quadratic polynomial of the raw features, and L1 leaves many of its terms at zero.
+# SparseQuadratic keeps only the non-zero terms as two index arrays into [1, x] and a coefficient
+# vector. For prediction they are scattered into a small upper-triangular matrix Q, and a batch
+# is scored as the row-wise quadratic form [1, x] Q [1, x]^T: one matrix product and one row-wise
+# dot product. Results match lasso_model.predict to float rounding.
+
+import numpy as np
+
+
+class SparseQuadratic:
+
+    def __init__(self, left, right, coef):
+        # prediction = sum_k coef[k] * X1[:, left[k]] * X1[:, right[k]] with X1 = [1, X]
+        self.left = left
+        self.right = right
+        self.coef = coef
+
+        size = int(max(left.max(), right.max())) + 1
+        self._Q = np.zeros((size, size))
+        np.add.at(self._Q, (left, right), coef)
+
+    @property
+    def n_terms(self):
+        return len(self.coef)
+
+    @classmethod
+    def from_terms(cls, mean, scale, powers, coef, intercept):
+        # Fold the scaler into PolynomialFeatures terms (powers) with the given Lasso coefficients
+        mean = np.asarray(mean, dtype=np.float64)
+        scale = np.asarray(scale, dtype=np.float64)
+        powers = np.asarray(powers, dtype=np.int64)
+        if powers.sum(axis=1).max() > 2:
+            raise ValueError("only polynomials up to degree 2 are supported")
+
+        # z_i = a_i * x_i + b_i
+        a = 1.0 / scale
+        b = -mean / scale
+
+        # Dense coefficients over [1, x] x [1, x], upper triangle only
+        n = len(mean)
+        Q = np.zeros((n + 1, n + 1))
+        Q[0, 0] = float(intercept)
+        for term, c in zip(powers, np.asarray(coef, dtype=np.float64)):
+            if c == 0:
+                continue
+            variables = np.repeat(np.arange(n), term)
+            if len(variables) == 0:
+                Q[0, 0] += c
+            elif len(variables) == 1:
+                i = variables[0]
+                Q[0, i + 1] += c * a[i]
+                Q[0, 0] += c * b[i]
+            else:
+                # (a_i x_i + b_i)(a_j x_j + b_j)
+                i, j = variables
+                Q[i + 1, j + 1] += c * a[i] * a[j]
+                Q[0, i + 1] += c * a[i] * b[j]
+                Q[0, j + 1] += c * a[j] * b[i]
+                Q[0, 0] += c * b[i] * b[j]
+
+        left, right = np.nonzero(Q)
+        # The constant term is always kept so the evaluator is never empty
+        if not Q[0, 0]:
+            left, right = np.concatenate([[0], left]), np.concatenate([[0], right])
+        return cls(left.astype(np.intp), right.astype(np.intp), Q[left, right])
+
+    @classmethod
+    def from_estimator(cls, model):
+        # Accepts the fitted Pipeline or a GridSearchCV wrapping it
+        pipe = getattr(model, "best_estimator_", model)
+        scaler, poly, lasso = [step for _, step in pipe.steps]
+        return cls.from_terms(scaler.mean_, scaler.scale_, poly.powers_, lasso.coef_, lasso.intercept_)
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        X1 = np.empty((len(X), len(self._Q)))
+        X1[:, 0] = 1.0
+        X1[:, 1:] = X[:, :len(self._Q) - 1]
+        return np.einsum("ij,ij->i", X1 @ self._Q, X1)
@@ -0,0 +1,300 @@
+# Sampling profiler for callbacks and start-up
+# -----------------------------------------------------------------------------------------------
+#
+# Off unless PROFILE_DIR is set. When it is set, the import of app.py is profiled. So is a fraction
+# PROFILE_RATE (default 0.05) of callback and model calls, each chosen independently.
+#
+# While a sampled call runs, a background thread reads the stack of the thread running it (from
+# sys._current_frames) every PROFILE_INTERVAL seconds (default 0.005) and counts identical stacks.
+# Every PROFILE_FLUSH seconds (default 30) the counts go to PROFILE_DIR/<pid>-<ms>.folded. That is
+# the collapsed-stack format of flamegraph.pl and speedscope: one "label;caller;...;callee count"
+# line per stack, cut at the sampled call and rooted at its label.
+#
+# Nothing is sampled while no sampled call is running. Sampling stops on its own PROFILE_SECONDS
+# (default 600) after the process started, or after a worker was forked from the preloading master.
+# The oldest files are deleted to keep PROFILE_DIR under PROFILE_MAX_MB (default 50). So it is safe
+# to turn on for one worker for a few minutes.
+#
+#   flamegraph.pl PROFILE_DIR/*.folded > profile.svg
+#   python profiling.py PROFILE_DIR [--label predict_profile] [--top 30]
+
+import argparse
+import collections
+import contextlib
+import functools
+import os
+import pathlib
+import random
+import sys
+import threading
+import time
+
+# Distinct stacks kept between two flushes; rarer ones beyond that are counted as "[other]"
+MAX_STACKS = 20000
+
+
+class Session:
+    # One profiled call: the current thread's stack is sampled between start() and stop()
+
+    def __init__(self, profiler, label):
+        self.profiler = profiler
+        self.label = label
+
+    def start(self, root=None):
+        # Stacks are cut below root, so by default they start at the function calling start()
+        self.profiler._enter(self.label, root or sys._getframe(2))
+        return self
+
+    def stop(self):
+        self.profiler._exit()
+
+    def __enter__(self):
+        return self.start(sys._getframe(2))
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+class Profiler:
+
+    def __init__(self, directory, rate=0.05, interval=0.005, flush_interval=30.0, max_bytes=50e6,
+                 seconds=600.0):
+        self.directory = pathlib.Path(directory)
+        self.rate = rate
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+        self._pid = None
+        self._paths = {}
+        # A worker forked from a preloading master samples for its own PROFILE_SECONDS
+        os.register_at_fork(after_in_child=self._restart_deadline)
+
+    def _restart_deadline(self):
+        self.deadline = time.monotonic() + self.seconds
+
+    def _reset(self):
+        # State of the sampler thread, created again in a forked worker
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._active = {}
+        self._counts = collections.Counter()
+        self.samples = 0
+        thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        thread.start()
+
+    def should_sample(self):
+        return random.random() < self.rate and time.monotonic() < self.deadline
+
+    def session(self, label):
+        return Session(self, label)
+
+    def _enter(self, label, frame):
+        if self._pid != os.getpid():
+            self._reset()
+        ident = threading.get_ident()
+        with self._lock:
+            # A sampled call inside another one keeps the outer label and cut
+            self._active.setdefault(ident, [label, frame, 0])[2] += 1
+        self._wake.set()
+
+    def _exit(self):
+        ident = threading.get_ident()
+        with self._lock:
+            entry = self._active[ident]
+            entry[2] -= 1
+            if not entry[2]:
+                del self._active[ident]
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            now = time.monotonic()
+            if now >= next_flush:
+                self.flush()
+                next_flush = now + self.flush_interval
+            if self._active:
+                time.sleep(self.interval)
+                self._sample()
+            else:
+                self._wake.wait(max(0.0, next_flush - now))
+                if self._wake.is_set():
+                    self._wake.clear()
+                    # A random first delay, so calls shorter than the interval are sampled in
+                    # proportion to their length instead of never
+                    time.sleep(random.uniform(0, self.interval))
+                    self._sample()
+
+    def _sample(self):
+        frames = sys._current_frames()
+        with self._lock:
+            for ident, (label, root, _) in self._active.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = self._collapse(label, frame, root)
+                if len(self._counts) >= MAX_STACKS and stack not in self._counts:
+                    stack = label + ";[other]"
+                self._counts[stack] += 1
+                self.samples += 1
+
+    def _collapse(self, label, frame, root):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append("%s (%s:%d)" % (code.co_name, self._short_path(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+            if frame is root:
+                break
+        names.append(label)
+        return ";".join(reversed(names))
+
+    def _short_path(self, filename):
+        # Paths relative to the longest sys.path entry, e.g. sklearn/svm/_base.py
+        short = self._paths.get(filename)
+        if short is None:
+            prefixes = [os.path.join(os.path.abspath(p), "") for p in sys.path]
+            prefixes = [p for p in prefixes if filename.startswith(p)]
+            short = filename[len(max(prefixes, key=len)):] if prefixes else filename
+            self._paths[filename] = short
+        return short
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, collections.Counter()
+        if not counts:
+            return
+        text = "".join("%s %d\n" % item for item in sorted(counts.items())).encode()
+        if len(text) > self.max_bytes:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._trim(self.max_bytes - len(text))
+            path = self.directory.joinpath("%d-%d.folded" % (os.getpid(), time.time() * 1e3))
+            tmp_path = path.with_name(path.name + ".tmp")
+            tmp_path.write_bytes(text)
+            os.replace(str(tmp_path), str(path))
+        except OSError:
+            pass
+
+    def _trim(self, budget):
+        # Deletes the oldest profiles (of any worker) until the rest fit in budget bytes
+        files = []
+        for path in self.directory.glob("*.folded"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= budget:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            total -= size
+
+
+def from_environ(environ=os.environ):
+    directory = environ.get("PROFILE_DIR")
+    if not directory:
+        return None
+    return Profiler(
+        directory,
+        rate=float(environ.get("PROFILE_RATE", 0.05)),
+        interval=float(environ.get("PROFILE_INTERVAL", 0.005)),
+        flush_interval=float(environ.get("PROFILE_FLUSH", 30)),
+        max_bytes=float(environ.get("PROFILE_MAX_MB", 50)) * 1e6,
+        seconds=float(environ.get("PROFILE_SECONDS", 600)),
+    )
+
+
+profiler = from_environ()
+
+_NOT_SAMPLED = contextlib.nullcontext()
+
+
+def sample(label):
+    # with sample(label): ... profiles the block for a PROFILE_RATE fraction of calls
+    if profiler is None or not profiler.should_sample():
+        return _NOT_SAMPLED
+    return profiler.session(label)
+
+
+def profiled(label):
+    # Decorator form of sample()
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if profiler is None or not profiler.should_sample():
+                return func(*args, **kwargs)
+            session = profiler.session(label).start(sys._getframe())
+            try:
+                return func(*args, **kwargs)
+            finally:
+                session.stop()
+        return wrapper
+    return decorator
+
+
+def startup(label="startup"):
+    # Profiles the caller from here until stop() is called and writes the profile right away
+    if profiler is None:
+        return None
+    return profiler.session(label).start(sys._getframe(2))
+
+
+def end_startup(session):
+    if session is not None:
+        session.stop()
+        profiler.flush()
+
+
+# Reading profiles
+# -----------------------------------------------------------------------------------------------
+
+def read_profiles(directory, label=None):
+    # Stack -> samples over every .folded file, optionally only the stacks under one label prefix
+    counts = collections.Counter()
+    for path in sorted(pathlib.Path(directory).glob("*.folded")):
+        with open(path) as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                if stack and (label is None or stack.startswith(label)):
+                    counts[stack] += int(count)
+    return counts
+
+
+def self_time(counts):
+    # Samples in which each function was the innermost frame
+    functions = collections.Counter()
+    for stack, count in counts.items():
+        functions[stack.rpartition(";")[2]] += count
+    return functions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory")
+    parser.add_argument("--label", default=None, help="only stacks whose label starts with this")
+    parser.add_argument("--top", type=int, default=0,
+                        help="print the functions with the most self samples instead of the merged stacks")
+    args = parser.parse_args()
+
+    counts = read_profiles(args.directory, args.label)
+    if not args.top:
+        for stack, count in sorted(counts.items()):
+            print("%s %d" % (stack, count))
+        sys.exit(0)
+
+    total = sum(counts.values())
+    print("%d samples" % total)
+    print("%8s %7s  %s" % ("samples", "share", "function"))
+    for name, count in self_time(counts).most_common(args.top):
+        print("%8d %6.1f%%  %s" % (count, 100.0 * count / total, name))
@@ -0,0 +1,123 @@
+# Per-model prediction for the app with a timeout and a bounded queue
+# -----------------------------------------------------------------------------------------------
+#
+# Each result card has its own callback, so the browser sends one request per model and shows
+# each result as soon as it arrives. Under gunicorn those requests usually land on different
+# workers, so each request runs only its own model. Requests for the same (profile, model) that
+# arrive while it is already running share that one run instead of starting another.
+#
+# The model runs in a small thread pool so that the request can give up after the timeout and
+# leave its card empty. A run nobody is waiting for any more is cancelled if it has not started.
+# One that has started finishes, and `on_complete` still receives its value. At most
+# `max_pending` runs may be queued or running; beyond that a request is rejected at once rather
+# than growing a backlog that could never be served within the timeout.
+
+import concurrent.futures
+import threading
+import time
+from collections import deque
+
+
+class ModelRunner:
+
+    def __init__(self, models, max_workers=None, timeout=None, max_pending=None, on_complete=None):
+        # models: name -> function(key) returning the prediction for a normalized profile
+        # on_complete: function(key, name, value) called with every successful prediction
+        self.models = models
+        self.timeout = timeout
+        self.max_workers = max_workers or len(models)
+        self.max_pending = max_pending or 8 * self.max_workers
+        self.on_complete = on_complete
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        # (key, name) -> [future, number of requests waiting for it]
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        self.timeouts = 0
+        self.errors = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self._timings = {name: deque(maxlen=1000) for name in models}
+
+    def _run(self, key, name):
+        start = time.perf_counter()
+        try:
+            value = self.models[name](key)
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self._timings[name].append(seconds)
+        # Stored before the run leaves _pending, so a request arriving in between finds it
+        # in the cache or joins this run, and never starts the model again
+        if self.on_complete is not None:
+            self.on_complete(key, name, value)
+        return value
+
+    def _finished(self, job, entry):
+        with self._lock:
+            if self._pending.get(job) is entry:
+                del self._pending[job]
+
+    def _join(self, key, name):
+        # The shared run for (key, name), started if needed; None when the queue is full
+        job = (key, name)
+        with self._lock:
+            entry = self._pending.get(job)
+            started = entry is None
+            if started:
+                if len(self._pending) >= self.max_pending:
+                    self.rejected += 1
+                    return None
+                entry = self._pending[job] = [self._executor.submit(self._run, key, name), 0]
+            entry[1] += 1
+        # Outside the lock: a future that is already done runs the callback right here
+        if started:
+            entry[0].add_done_callback(lambda _: self._finished(job, entry))
+        return entry
+
+    def _leave(self, entry, gave_up):
+        with self._lock:
+            entry[1] -= 1
+            abandoned = gave_up and not entry[1]
+        # cancel() also runs the done callbacks, which take the lock
+        if abandoned and entry[0].cancel():
+            with self._lock:
+                self.cancelled += 1
+
+    def result(self, key, name):
+        # Prediction of one model, or None if it failed, did not finish in time or was rejected
+        entry = self._join(key, name)
+        if entry is None:
+            return None
+        gave_up = False
+        try:
+            return entry[0].result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            gave_up = True
+            with self._lock:
+                self.timeouts += 1
+            return None
+        except concurrent.futures.CancelledError:
+            return None
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            return None
+        finally:
+            self._leave(entry, gave_up)
+
+    def stats(self):
+        # Per-model wall time over the most recent predictions, in milliseconds
+        with self._lock:
+            models = {}
+            for name, timings in self._timings.items():
+                ordered = sorted(timings)
+                models[name] = {
+                    "count": len(ordered),
+                    "mean_ms": 1e3 * sum(ordered) / len(ordered) if ordered else 0.0,
+                    "p95_ms": 1e3 * ordered[int(0.95 * (len(ordered) - 1))] if ordered else 0.0,
+                    "max_ms": 1e3 * ordered[-1] if ordered else 0.0,
+                }
+            return {"timeout": self.timeout, "timeouts": self.timeouts, "errors": self.errors,
+                    "rejected": self.rejected, "cancelled": self.cancelled, "max_pending": self.max_pending,
+                    "pending": len(self._pending), "models": models}
@@ -0,0 +1,138 @@
+# Reduced-set approximation of the SVR
+# -----------------------------------------------------------------------------------------------
+#
+# Predicting with the SVR costs one kernel evaluation per support vector, and the number of
+# support vectors grows with the training set. The approximation keeps the SVR's kernel but only a
+# subset of its support vectors, with the weights and intercept refit by least squares to the
+# exact SVR's outputs on the training rows plus random profiles. The subset is chosen greedily
+# (orthogonal matching pursuit over the kernel columns), and the smallest one whose largest
+# deviation from the exact SVR on separate held-out profiles is within the tolerance (in dollars)
+# is kept.
+#
+# KMeans centres as landmarks do much worse here: many dual coefficients sit at +/-C and cancel
+# each other, so the SVR depends on the exact support vector positions.
+#
+# The selection holds the dense (rows x support vectors) kernel matrix and one weight vector per
+# step in memory, so it only tries subsets of up to --max-kept support vectors (default 1000).
+# That suits an SVR with a few thousand support vectors at most; a larger one needs a smaller
+# --max-kept or fewer fit rows.
+#
+# The result is a CompactSVR saved as data/models/svr_approx, so serving only changes which
+# artifact is loaded (SVR_MODE=approx). If no subset meets the tolerance nothing is saved and the
+# command exits with status 1.
+#
+#   python svr_approx.py [--tolerance 50] [--max-kept 1000] [--store data/models]
+
+import argparse
+import pathlib
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import model_store
+from features import RAW_COLUMNS, random_profiles
+
+
+def reference_inputs(bundle, df, n_profiles, seed):
+    # Scaled inputs the approximation is fit or checked on: dataset rows plus random profiles
+    samples = pd.concat([df[RAW_COLUMNS], random_profiles(bundle.encoder, n_profiles, seed)], ignore_index=True)
+    return bundle.sc_X.transform(bundle.encoder.transform(samples))
+
+
+def selection_path(svr, X, max_kept):
+    # Weights for the greedily selected support vectors after 1, 2, ... max_kept steps, plus intercepts
+    from sklearn.linear_model import orthogonal_mp
+
+    K = svr.kernel_matrix(X)
+    target = svr.predict(X)
+    K_mean, target_mean = K.mean(axis=0), target.mean()
+    path = orthogonal_mp(K - K_mean, target - target_mean, n_nonzero_coefs=min(max_kept, K.shape[1] - 1),
+                         return_path=True, precompute=True)
+    return path, target_mean - K_mean @ path
+
+
+def reduce_svr(bundle, df, tolerance=50.0, max_kept=1000, n_fit=20000, n_check=5000):
+    # The smallest reduced SVR within the tolerance and its report, or None and the report
+    svr = bundle.svr_model
+    path, intercepts = selection_path(svr, reference_inputs(bundle, df, n_fit, seed=0), max_kept)
+
+    # Largest deviation (in dollars) from the exact SVR on held-out profiles after each step
+    X_check = reference_inputs(bundle, df, n_check, seed=1)
+    approx_values = svr.kernel_matrix(X_check) @ path + intercepts
+    errors = np.abs(approx_values - svr.predict(X_check)[:, None]) * float(bundle.sc_y.scale[0])
+    max_errors = errors.max(axis=0)
+
+    within = np.nonzero(max_errors <= tolerance)[0]
+    if len(within) == 0:
+        # Nothing smaller meets the tolerance; the report holds the closest subset tried
+        step = int(np.argmin(max_errors))
+        return None, {"support_vectors": len(svr.support_vectors), "kept": int(np.count_nonzero(path[:, step])),
+                      "tolerance": tolerance, "max_deviation": float(max_errors[step]),
+                      "mean_deviation": float(errors[:, step].mean())}
+
+    step = within[0]
+    keep = np.nonzero(path[:, step])[0]
+    approx = model_store.CompactSVR(np.ascontiguousarray(svr.support_vectors[keep]), path[keep, step],
+                                    intercepts[step], svr.kernel, svr.gamma, svr.coef0, svr.degree)
+    return approx, {"support_vectors": len(svr.support_vectors), "kept": len(keep), "tolerance": tolerance,
+                    "max_deviation": float(max_errors[step]), "mean_deviation": float(errors[:, step].mean())}
+
+
+def timings(bundle, approx, X, repeat=200):
+    # Seconds per single-row predict (median) and per row of one batched predict (best of 5)
+    result = {}
+    for label, model in (("exact", bundle.svr_model), ("approx", approx)):
+        single = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            model.predict(X[i:i + 1])
+            single.append(time.perf_counter() - start)
+        batch = []
+        for _ in range(5):
+            start = time.perf_counter()
+            model.predict(X)
+            batch.append(time.perf_counter() - start)
+        result[label] = {"row": float(np.median(single)), "batch_row": min(batch) / len(X)}
+    return result
+
+
+def save_approx(approx, report, bundle_path):
+    # The approximation records the digest of the SVR artifact it was fit to
+    svr_digest = model_store.load_manifest(bundle_path)["artifacts"]["svr"]
+    approx.save(pathlib.Path(bundle_path).joinpath("svr_approx"), svr_digest=svr_digest, report=report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", default=str(model_store.STORE_PATH))
+    parser.add_argument("--data", default=str(model_store.PATH.joinpath("data", "insurance.csv")))
+    parser.add_argument("--tolerance", type=float, default=50.0, help="max deviation from the exact SVR in dollars")
+    parser.add_argument("--max-kept", type=int, default=1000, help="largest subset of support vectors tried")
+    args = parser.parse_args()
+
+    bundle = model_store.load_bundle(args.store)
+    df = pd.read_csv(args.data)
+
+    start = time.perf_counter()
+    approx, report = reduce_svr(bundle, df, args.tolerance, args.max_kept)
+    if approx is None:
+        print("no subset of up to %d of %d support vectors within $%.2f (closest: %d, max $%.2f), "
+              "approximation not saved" % (min(args.max_kept, report["support_vectors"] - 1),
+                                           report["support_vectors"], args.tolerance, report["kept"],
+                                           report["max_deviation"]))
+        sys.exit(1)
+    print("kept %d of %d support vectors (%.1f s)" % (report["kept"], report["support_vectors"],
+                                                      time.perf_counter() - start))
+    print("deviation from the exact SVR: max $%.2f, mean $%.2f (tolerance $%.2f)" % (
+        report["max_deviation"], report["mean_deviation"], args.tolerance))
+
+    times = timings(bundle, approx, reference_inputs(bundle, df, 10000, seed=2))
+    print("single row: %.1f us -> %.1f us (%.1fx)" % (1e6 * times["exact"]["row"], 1e6 * times["approx"]["row"],
+                                                     times["exact"]["row"] / times["approx"]["row"]))
+    print("batched:    %.2f us/row -> %.2f us/row (%.1fx)" % (
+        1e6 * times["exact"]["batch_row"], 1e6 * times["approx"]["batch_row"],
+        times["exact"]["batch_row"] / times["approx"]["batch_row"]))
+
+    save_approx(approx, dict(report, timings=times), args.store)
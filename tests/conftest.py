@@ -0,0 +1,6 @@
+import pathlib
+import sys
+
+ROOT = str(pathlib.Path(__file__).resolve().parent.parent)
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
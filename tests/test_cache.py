@@ -0,0 +1,35 @@
+# PredictionCache: LRU bound, TTL and model-version keys
+
+from cache import PredictionCache
+
+
+def test_lru_eviction():
+    cache = PredictionCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("cache.time.monotonic", lambda: now[0])
+    cache = PredictionCache(ttl=10)
+    cache.put("a", 1)
+    now[0] += 11
+    assert cache.get("a") is None
+    assert cache.expirations == 1
+
+
+def test_entries_belong_to_their_model_version():
+    cache = PredictionCache(version="v1")
+    cache.put("a", 1)
+    cache.version = "v2"
+    assert cache.get("a") is None
+    cache.put("a", 2)
+    cache.set_version("v3")
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
@@ -0,0 +1,31 @@
+# Data Analysis figures drawn from sketches (datasets above the point budget)
+
+import pandas as pd
+
+import aggregates
+from figures import smoker_graph
+
+
+def smokers_only(rows=200):
+    # Every row a smoker, with 'no' still listed as a category, as in a Parquet dictionary
+    return pd.DataFrame({
+        "age": pd.Series([30 + i % 30 for i in range(rows)], dtype="int8"),
+        "sex": pd.Categorical(["male", "female"] * (rows // 2)),
+        "bmi": pd.Series([20 + i % 15 for i in range(rows)], dtype="float32"),
+        "children": pd.Series([i % 4 for i in range(rows)], dtype="int8"),
+        "smoker": pd.Categorical(["yes"] * rows, categories=["no", "yes"]),
+        "region": pd.Categorical(["southwest"] * rows),
+        "charges": [20000.0 + 100 * i for i in range(rows)],
+    })
+
+
+def test_absent_smoker_level_has_no_sketch():
+    summary = aggregates.summarize([smokers_only()], point_budget=0)
+    assert sorted(summary.charges) == ["yes"]
+
+
+def test_smoker_graph_draws_present_levels_only():
+    summary = aggregates.summarize([smokers_only()], point_budget=0)
+    assert summary.frame() is None
+    fig = smoker_graph(summary)
+    assert list(fig.layout.xaxis.ticktext) == ["yes"]
@@ -0,0 +1,73 @@
+# CompactForest against sklearn's own RandomForestRegressor.predict
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.model_selection import GridSearchCV
+
+import forest
+from forest import CompactForest
+
+
+def synthetic(rows, seed=0):
+    # The app's 8 encoded columns: three numeric features and five one-hot ones
+    rng = np.random.RandomState(seed)
+    numeric = rng.normal(size=(rows, 3))
+    onehot = rng.randint(0, 2, size=(rows, 5)).astype(float)
+    X = np.hstack([numeric, onehot])
+    y = 3 * X[:, 0] + X[:, 1] ** 2 + 5 * X[:, 3] * X[:, 4] + rng.normal(scale=0.1, size=rows)
+    return X, y
+
+
+@pytest.fixture(scope="module")
+def fitted():
+    X, y = synthetic(400)
+    return RandomForestRegressor(n_estimators=30, max_depth=12, random_state=0).fit(X, y)
+
+
+def test_matches_sklearn_bit_for_bit(fitted):
+    X, _ = synthetic(1000, seed=1)
+    np.testing.assert_array_equal(CompactForest.from_estimator(fitted).predict(X), fitted.predict(X))
+
+
+def test_single_row_and_chunked_batches(fitted, monkeypatch):
+    X, _ = synthetic(50, seed=2)
+    compact = CompactForest.from_estimator(fitted)
+    np.testing.assert_array_equal(compact.predict(X[0]), fitted.predict(X[:1]))
+
+    # Force several traversal chunks
+    monkeypatch.setattr(forest, "CHUNK_ELEMENTS", 7 * compact.n_estimators)
+    np.testing.assert_array_equal(compact.predict(X), fitted.predict(X))
+
+
+def test_thresholds_between_float32_values(fitted):
+    # Feature values right at the split thresholds, where float32/float64 handling matters
+    compact = CompactForest.from_estimator(fitted)
+    thresholds = compact.threshold[np.isfinite(compact.threshold)]
+    X, _ = synthetic(len(thresholds), seed=3)
+    X[np.arange(len(X)), compact.feature[np.isfinite(compact.threshold)]] = thresholds
+    np.testing.assert_array_equal(compact.predict(X), fitted.predict(X))
+
+
+def test_accepts_grid_search(fitted):
+    X, y = synthetic(200)
+    search = GridSearchCV(RandomForestRegressor(n_estimators=5, random_state=0), {"max_depth": [3]}, cv=2)
+    search.fit(X, y)
+    np.testing.assert_array_equal(CompactForest.from_estimator(search).predict(X), search.predict(X))
+
+
+def test_bundle_predicts_large_batches_with_sklearn(fitted, tmp_path):
+    import model_store
+    from features import Scaler
+
+    model_store.save_sklearn_forest(fitted, tmp_path.joinpath("random_forest_sklearn"))
+    identity = Scaler(np.zeros(8), np.ones(8))
+    bundle = model_store.ModelBundle("test", None, identity, Scaler(np.zeros(1), np.ones(1)),
+                                     CompactForest.from_estimator(fitted), None, None,
+                                     rf_batch_path=tmp_path.joinpath("random_forest_sklearn"), rf_batch_rows=100)
+    X, _ = synthetic(300, seed=4)
+
+    np.testing.assert_array_equal(bundle.predict_model("random_forest", X[:99]), fitted.predict(X[:99]))
+    assert bundle._rf_batch_model is None
+    np.testing.assert_array_equal(bundle.predict_model("random_forest", X), fitted.predict(X))
+    assert bundle._rf_batch_model is not None
@@ -0,0 +1,75 @@
+# metrics.SnapshotWriter: merged worker snapshots, dead workers and PID reuse
+
+import json
+import os
+import subprocess
+import sys
+
+from metrics import Registry, SnapshotWriter
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def worker_snapshot(requests, in_flight):
+    registry = Registry()
+    registry.counter("requests_total", "Requests.").inc(amount=requests)
+    registry.gauge("in_flight", "In flight.").inc(amount=in_flight)
+    return registry.snapshot()
+
+
+def write_snapshot(directory, name, snapshot):
+    directory.joinpath(name).write_text(json.dumps(snapshot))
+
+
+def merged_values(writer):
+    text = writer.registry.render(writer.snapshots())
+    return dict(line.split() for line in text.splitlines() if not line.startswith("#"))
+
+
+def test_live_workers_are_summed(tmp_path):
+    writer = SnapshotWriter(Registry(), tmp_path)
+    writer.ensure_started()
+    write_snapshot(tmp_path, "%d-1.json" % os.getppid(), worker_snapshot(3, 2))
+    values = merged_values(writer)
+    assert values["requests_total"] == "3" and values["in_flight"] == "2"
+
+
+def test_dead_workers_keep_counters_but_not_gauges(tmp_path):
+    writer = SnapshotWriter(Registry(), tmp_path)
+    writer.ensure_started()
+    write_snapshot(tmp_path, "%d-1.json" % os.getppid(), worker_snapshot(3, 2))
+    write_snapshot(tmp_path, "%d-1.json" % dead_pid(), worker_snapshot(5, 4))
+    values = merged_values(writer)
+    assert values["requests_total"] == "8" and values["in_flight"] == "2"
+
+
+def test_reused_pid_keeps_the_old_workers_counts(tmp_path):
+    writer = SnapshotWriter(Registry(), tmp_path)
+    writer.ensure_started()
+    pid = os.getppid()
+    write_snapshot(tmp_path, "%d-1.json" % pid, worker_snapshot(5, 4))
+    write_snapshot(tmp_path, "%d-2.json" % pid, worker_snapshot(3, 2))
+    values = merged_values(writer)
+    assert values["requests_total"] == "8" and values["in_flight"] == "2"
+
+
+def test_dead_workers_are_folded_into_the_retired_totals(tmp_path):
+    writer = SnapshotWriter(Registry(), tmp_path)
+    writer.ensure_started()
+    registry = Registry()
+    registry.counter("requests_total", "Requests.").inc(amount=5)
+    registry.histogram("latency_seconds", "Latency.").observe(0.01)
+    dead = dead_pid()
+    write_snapshot(tmp_path, "%d-1.json" % dead, registry.snapshot())
+    write_snapshot(tmp_path, "%d-2.json" % dead, worker_snapshot(3, 4))
+
+    for _ in range(3):
+        values = merged_values(writer)
+        assert values["requests_total"] == "8"
+        assert values["latency_seconds_count"] == "1"
+        assert "in_flight" not in values
+    assert sorted(path.name for path in tmp_path.glob("*.json")) == ["retired.json"]
@@ -0,0 +1,47 @@
+# SparseQuadratic against the StandardScaler -> PolynomialFeatures -> Lasso pipeline
+
+import numpy as np
+import pytest
+from sklearn.linear_model import Lasso
+from sklearn.model_selection import GridSearchCV
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+from polynomial import SparseQuadratic
+
+
+def synthetic(rows, seed=0):
+    rng = np.random.RandomState(seed)
+    X = np.hstack([rng.uniform(18, 64, (rows, 1)), rng.uniform(15, 50, (rows, 1)),
+                   rng.randint(0, 5, (rows, 1)), rng.randint(0, 2, (rows, 5))]).astype(float)
+    y = 250 * X[:, 0] + 20 * X[:, 1] * X[:, 3] + 3000 * X[:, 4] + rng.normal(scale=100, size=rows)
+    return X, y
+
+
+def pipeline(alpha):
+    return Pipeline([("scalar", StandardScaler()), ("poly", PolynomialFeatures(degree=2)),
+                     ("model", Lasso(alpha=alpha, max_iter=10000))])
+
+
+@pytest.mark.parametrize("alpha", [0.01, 10.0, 500.0])
+def test_matches_pipeline(alpha):
+    X, y = synthetic(500)
+    model = pipeline(alpha).fit(X, y)
+    quadratic = SparseQuadratic.from_estimator(model)
+    X_test, _ = synthetic(1000, seed=1)
+    np.testing.assert_allclose(quadratic.predict(X_test), model.predict(X_test), rtol=1e-9, atol=1e-6)
+    np.testing.assert_allclose(quadratic.predict(X_test[0]), model.predict(X_test[:1]), rtol=1e-9, atol=1e-6)
+
+
+def test_keeps_only_nonzero_terms():
+    X, y = synthetic(500)
+    model = pipeline(500.0).fit(X, y)
+    lasso = model.named_steps["model"]
+    assert SparseQuadratic.from_estimator(model).n_terms <= np.count_nonzero(lasso.coef_) + 1
+
+
+def test_accepts_grid_search():
+    X, y = synthetic(300)
+    search = GridSearchCV(pipeline(1.0), {"model__alpha": [0.1, 1.0]}, cv=2).fit(X, y)
+    np.testing.assert_allclose(SparseQuadratic.from_estimator(search).predict(X), search.predict(X),
+                               rtol=1e-9, atol=1e-6)
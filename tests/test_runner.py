@@ -0,0 +1,72 @@
+# ModelRunner: one run per (profile, model), a bounded queue and timeouts
+
+import threading
+import time
+
+from runner import ModelRunner
+
+
+def test_runs_only_the_requested_model():
+    calls = []
+    runner = ModelRunner({name: (lambda key, name=name: calls.append(name) or 1.0) for name in "abc"})
+    assert runner.result("p", "b") == 1.0
+    assert calls == ["b"]
+
+
+def test_concurrent_requests_share_one_run():
+    release = threading.Event()
+    calls = []
+
+    def model(key):
+        calls.append(key)
+        release.wait()
+        return 2.0
+
+    runner = ModelRunner({"a": model}, timeout=5)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(runner.result("p", "a"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    # Only finish the run once every request has joined it
+    while runner._pending.get(("p", "a"), [None, 0])[1] < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [2.0] * 4
+    assert calls == ["p"]
+
+
+def test_result_is_stored_before_the_run_is_released():
+    stored = {}
+    runner = ModelRunner({"a": lambda key: 3.0},
+                         on_complete=lambda key, name, value: stored.update({(key, name): value}))
+    runner.result("p", "a")
+    assert stored == {("p", "a"): 3.0}
+    assert runner.stats()["pending"] == 0
+
+
+def test_timed_out_runs_are_cancelled_if_not_started():
+    release = threading.Event()
+    runner = ModelRunner({"a": lambda key: release.wait() and 1.0}, max_workers=1, timeout=0.05)
+    assert runner.result("p1", "a") is None     # running, times out and keeps running
+    assert runner.result("p2", "a") is None     # queued behind p1, times out and is cancelled
+    stats = runner.stats()
+    assert stats["timeouts"] == 2 and stats["cancelled"] == 1 and stats["pending"] == 1
+    release.set()
+
+
+def test_full_queue_rejects():
+    release = threading.Event()
+    runner = ModelRunner({"a": lambda key: release.wait() and 1.0}, max_workers=1, max_pending=1,
+                         timeout=0.05)
+    runner.result("p1", "a")
+    assert runner.result("p2", "a") is None
+    assert runner.stats()["rejected"] == 1
+    release.set()
+
+
+def test_errors_leave_the_card_empty():
+    runner = ModelRunner({"a": lambda key: 1 / 0})
+    assert runner.result("p", "a") is None
+    assert runner.stats()["errors"] == 1
@@ -0,0 +1,39 @@
+# train.split_budget: worker shares proportional to cost that never exceed the budget
+
+import pytest
+
+from train import FIT_COST, GRIDS, n_fits, split_budget
+
+COSTS = {"random_forest": 400, "lasso": 10, "svr": 600}
+
+
+@pytest.mark.parametrize("budget", [3, 4, 5, 8, 13, 64])
+def test_split_budget_sums_to_budget(budget):
+    workers = split_budget(budget, COSTS)
+    assert sum(workers.values()) == budget
+    assert min(workers.values()) >= 1
+
+
+def test_split_budget_one_each_when_short():
+    assert split_budget(1, COSTS) == {"random_forest": 1, "lasso": 1, "svr": 1}
+
+
+def test_split_budget_follows_cost():
+    workers = split_budget(64, COSTS)
+    assert workers["svr"] > workers["random_forest"] > workers["lasso"]
+
+
+@pytest.mark.parametrize("budget", [3, 4, 8])
+def test_split_budget_keeps_a_worker_for_cheap_searches(budget):
+    # Costs of the wide grids: the random forest dwarfs the other two
+    workers = split_budget(budget, {"random_forest": 120, "lasso": 3, "svr": 12})
+    assert sum(workers.values()) == budget
+    assert min(workers.values()) >= 1
+
+
+def test_split_budget_wide_grids():
+    costs = {name: n_fits(grid, 10) * FIT_COST[name] for name, grid in GRIDS["wide"].items()}
+    for budget in range(len(costs), 65):
+        workers = split_budget(budget, costs)
+        assert sum(workers.values()) == budget
+        assert min(workers.values()) >= 1
@@ -0,0 +1,356 @@
+# Model training
+# -----------------------------------------------------------------------------------------------
+#
+# The training steps of machine_learning_models.ipynb as a module: the same encoding, split,
+# scalers and grid searches for the random forest, the Lasso pipeline and the SVR.
+#
+# The three GridSearchCV jobs run at the same time and share one joblib worker budget (--jobs),
+# split between them by their number of fits. They use the threading backend: tree building,
+# coordinate descent and libsvm all release the GIL, and the training data is not copied into
+# worker processes. The Lasso pipeline caches its StandardScaler + PolynomialFeatures steps with
+# Pipeline(memory=...), so they are fit once per fold instead of once per alpha and fold.
+#
+# Writes data/random_forest_model.sav, data/lasso_model.sav and data/svr_model.sav, then exports
+# the model store (model_store.py) that the app serves from.
+#
+# --search halving replaces the exhaustive grid search with successive halving (halving.py), and
+# --search compare runs both on the same grids and reports wall time and scores side by side.
+#
+#   python train.py [--jobs 8] [--cv 10] [--grid notebook|full|wide] [--search grid|halving|compare]
+#                   [--no-export]
+
+import argparse
+import concurrent.futures
+import pathlib
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import Lasso
+from sklearn.model_selection import GridSearchCV
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+from sklearn.svm import SVR
+
+import model_store
+from features import FeatureEncoder, Scaler
+from halving import HalvingGridSearch
+
+PATH = pathlib.Path(__file__).parent
+DATA_PATH = PATH.joinpath("data").resolve()
+
+MODEL_FILES = {
+    "random_forest": "random_forest_model.sav",
+    "lasso": "lasso_model.sav",
+    "svr": "svr_model.sav",
+}
+
+# "notebook" is the final grid of each search in the notebook; "full" also sweeps the Lasso
+# alpha range the notebook searched first (np.arange(0.01, 1, 0.005)); "wide" adds a real RF
+# grid and more SVR gammas and Cs, which is only practical with --search halving
+GRIDS = {
+    "notebook": {
+        "random_forest": {
+            "n_estimators": [1200],
+            "max_features": ["auto"],
+            "max_depth": [50],
+            "min_samples_split": [7],
+            "min_samples_leaf": [10],
+            "bootstrap": [True],
+            "criterion": ["mse"],
+            "random_state": [42],
+        },
+        "lasso": {
+            "model__alpha": [0.9949],
+            "model__fit_intercept": [True],
+            "model__tol": [0.0001],
+            "model__max_iter": [5000],
+            "model__random_state": [42],
+        },
+        "svr": {
+            "kernel": ["rbf", "sigmoid"],
+            "gamma": [0.001, 0.01, 0.1, 1, "scale"],
+            "tol": [0.0001],
+            "C": [0.001, 0.01, 0.1, 1, 10, 100],
+        },
+    },
+}
+GRIDS["full"] = dict(GRIDS["notebook"], lasso=dict(GRIDS["notebook"]["lasso"],
+                                                   model__alpha=list(np.arange(0.01, 1, 0.005)) + [0.9949]))
+
+GRIDS["wide"] = {
+    "random_forest": dict(GRIDS["notebook"]["random_forest"],
+                          n_estimators=[300, 600, 1200],
+                          max_features=["auto", "sqrt"],
+                          max_depth=[10, 50, None],
+                          min_samples_split=[2, 7],
+                          min_samples_leaf=[1, 5, 10]),
+    "lasso": GRIDS["full"]["lasso"],
+    "svr": dict(GRIDS["notebook"]["svr"],
+                gamma=[0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1, "scale"],
+                C=[0.001, 0.01, 0.1, 1, 10, 100, 1000]),
+}
+
+# Rough cost of one fit relative to an SVR fit, used to split the worker budget
+FIT_COST = {"random_forest": 40, "lasso": 1, "svr": 1}
+
+
+# Stage Report
+# -----------------------------------------------------------------------------------------------
+
+def rss_mb():
+    # Current resident set size from /proc (Linux), else the process high-water mark
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1e6
+    except OSError:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+class PeakRss:
+    # Highest RSS seen while the block runs, sampled every `interval` seconds by a thread
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._done = threading.Event()
+
+    def _sample(self):
+        while True:
+            self.peak_mb = max(self.peak_mb, rss_mb())
+            if self._done.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self.peak_mb = rss_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, rss_mb())
+        return False
+
+
+def run_stage(report, stage, func, *args):
+    start = time.perf_counter()
+    with PeakRss() as rss:
+        result = func(*args)
+    report.append({"stage": stage, "seconds": time.perf_counter() - start, "peak_mb": rss.peak_mb})
+    return result
+
+
+def print_report(report):
+    # Peak RSS is the process's during each stage; concurrent searches share one process and
+    # have no memory figure of their own
+    print("%-32s %10s %14s" % ("stage", "wall s", "peak RSS MB"))
+    for row in report:
+        peak = "%14.1f" % row["peak_mb"] if row.get("peak_mb") is not None else "%14s" % "-"
+        print("%-32s %10.2f %s" % (row["stage"], row["seconds"], peak))
+
+
+# Data
+# -----------------------------------------------------------------------------------------------
+
+def prepare_data(df, test_size=0.25, random_state=42):
+    # Encoding, split and scalers as in the notebook (and model_store.fit_preprocessing)
+    encoder = FeatureEncoder.fit(df)
+    X = encoder.transform(df)
+    y = df["charges"].values.reshape(-1,1)
+    train, test = model_store.split_rows(len(df), test_size, random_state)
+
+    sc_X = StandardScaler().fit(X[train])
+    sc_y = StandardScaler().fit(y[train])
+    return {
+        "encoder": encoder, "sc_X": sc_X, "sc_y": sc_y,
+        "X_train": X[train], "y_train": y[train], "X_test": X[test], "y_test": y[test],
+    }
+
+
+# Searches
+# -----------------------------------------------------------------------------------------------
+
+def make_search(name, grid, cv, n_jobs, cache_dir=None, search="grid"):
+    if name == "random_forest":
+        estimator = RandomForestRegressor()
+    elif name == "lasso":
+        steps = [
+            ('scalar', StandardScaler()),
+            ('poly', PolynomialFeatures(degree=2)),
+            ('model', Lasso())
+        ]
+        memory = joblib.Memory(cache_dir, verbose=0) if cache_dir else None
+        estimator = Pipeline(steps, memory=memory)
+    elif name == "svr":
+        estimator = SVR()
+    else:
+        raise ValueError("unknown model: %s" % name)
+
+    if search == "halving":
+        return HalvingGridSearch(estimator, grid, cv=cv, n_jobs=n_jobs, random_state=42)
+    return GridSearchCV(estimator, grid, cv=cv, n_jobs=n_jobs)
+
+
+def search_inputs(name, data):
+    # The Lasso pipeline scales its own inputs; the RF and SVR are fit on the scaled data
+    if name == "lasso":
+        return data["X_train"], data["y_train"].ravel()
+    return data["sc_X"].transform(data["X_train"]), data["sc_y"].transform(data["y_train"]).ravel()
+
+
+def n_fits(grid, cv):
+    return int(np.prod([len(values) for values in grid.values()])) * cv
+
+
+def split_budget(budget, costs):
+    # Worker count per search proportional to its cost, at least one each and `budget` in total
+    # (one each when there are more searches than workers)
+    budget = max(budget, len(costs))
+    total = float(sum(costs.values()))
+    shares = {name: budget * cost / total for name, cost in costs.items()}
+    workers = {name: max(1, int(share)) for name, share in shares.items()}
+    while sum(workers.values()) < budget:
+        workers[max(shares, key=lambda name: shares[name] - workers[name])] += 1
+    while sum(workers.values()) > budget:
+        # Only from searches that keep at least one worker
+        over = [name for name in workers if workers[name] > 1]
+        workers[max(over, key=lambda name: workers[name] - shares[name])] -= 1
+    return workers
+
+
+def _fit_search(name, search, X, y):
+    # Each search runs in its own thread; the backend setting is thread-local
+    start = time.perf_counter()
+    with joblib.parallel_backend("threading"):
+        search.fit(X, y)
+    return search, time.perf_counter() - start
+
+
+def fit_searches(data, grids, cv, jobs, cache_dir, report, search="grid"):
+    budget = joblib.cpu_count() if jobs is None or jobs < 0 else jobs
+    workers = split_budget(budget, {name: n_fits(grid, cv) * FIT_COST[name] for name, grid in grids.items()})
+
+    searches = {name: make_search(name, grid, cv, workers[name], cache_dir, search) for name, grid in grids.items()}
+    start = time.perf_counter()
+    with PeakRss() as rss, concurrent.futures.ThreadPoolExecutor(max_workers=len(searches)) as executor:
+        futures = {name: executor.submit(_fit_search, name, search, *search_inputs(name, data))
+                   for name, search in searches.items()}
+        results = {name: future.result() for name, future in futures.items()}
+
+    for name, (_, seconds) in results.items():
+        report.append({"stage": "%s %s (%d jobs)" % (search, name, workers[name]), "seconds": seconds,
+                       "peak_mb": None, "model": name, "search": search})
+    report.append({"stage": "%s searches (concurrent)" % search, "seconds": time.perf_counter() - start,
+                   "peak_mb": rss.peak_mb})
+    return {name: search for name, (search, _) in results.items()}
+
+
+def test_scores(models, data):
+    scores = {}
+    y_test = data["y_test"].ravel()
+    for name, model in models.items():
+        if name == "lasso":
+            y_pred = model.predict(data["X_test"])
+        else:
+            y_pred = data["sc_y"].inverse_transform(model.predict(data["sc_X"].transform(data["X_test"])).reshape(-1,1))
+        residuals = y_test - np.ravel(y_pred)
+        scores[name] = {
+            "cv": float(model.best_score_),
+            "r2": float(1 - np.sum(residuals ** 2) / np.sum((y_test - y_test.mean()) ** 2)),
+            "rmse": float(np.sqrt(np.mean(residuals ** 2))),
+            "best_params": model.best_params_,
+        }
+    return scores
+
+
+def save_models(models, out_path=DATA_PATH):
+    out_path = pathlib.Path(out_path)
+    for name, model in models.items():
+        joblib.dump(model, out_path.joinpath(MODEL_FILES[name]))
+
+
+def export_models(models, data, store_path=model_store.STORE_PATH):
+    preprocessing = (data["encoder"], Scaler.from_estimator(data["sc_X"]), Scaler.from_estimator(data["sc_y"]))
+    return model_store.export_store(models["random_forest"], models["lasso"], models["svr"], preprocessing,
+                                    store_path)
+
+
+def train(df, grids, cv=10, jobs=-1, report=None, search="grid"):
+    report = [] if report is None else report
+    data = run_stage(report, "prepare data", prepare_data, df)
+
+    cache_dir = tempfile.mkdtemp(prefix="train-cache-")
+    try:
+        models = fit_searches(data, grids, cv, jobs, cache_dir, report, search)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    for model in models.values():
+        drop_memory(model)
+    return models, data
+
+
+def drop_memory(search):
+    # The Pipeline's cache directory is deleted above, so the saved models must not refer to it
+    for estimator in (search.estimator, getattr(search, "best_estimator_", None)):
+        if isinstance(estimator, Pipeline):
+            estimator.set_params(memory=None)
+
+
+def compare_searches(df, grids, cv=10, jobs=-1):
+    # Exhaustive and successive-halving search on the same grids, one model at a time so each
+    # search gets the whole worker budget and its own wall time; nothing is saved
+    rows = []
+    for name, grid in grids.items():
+        for search in ("grid", "halving"):
+            report = []
+            models, data = train(df, {name: grid}, cv, jobs, report, search)
+            seconds = [row["seconds"] for row in report if row.get("model") == name][0]
+            rows.append(dict(test_scores(models, data)[name], model=name, search=search, seconds=seconds))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", default=str(DATA_PATH.joinpath("insurance.csv")))
+    parser.add_argument("--out", default=str(DATA_PATH), help="directory for the .sav files")
+    parser.add_argument("--store", default=str(model_store.STORE_PATH))
+    parser.add_argument("--grid", choices=sorted(GRIDS), default="notebook")
+    parser.add_argument("--cv", type=int, default=10)
+    parser.add_argument("--jobs", type=int, default=-1, help="worker budget shared by the three searches")
+    parser.add_argument("--search", choices=["grid", "halving", "compare"], default="grid")
+    parser.add_argument("--no-export", action="store_true", help="only write the .sav files")
+    args = parser.parse_args()
+
+    report = []
+    df = run_stage(report, "load data", pd.read_csv, args.data)
+
+    if args.search == "compare":
+        print("%-15s %-8s %10s %10s %10s %12s" % ("model", "search", "wall s", "best CV", "R2 (test)", "RMSE"))
+        for row in compare_searches(df, GRIDS[args.grid], args.cv, args.jobs):
+            print("%-15s %-8s %10.1f %10.4f %10.4f %12.2f" % (row["model"], row["search"], row["seconds"],
+                                                             row["cv"], row["r2"], row["rmse"]))
+        sys.exit(0)
+
+    models, data = train(df, GRIDS[args.grid], args.cv, args.jobs, report, args.search)
+
+    for name, scores in test_scores(models, data).items():
+        print("%-15s CV %.4f  R2 (test) %.4f  RMSE %.2f  %s" % (name, scores["cv"], scores["r2"], scores["rmse"],
+                                                              scores["best_params"]))
+
+    run_stage(report, "save .sav files", save_models, models, args.out)
+    if not args.no_export:
+        manifest = run_stage(report, "export model store", export_models, models, data, args.store)
+        print("exported model bundle %s to %s" % (manifest["version"], args.store))
+
+    print_report(report)